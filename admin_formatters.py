@@ -113,6 +113,7 @@ def fmt_admin_report(all_users_from_api: list, db_manager) -> str:
     online_deadline = now_utc - timedelta(minutes=3)
 
     db_users_map = {u['uuid']: u.get('created_at') for u in db_manager.all_active_uuids()}
+    daily_usage_map = db_manager.get_usage_since_midnight_all_by_uuid()
 
     for user_info in all_users_from_api:
         breakdown = user_info.get('breakdown', {})
@@ -129,15 +130,14 @@ def fmt_admin_report(all_users_from_api: list, db_manager) -> str:
             if is_on_marzban: active_marzban_users += 1
 
         if user_info.get('uuid'):
-            daily_usage_dict = db_manager.get_usage_since_midnight_by_uuid(user_info['uuid'])
+            daily_usage_dict = daily_usage_map.get(user_info['uuid'], {})
             total_daily_hiddify += daily_usage_dict.get('hiddify', 0.0)
             total_daily_marzban += daily_usage_dict.get('marzban', 0.0)
         else:
             daily_usage_dict = {}
 
         if user_info.get('is_active') and user_info.get('last_online') and isinstance(user_info.get('last_online'), datetime) and user_info['last_online'].astimezone(pytz.utc) >= online_deadline:
-            user_info['daily_usage_dict'] = daily_usage_dict
-            online_users.append(user_info)
+            online_users.append({**user_info, 'daily_usage_dict': daily_usage_dict})
 
         expire_days = user_info.get('expire')
         if expire_days is not None:
@@ -538,4 +538,23 @@ def fmt_user_payment_history(payments: list, user_name: str, page: int) -> str:
         line = f"`•` 💳 تاریخ ثبت: `{shamsi_datetime}`"
         lines.append(line)
 
-    return "\n".join(lines)
\ No newline at end of file
+    return "\n".join(lines)
+
+
+def fmt_scheduler_stats(jobs: list) -> str:
+    """وضعیت جاب‌های زمان‌بندی شده (job_scheduler.stats())."""
+    if not jobs:
+        return escape_markdown("هیچ جابی ثبت نشده است.")
+
+    lines = [f"*⏱ {escape_markdown('وضعیت جاب‌های زمان‌بندی شده')}*", "`────────────────────────────`"]
+    for job in jobs:
+        status = "🔄" if job['running'] else ("❌" if job['last_error'] else "✅")
+        last_duration = f"{job['last_duration']:.1f}s" if job['last_duration'] is not None else "-"
+        avg_duration = f"{job['avg_duration']:.1f}s" if job['avg_duration'] is not None else "-"
+        lines.append(f"{status} *{escape_markdown(job['name'])}* `{escape_markdown(job['trigger'])}`")
+        lines.append(f"   آخرین اجرا: `{escape_markdown(format_shamsi_tehran(job['last_started']))}` \\({escape_markdown(last_duration)}\\)")
+        lines.append(f"   اجرای بعدی: `{escape_markdown(format_shamsi_tehran(job['next_run']))}`")
+        lines.append(f"   اجراها: `{job['runs']}` \\| خطا: `{job['failures']}` \\| هم‌پوشانی: `{job['overlaps']}` \\| میانگین: `{escape_markdown(avg_duration)}`")
+        if job['last_error']:
+            lines.append(f"   خطا: `{escape_markdown(job['last_error'][:100])}`")
+    return "\n".join(lines)
@@ -48,21 +48,34 @@ def json_datetime_serializer(obj):
         return obj.isoformat()
     raise TypeError(f"Type {type(obj)} not serializable")
 
+def _write_json_pages(f, pages) -> int:
+    """Writes the pages as one JSON array, a record at a time (the full list is never held in memory)."""
+    count = 0
+    f.write("[")
+    for page in pages:
+        for user in page:
+            f.write(",\n    " if count else "\n    ")
+            f.write(json.dumps(dict(user), ensure_ascii=False, indent=4, default=json_datetime_serializer).replace("\n", "\n    "))
+            count += 1
+    f.write("\n]" if count else "]")
+    return count
+
 def _handle_marzban_backup_request(call):
     chat_id, msg_id = call.from_user.id, call.message.message_id
     bot.answer_callback_query(call.id, "در حال دریافت اطلاعات...")
     _safe_edit(chat_id, msg_id, "⏳ در حال دریافت لیست کاربران از پنل فرانسه...")
+    backup_filename = f"marzban_backup_{datetime.now().strftime('%Y-%m-%d')}.json"
     try:
-        marzban_users = marzban_handler.get_all_users()
-        if not marzban_users:
+        with open(backup_filename, 'w', encoding='utf-8') as f:
+            user_count = _write_json_pages(f, marzban_handler.iter_user_pages())
+        if not user_count:
             _safe_edit(chat_id, msg_id, "❌ هیچ کاربری در پنل فرانسه یافت نشد.", reply_markup=menu.admin_backup_selection_menu())
             return
-        backup_filename = f"marzban_backup_{datetime.now().strftime('%Y-%m-%d')}.json"
-        with open(backup_filename, 'w', encoding='utf-8') as f:
-            json.dump(marzban_users, f, ensure_ascii=False, indent=4, default=json_datetime_serializer)
         with open(backup_filename, "rb") as backup_file:
-            bot.send_document(chat_id, backup_file, caption=f"✅ فایل پشتیبان کاربران پنل فرانسه ({len(marzban_users)} کاربر).")
-        os.remove(backup_filename)
+            bot.send_document(chat_id, backup_file, caption=f"✅ فایل پشتیبان کاربران پنل فرانسه ({user_count} کاربر).")
     except Exception as e:
         logger.error(f"Marzban backup failed: {e}")
         _safe_edit(chat_id, msg_id, f"❌ خطای ناشناخته: {escape_markdown(e)}", reply_markup=menu.admin_backup_selection_menu())
+    finally:
+        if os.path.exists(backup_filename):
+            os.remove(backup_filename)
@@ -1,16 +1,14 @@
 import logging
-import time
 from telebot import types
 import pytz
 from datetime import datetime, timedelta
-import re
 
 from database import db
 from hiddify_api_handler import hiddify_handler
 from marzban_api_handler import marzban_handler
 from menu import menu
+from broadcast_runner import broadcast_runner
 from utils import _safe_edit, escape_markdown 
-from telebot.apihelper import ApiTelegramException
 
 logger = logging.getLogger(__name__)
 bot, admin_conversations = None, None
@@ -82,29 +80,14 @@ def _send_broadcast(message: types.Message):
 
     unique_targets = set(target_user_ids) - {admin_id}
     
+    status_text = f"⏳ شروع ارسال پیام برای {len(unique_targets)} کاربر..."
     if original_msg_id:
-        _safe_edit(admin_id, original_msg_id, f"⏳ شروع ارسال پیام برای {len(unique_targets)} کاربر...", parse_mode=None, reply_markup=None)
-
-    success_count, fail_count = 0, 0
-    for user_id in unique_targets:
-        try:
-            bot.copy_message(chat_id=user_id, from_chat_id=admin_id, message_id=message.message_id)
-            success_count += 1
-        except ApiTelegramException as e:
-            if 'flood control' in e.description.lower():
-                retry_after = int(re.search(r'retry after (\d+)', e.description).group(1))
-                logger.warning(f"Flood control triggered. Sleeping for {retry_after} seconds.")
-                time.sleep(retry_after)
-                try:
-                    bot.copy_message(chat_id=user_id, from_chat_id=admin_id, message_id=message.message_id)
-                    success_count += 1
-                except Exception as retry_e:
-                    logger.error(f"Failed to send broadcast to {user_id} after flood wait: {retry_e}")
-                    fail_count += 1
-            else:
-                logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
-                fail_count += 1
-        except Exception as e:
-            logger.error(f"An unexpected error occurred sending to {user_id}: {e}")
-            fail_count += 1
+        _safe_edit(admin_id, original_msg_id, status_text, parse_mode=None, reply_markup=None)
+    else:
+        original_msg_id = bot.send_message(admin_id, status_text).message_id
 
+    # The job and its targets are persisted, so the runner can resume it after a restart
+    job_id = db.create_broadcast_job(admin_id, admin_id, message.message_id, target_group,
+                                     sorted(unique_targets), status_message_id=original_msg_id)
+    logger.info(f"Broadcast job {job_id} created by admin {admin_id} for {len(unique_targets)} users.")
+    broadcast_runner.enqueue(job_id)
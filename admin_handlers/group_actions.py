@@ -105,17 +105,21 @@ def _apply_group_action(message: types.Message):
     add_gb = value if action_type == 'add_gb' else 0
     add_days = int(value) if action_type == 'add_days' else 0
 
-    success_count, fail_count = 0, 0
-    for user in target_users:
-        identifier = user.get('uuid') or user.get('username')
-        if combined_handler.modify_user_on_all_panels(identifier, add_gb=add_gb, add_days=add_days):
-            success_count += 1
-        else:
-            fail_count += 1
+    def report_progress(done: int, total: int, failed: int) -> None:
+        _safe_edit(uid, msg_id, f"⏳ در حال اجرای دستور روی *{total}* کاربر\\.\\.\\.\n\n"
+                                f"انجام شده: *{done}* از *{total}* \\(ناموفق: *{failed}*\\)")
+
+    summary = combined_handler.bulk_modify_users(target_users, add_gb=add_gb, add_days=add_days,
+                                                 on_progress=report_progress)
 
     final_text = (f"✅ عملیات گروهی با موفقیت انجام شد.\n\n"
-                  f"به *{success_count}* کاربر اعمال شد.\n"
-                  f"عملیات برای *{fail_count}* کاربر ناموفق بود.")
+                  f"به *{summary['succeeded']}* کاربر اعمال شد.\n"
+                  f"عملیات برای *{summary['failed']}* کاربر ناموفق بود.")
+    failed_names = [r['name'] or identifier for identifier, r in summary['results'].items() if not r['ok']]
+    if failed_names:
+        shown = ", ".join(escape_markdown(str(name)) for name in failed_names[:10])
+        more = f" و {len(failed_names) - 10} کاربر دیگر" if len(failed_names) > 10 else ""
+        final_text += f"\n\nناموفق: {shown}{more}"
     _safe_edit(uid, msg_id, final_text, reply_markup=menu.admin_panel())
 
 def handle_select_action_type(call, params):
@@ -11,8 +11,9 @@ from admin_formatters import (
     fmt_users_list, fmt_panel_users_list, fmt_online_users_list,
     fmt_top_consumers, fmt_bot_users_list, fmt_birthdays_list,
     fmt_hiddify_panel_info, fmt_marzban_system_stats, fmt_users_by_plan_list,
-    fmt_payments_report_list 
+    fmt_payments_report_list, fmt_scheduler_stats
 )
+from job_scheduler import job_scheduler
 from utils import _safe_edit, load_service_plans, parse_volume_string, escape_markdown
 
 logger = logging.getLogger(__name__)
@@ -57,6 +58,11 @@ def handle_marzban_system_stats(call, params):
     kb = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin:analytics_menu:marzban"))
     _safe_edit(call.from_user.id, call.message.message_id, text, reply_markup=kb)
 
+def handle_scheduler_stats(call, params):
+    text = fmt_scheduler_stats(job_scheduler.stats())
+    kb = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin:system_status_menu"))
+    _safe_edit(call.from_user.id, call.message.message_id, text, reply_markup=kb)
+
 def handle_paginated_list(call, params):
     list_type, panel, page = params[0], params[1] if len(params) > 2 else None, int(params[-1])
     
@@ -72,12 +78,10 @@ def handle_paginated_list(call, params):
     elif list_type == "online_users":
         deadline = datetime.now(pytz.utc) - timedelta(minutes=3)
         online_users = [u for u in all_panel_users if u.get('is_active') and isinstance(u.get('last_online'), datetime) and u['last_online'].astimezone(pytz.utc) >= deadline]
-        for user in online_users:
-            if user.get('uuid'):
-                user['daily_usage_GB'] = sum(db.get_usage_since_midnight_by_uuid(user['uuid']).values())
-            else:
-                user['daily_usage_GB'] = 0
-        users = online_users
+        daily_usage_map = db.get_usage_since_midnight_all_by_uuid() if online_users else {}
+        # Copies: the panel records are shared with panel_cache and must not be changed here
+        users = [{**user, 'daily_usage_GB': sum(daily_usage_map.get(user['uuid'], {}).values()) if user.get('uuid') else 0}
+                 for user in online_users]
     elif list_type == "active_users":
         deadline = datetime.now(pytz.utc) - timedelta(days=1)
         users = [u for u in all_panel_users if u.get('last_online') and u['last_online'].astimezone(pytz.utc) >= deadline]
@@ -138,7 +138,7 @@ def apply_user_edit(msg: types.Message):
 def handle_toggle_status(call, params):
     # تغيير: پانل از شناسه استخراج می‌شود
     identifier = params[0]
-    info = combined_handler.get_combined_user_info(identifier)
+    info = combined_handler.get_combined_user_info(identifier, force_refresh=True)
     if not info:
         bot.answer_callback_query(call.id, "❌ کاربر یافت نشد.", show_alert=True)
         return
@@ -152,6 +152,7 @@ def handle_toggle_status(call, params):
     if 'marzban' in info.get('breakdown', {}):
         m_success = combined_handler.marzban_handler.modify_user(info['name'],
                                                                  data={'status': 'active' if new_status else 'disabled'})
+    combined_handler.invalidate_user_info(identifier)
 
     if h_success and m_success:
         bot.answer_callback_query(call.id, "✅ وضعیت با موفقیت تغییر کرد.")
@@ -219,6 +220,7 @@ def handle_reset_usage_action(call, params):
 
     if panel_to_reset in ['marzban', 'both'] and 'marzban' in info.get('breakdown', {}):
         m_success = combined_handler.marzban_handler.reset_user_usage(info['name'])
+    combined_handler.invalidate_user_info(identifier)
 
     if h_success and m_success:
         if uuid_id_in_db:
@@ -118,6 +118,7 @@ ADMIN_CALLBACK_HANDLERS = {
     # Reporting & Analytics
     "health_check": reporting.handle_health_check,
     "marzban_stats": reporting.handle_marzban_system_stats,
+    "scheduler_stats": reporting.handle_scheduler_stats,
     "list": reporting.handle_paginated_list,
     "report_by_plan_select": reporting.handle_report_by_plan_selection,
     "list_by_plan": reporting.handle_list_users_by_plan,
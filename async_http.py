@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import API_TIMEOUT, API_RETRY_COUNT, PANEL_HTTP_CONCURRENCY, PANEL_STREAM_CHUNK_SIZE
+from metrics import registry
+
+try:  # optional: real non-blocking sockets; falls back to a bounded thread pool around requests
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Only these are retried on transient failures; a retried POST could create a user twice
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+_request_seconds = registry.histogram('panel_request_duration_seconds', 'Panel API request duration including retries.',
+                                      ('panel', 'method', 'endpoint'))
+_requests_total = registry.counter('panel_requests_total', 'Panel API requests by final HTTP status (or "error").',
+                                   ('panel', 'method', 'endpoint', 'status'))
+_USER_SEGMENT = re.compile(r'(user)/[^/]+')
+
+
+def _endpoint_label(path: str) -> str:
+    """'/user/<uuid>/' -> 'user/{id}', keeping the label set small."""
+    return _USER_SEGMENT.sub(r'\1/{id}', path.strip('/'))
+
+
+class PanelRequestError(Exception):
+    """A streamed request failed (the batch API reports failures in PanelResponse instead)."""
+
+
+@dataclass
+class PanelRequest:
+    method: str
+    path: str
+    json: Any = None
+    params: Optional[Dict[str, Any]] = None
+    data: Optional[Dict[str, Any]] = None
+    key: Any = None                  # free-form correlation key for the caller
+    timeout: Optional[float] = None  # per-request override of the client timeout
+    retry: Optional[bool] = None     # None: retry only idempotent methods
+
+
+@dataclass
+class PanelResponse:
+    request: PanelRequest
+    status: Optional[int] = None
+    data: Any = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and self.status < 400
+
+    @property
+    def transient(self) -> bool:
+        """Worth retrying: connection errors/timeouts, 429 and 5xx."""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class _EventLoopThread:
+    """One background asyncio loop shared by every AsyncPanelClient."""
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="panel-http-loop", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+
+_loop_thread = _EventLoopThread()
+_clients: List["AsyncPanelClient"] = []
+
+
+class AsyncPanelClient:
+    """
+    asyncio HTTP client for one panel API, with connection pooling, a concurrency limit,
+    per-request timeouts and retry of transient failures.
+
+    Use the coroutines from async code, or the sync facade (run / run_many / submit_many)
+    from telebot and scheduler threads. `on_result` callbacks run on the event loop thread
+    and must not block.
+    """
+
+    def __init__(self, name: str, base_url: str, headers_factory: Callable[[], Dict[str, str]],
+                 concurrency: int = PANEL_HTTP_CONCURRENCY, timeout: float = API_TIMEOUT,
+                 retries: int = API_RETRY_COUNT, on_unauthorized: Optional[Callable[[], bool]] = None) -> None:
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.headers_factory = headers_factory
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.on_unauthorized = on_unauthorized
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._aio_session = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sync_session: Optional[requests.Session] = None
+        _clients.append(self)
+
+    # --- transport -------------------------------------------------------
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def _send_aiohttp(self, req: PanelRequest, headers: Dict[str, str], timeout: float) -> tuple:
+        if self._aio_session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self._aio_session = aiohttp.ClientSession(connector=connector)
+        async with self._aio_session.request(req.method, self._url(req.path), json=req.json, params=req.params,
+                                             data=req.data, headers=headers,
+                                             timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            if resp.status == 204:
+                return resp.status, True
+            body = await resp.read()
+            if resp.status >= 400:
+                return resp.status, None
+            return resp.status, (await resp.json(content_type=None)) if body else True
+
+    def _send_blocking(self, req: PanelRequest, headers: Dict[str, str], timeout: float) -> tuple:
+        resp = self._sync_session.request(req.method, self._url(req.path), json=req.json, params=req.params,
+                                          data=req.data, headers=headers, timeout=timeout)
+        if resp.status_code == 204:
+            return resp.status_code, True
+        if resp.status_code >= 400:
+            return resp.status_code, None
+        return resp.status_code, resp.json() if resp.content else True
+
+    def _blocking_session(self) -> requests.Session:
+        if self._sync_session is None:
+            self._sync_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+            self._sync_session.mount('https://', adapter)
+            self._sync_session.mount('http://', adapter)
+        return self._sync_session
+
+    def _retries_for(self, req: PanelRequest) -> int:
+        return self.retries if (req.retry if req.retry is not None else req.method.upper() in IDEMPOTENT_METHODS) else 0
+
+    def _observe(self, req: PanelRequest, elapsed: float, status: Optional[int]) -> None:
+        endpoint = _endpoint_label(req.path)
+        _request_seconds.observe(elapsed, panel=self.name, method=req.method.upper(), endpoint=endpoint)
+        _requests_total.inc(panel=self.name, method=req.method.upper(), endpoint=endpoint,
+                            status=status if status is not None else 'error')
+
+    async def _send(self, req: PanelRequest, timeout: float) -> tuple:
+        headers = self.headers_factory()
+        if aiohttp is not None:
+            return await self._send_aiohttp(req, headers, timeout)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"{self.name}-http")
+        self._blocking_session()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._send_blocking, req, headers, timeout)
+
+    # --- async API -------------------------------------------------------
+
+    async def request(self, req: PanelRequest) -> PanelResponse:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = req.timeout or self.timeout
+        retries = self._retries_for(req)
+        result = PanelResponse(request=req)
+        started = time.monotonic()
+        reauthorized = False
+
+        while True:
+            result.attempts += 1
+            result.status, result.data, result.error = None, None, None
+            try:
+                async with self._semaphore:
+                    result.status, result.data = await self._send(req, timeout)
+                if result.status >= 400:
+                    result.error = f"HTTP {result.status}"
+            except Exception as e:  # timeouts, connection errors, invalid JSON
+                result.error = f"{type(e).__name__}: {e}"
+
+            if result.status == 401 and self.on_unauthorized and not reauthorized:
+                reauthorized = True
+                loop = asyncio.get_running_loop()
+                if await loop.run_in_executor(None, self.on_unauthorized):
+                    continue
+            if result.ok or not result.transient or result.attempts > retries:
+                break
+            await asyncio.sleep(0.5 * (2 ** (result.attempts - 1)))
+
+        result.elapsed = time.monotonic() - started
+        self._observe(req, result.elapsed, result.status)
+        if not result.ok:
+            logger.error(f"{self.name} API request failed: {req.method} {self._url(req.path)} - {result.error} (attempts: {result.attempts})")
+        return result
+
+    async def request_many(self, reqs: Iterable[PanelRequest],
+                           on_result: Optional[Callable[[PanelResponse], None]] = None) -> List[PanelResponse]:
+        async def run_one(req: PanelRequest) -> PanelResponse:
+            response = await self.request(req)
+            if on_result:
+                try:
+                    on_result(response)
+                except Exception as e:
+                    logger.error(f"{self.name}: on_result callback failed: {e}")
+            return response
+        return list(await asyncio.gather(*(run_one(req) for req in reqs)))
+
+    async def aclose(self) -> None:
+        if self._aio_session is not None:
+            await self._aio_session.close()
+            self._aio_session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    # --- sync facade -----------------------------------------------------
+
+    def _check_thread(self) -> None:
+        if _loop_thread.in_loop_thread():
+            raise RuntimeError("AsyncPanelClient sync facade called from the event loop thread")
+
+    def run(self, req: PanelRequest) -> PanelResponse:
+        self._check_thread()
+        return _loop_thread.submit(self.request(req)).result()
+
+    def run_many(self, reqs: Iterable[PanelRequest],
+                 on_result: Optional[Callable[[PanelResponse], None]] = None) -> List[PanelResponse]:
+        return self.submit_many(reqs, on_result).result()
+
+    def submit_many(self, reqs: Iterable[PanelRequest],
+                    on_result: Optional[Callable[[PanelResponse], None]] = None) -> Future:
+        """Starts a batch and returns immediately; the Future resolves to the list of responses."""
+        self._check_thread()
+        return _loop_thread.submit(self.request_many(list(reqs), on_result))
+
+
+    def stream(self, req: PanelRequest, chunk_size: int = PANEL_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Sync facade for large bodies: yields the raw body in chunks as it arrives, on the calling
+        thread. Transient failures are retried until the response headers arrive (not mid-body).
+        Raises PanelRequestError when the request fails.
+        """
+        self._check_thread()
+        session = self._blocking_session()
+        timeout = req.timeout or self.timeout
+        retries = self._retries_for(req)
+        started = time.monotonic()
+        attempts, reauthorized = 0, False
+
+        while True:
+            attempts += 1
+            status, response = None, None
+            try:
+                response = session.request(req.method, self._url(req.path), json=req.json, params=req.params,
+                                           data=req.data, headers=self.headers_factory(), timeout=timeout, stream=True)
+                status = response.status_code
+                if status < 400:
+                    break
+                response.close()
+                error = f"HTTP {status}"
+            except requests.RequestException as e:
+                error = f"{type(e).__name__}: {e}"
+            if status == 401 and self.on_unauthorized and not reauthorized:
+                reauthorized = True
+                if self.on_unauthorized():
+                    continue
+            if not (status is None or status == 429 or status >= 500) or attempts > retries:
+                self._observe(req, time.monotonic() - started, status)
+                logger.error(f"{self.name} API request failed: {req.method} {self._url(req.path)} - {error} (attempts: {attempts})")
+                raise PanelRequestError(error)
+            time.sleep(0.5 * (2 ** (attempts - 1)))
+
+        try:
+            with response:
+                yield from response.iter_content(chunk_size)
+        except requests.RequestException as e:
+            status = None
+            logger.error(f"{self.name} API stream failed: {req.method} {self._url(req.path)} - {type(e).__name__}: {e}")
+            raise PanelRequestError(f"{type(e).__name__}: {e}") from e
+        finally:
+            self._observe(req, time.monotonic() - started, status)
+
+
+def shutdown_async_clients() -> None:
+    """Closes pooled connections of every client (used on shutdown)."""
+    for client in _clients:
+        try:
+            _loop_thread.submit(client.aclose()).result(timeout=5)
+        except Exception as e:
+            logger.warning(f"Could not close {client.name} HTTP client: {e}")
@@ -0,0 +1,42 @@
+"""A TeleBot stand-in that records outgoing calls instead of talking to Telegram."""
+import itertools
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any
+
+
+class FakeTeleBot:
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.sent_bytes = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _record(self, method: str, chat_id: Any, text: str = "") -> SimpleNamespace:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] += 1
+            self.sent_bytes += len(text.encode("utf-8")) if text else 0
+            message_id = next(self._ids)
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id), text=text)
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        return self._record("send_message", chat_id, text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        return self._record("edit_message_text", chat_id, text)
+
+    def copy_message(self, chat_id, from_chat_id, message_id, *args, **kwargs):
+        return self._record("copy_message", chat_id)
+
+    def answer_callback_query(self, *args, **kwargs):
+        return True
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.sent_bytes = 0
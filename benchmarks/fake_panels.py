@@ -0,0 +1,156 @@
+"""
+Local stand-ins for the Hiddify and Marzban admin APIs, served by the standard library.
+
+Only the endpoints the bot's hot paths use are implemented:
+    Hiddify:  GET /<proxy>/api/v2/admin/user/            GET|PATCH /<proxy>/api/v2/admin/user/<uuid>/
+    Marzban:  POST /api/admin/token   GET /api/users (offset/limit)   GET|PUT /api/user/<username>
+The user set is deterministic for a given count and seed, so runs on different commits are comparable.
+"""
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+PROXY_PATH = "bench"
+ADMIN_KEY = "bench-admin-key"
+MARZBAN_TOKEN = "bench-token"
+
+
+def make_users(count: int, seed: int = 7) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, str]]:
+    """Returns (hiddify users by uuid, marzban users by username, uuid -> marzban username).
+
+    About 60% of the accounts exist on both panels, 25% only on Hiddify and 15% only on Marzban.
+    Usage, expiry and last-online times are spread so that warnings and online lists are non-empty.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    hiddify, marzban, uuid_map = {}, {}, {}
+    for i in range(count):
+        uuid = f"{i:08x}-{rng.getrandbits(16):04x}-4{rng.getrandbits(12):03x}-8{rng.getrandbits(12):03x}-{rng.getrandbits(48):012x}"
+        name = f"user{i:05d}"
+        kind = rng.random()
+        limit_gb = rng.choice((10, 20, 30, 50, 100))
+        used_gb = round(limit_gb * rng.random() ** 0.5, 3)
+        package_days = rng.choice((30, 60, 90))
+        start = (now - timedelta(days=rng.randint(0, package_days + 5))).date().isoformat()
+        online = now - timedelta(minutes=rng.randint(0, 60 * 24 * 3)) if rng.random() < 0.8 else None
+
+        if kind < 0.85:
+            hiddify[uuid] = {
+                "uuid": uuid, "name": name, "enable": rng.random() < 0.95,
+                "usage_limit_GB": limit_gb, "current_usage_GB": used_gb,
+                "package_days": package_days, "start_date": start, "mode": "no_reset",
+                "last_online": online.strftime("%Y-%m-%d %H:%M:%S") if online else None,
+            }
+        if kind >= 0.25:
+            username = f"m_{name}"
+            uuid_map[uuid] = username
+            marzban[username] = {
+                "username": username, "status": "active" if rng.random() < 0.95 else "disabled",
+                "data_limit": int(limit_gb * 1024 ** 3), "used_traffic": int(used_gb * 1024 ** 3),
+                "expire": int((now + timedelta(days=rng.randint(-3, 60))).timestamp()),
+                "online_at": online.strftime("%Y-%m-%dT%H:%M:%S") if online else None,
+                "proxies": {"vless": {"id": uuid}},
+            }
+    return hiddify, marzban, uuid_map
+
+
+class FakePanels:
+    """Both panels on one local port, with `latency` seconds added to every response."""
+
+    def __init__(self, users: int, latency: float = 0.0, seed: int = 7) -> None:
+        self.hiddify, self.marzban, self.uuid_map = make_users(users, seed)
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point config.py at these panels."""
+        return {"HIDDIFY_DOMAIN": self.base_url, "ADMIN_PROXY_PATH": PROXY_PATH, "ADMIN_UUID": ADMIN_KEY,
+                "MARZBAN_API_BASE_URL": self.base_url, "MARZBAN_API_USERNAME": "bench", "MARZBAN_API_PASSWORD": "bench"}
+
+    def start(self) -> "FakePanels":
+        panels = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _reply(self, status: int, payload: Any = None) -> None:
+                body = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with panels._lock:
+                    panels.requests += 1
+                if panels.latency:
+                    time.sleep(panels.latency)
+                url = urlsplit(self.path)
+                status, payload = panels.route(self.command, url.path, body, self.headers, dict(parse_qsl(url.query)))
+                self._reply(status, payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-panels", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def route(self, method: str, path: str, body: bytes, headers, query: Optional[Dict[str, str]] = None) -> Tuple[int, Any]:
+        query = query or {}
+        hiddify = re.fullmatch(rf"/{PROXY_PATH}/api/v2/admin/user/(?:([^/]+)/)?", path)
+        if hiddify:
+            if headers.get("Hiddify-API-Key") != ADMIN_KEY:
+                return 401, {"detail": "unauthorized"}
+            uuid = hiddify.group(1)
+            if uuid is None:
+                return (200, list(self.hiddify.values())) if method == "GET" else (405, None)
+            user = self.hiddify.get(uuid)
+            if user is None:
+                return 404, {"detail": "not found"}
+            if method == "PATCH":
+                user.update(json.loads(body or b"{}"))
+            return 200, user
+
+        if path == "/api/admin/token" and method == "POST":
+            return 200, {"access_token": MARZBAN_TOKEN, "token_type": "bearer"}
+        if path.startswith("/api/") and headers.get("Authorization") != f"Bearer {MARZBAN_TOKEN}":
+            return 401, {"detail": "unauthorized"}
+        if path == "/api/users" and method == "GET":
+            users: List[dict] = list(self.marzban.values())
+            offset, limit = int(query.get("offset", 0)), query.get("limit")
+            page = users[offset:offset + int(limit)] if limit is not None else users[offset:]
+            return 200, {"users": page, "total": len(users)}
+        marzban = re.fullmatch(r"/api/user/([^/]+)", path)
+        if marzban:
+            user = self.marzban.get(marzban.group(1))
+            if user is None:
+                return 404, {"detail": "not found"}
+            if method == "PUT":
+                user.update(json.loads(body or b"{}"))
+            return 200, user
+        return 404, {"detail": "not found"}
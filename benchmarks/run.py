@@ -0,0 +1,206 @@
+"""
+Times the bot's hot paths against local fake panels and a fake TeleBot.
+
+    python -m benchmarks.run --users 5000 --latency 0.02 --repeat 3
+    python -m benchmarks.run --users 5000 --save before.json
+    python -m benchmarks.run --users 5000 --compare before.json
+
+Run it from the repository root. The bot modules are imported only after the environment points
+config.py at the fake panels; the SQLite database and the Marzban uuid map are written to a
+temporary directory. Telegram pacing (outbound queue) is disabled so the numbers measure the bot's
+own work. The report is printed and written to bench_output.txt.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_bot import FakeTeleBot
+from benchmarks.fake_panels import FakePanels
+
+ADMIN_CHAT_IDS = (900000001, 900000002)
+FIRST_BOT_USER_ID = 100000
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def _populate_db(db, panels: FakePanels, bot_user_ratio: float, seed: int) -> int:
+    """Registers a share of the panel accounts as bot users, with a few usage snapshots from today."""
+    rng = random.Random(seed)
+    uuids = sorted(set(panels.hiddify) | set(panels.uuid_map))
+    linked = [u for u in uuids if rng.random() < bot_user_ratio]
+    unlinked = sorted(set(uuids) - set(linked))
+    users = [(user_id, f"tg{user_id}", "Bench", None) for user_id in ADMIN_CHAT_IDS]
+    users += [(FIRST_BOT_USER_ID + i, f"tg{i}", "Bench", None) for i in range(len(linked))]
+    with db._conn() as c:
+        c.executemany("INSERT OR IGNORE INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)", users)
+        c.executemany("INSERT OR IGNORE INTO user_uuids (user_id, uuid, name) VALUES (?, ?, ?)",
+                      [(FIRST_BOT_USER_ID + i, uuid, f"acc{i}") for i, uuid in enumerate(linked)])
+        # The admins also own two accounts each, like in production
+        c.executemany("INSERT OR IGNORE INTO user_uuids (user_id, uuid, name) VALUES (?, ?, ?)",
+                      [(admin_id, uuid, "admin-acc") for admin_id in ADMIN_CHAT_IDS
+                       for uuid in rng.sample(unlinked, k=2)])
+        ids = [row[0] for row in c.execute("SELECT id FROM user_uuids")]
+    db.add_usage_snapshots([(uuid_id, rng.random() * 5, rng.random() * 5) for uuid_id in ids])
+    return len(ids)
+
+
+class Bench:
+    def __init__(self, name: str, func: Callable[[], Any], setup: Optional[Callable[[], None]] = None,
+                 ops: int = 1) -> None:
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.ops = ops  # operations per call, for per-op timings
+
+
+def _run(bench: Bench, repeat: int, fake_bot: FakeTeleBot) -> Dict[str, Any]:
+    timings, messages = [], 0
+    for _ in range(repeat):
+        if bench.setup:
+            bench.setup()
+        fake_bot.reset()
+        started = time.perf_counter()
+        bench.func()
+        timings.append(time.perf_counter() - started)
+        messages = sum(fake_bot.calls.values())
+    return {"median": statistics.median(timings), "min": min(timings), "max": max(timings),
+            "ops": bench.ops, "messages": messages}
+
+
+def _format_report(meta: Dict[str, Any], results: Dict[str, Dict[str, Any]],
+                   baseline: Optional[Dict[str, Any]]) -> str:
+    lines = [f"benchmark @ {meta['revision']}  python {meta['python']}  users={meta['users']}  "
+             f"bot_accounts={meta['bot_accounts']}  latency={meta['latency']}s  repeat={meta['repeat']}",
+             ""]
+    header = f"{'benchmark':<34}{'median':>10}{'min':>10}{'max':>10}{'per op':>11}{'msgs':>7}"
+    if baseline:
+        header += f"{'baseline':>11}{'change':>9}"
+    lines += [header, "-" * len(header)]
+    for name, r in results.items():
+        line = (f"{name:<34}{r['median']:>9.3f}s{r['min']:>9.3f}s{r['max']:>9.3f}s"
+                f"{r['median'] / r['ops'] * 1000:>9.2f}ms{r['messages']:>7}")
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            change = (r["median"] - base["median"]) / base["median"] * 100 if base["median"] else 0.0
+            line += f"{base['median']:>10.3f}s{change:>+8.1f}%"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="accounts per fake panel set (1k-50k)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every panel response")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds added to every fake Telegram call")
+    parser.add_argument("--bot-user-ratio", type=float, default=0.5, help="share of panel accounts registered in the bot")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--only", nargs="*", help="run only benchmarks whose name contains one of these strings")
+    parser.add_argument("--save", help="write the results as JSON (for --compare on another commit)")
+    parser.add_argument("--compare", help="JSON file from an earlier --save run")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "bench_output.txt"))
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logs")
+    args = parser.parse_args(argv)
+    invocation_dir = os.getcwd()
+
+    def resolve(path: str) -> str:
+        """Paths on the command line are relative to where the command ran (the run itself chdirs)."""
+        return os.path.join(invocation_dir, path)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    panels = FakePanels(args.users, args.latency, args.seed).start()
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update(panels.env())
+    os.environ.update(BOT_TOKEN="123456:bench", ADMIN_IDS=",".join(map(str, ADMIN_CHAT_IDS)), METRICS_PORT="0")
+    os.chdir(workdir)
+    with open("uuid_to_marzban_user.json", "w", encoding="utf-8") as f:
+        json.dump(panels.uuid_map, f)
+
+    # Bot modules read the environment and the working directory at import time
+    import combined_handler
+    from admin_formatters import fmt_admin_report
+    from database import db
+    from outbound import outbound
+    from panel_cache import panel_cache
+    from scheduler import SchedulerManager
+
+    bot_accounts = _populate_db(db, panels, args.bot_user_ratio, args.seed)
+    fake_bot = FakeTeleBot(args.telegram_latency)
+    # Measure the bot, not Telegram's rate limits
+    outbound.chat_interval = outbound.group_chat_interval = 0
+    outbound._bucket.rate = 1e9
+    outbound.start(fake_bot)
+    scheduler = SchedulerManager(fake_bot)
+
+    rng = random.Random(args.seed)
+    names = [u["name"] for u in rng.sample(list(panels.hiddify.values()), k=min(25, len(panels.hiddify)))]
+    queries = names + [name[:6] for name in names] + [uuid[:8] for uuid in rng.sample(list(panels.hiddify), k=min(25, len(panels.hiddify)))]
+    warm_users = combined_handler.get_all_users_combined()
+
+    def search_all() -> None:
+        for query in queries:
+            combined_handler.search_user(query)
+
+    def reset_warnings() -> None:
+        scheduler.snapshots.invalidate()
+        with db._conn() as c:
+            c.execute("DELETE FROM warning_log")
+
+    benches = [
+        Bench("get_all_users_combined (cold)", combined_handler.get_all_users_combined, setup=panel_cache.clear),
+        Bench("get_all_users_combined (warm)", combined_handler.get_all_users_combined),
+        Bench("search_user", search_all, ops=len(queries)),
+        Bench("fmt_admin_report", lambda: fmt_admin_report(warm_users, db)),
+        Bench("scheduler._hourly_snapshots", scheduler._hourly_snapshots, setup=scheduler.snapshots.invalidate),
+        Bench("scheduler._check_for_warnings", scheduler._check_for_warnings, setup=reset_warnings),
+        Bench("scheduler._nightly_report", scheduler._nightly_report, setup=scheduler.snapshots.invalidate),
+    ]
+    if args.only:
+        benches = [b for b in benches if any(part in b.name for part in args.only)]
+
+    results = {}
+    for bench in benches:
+        print(f"running {bench.name} ...", file=sys.stderr, flush=True)
+        results[bench.name] = _run(bench, args.repeat, fake_bot)
+
+    outbound.stop()
+    panels.stop()
+
+    meta = {"revision": _git_revision(), "python": platform.python_version(), "users": args.users,
+            "bot_accounts": bot_accounts, "latency": args.latency, "repeat": args.repeat,
+            "panel_requests": panels.requests}
+    baseline = None
+    if args.compare:
+        with open(resolve(args.compare), encoding="utf-8") as f:
+            baseline = json.load(f)
+    report = _format_report(meta, results, baseline)
+    print(report)
+    with open(resolve(args.output), "w", encoding="utf-8") as f:
+        f.write(report)
+    if args.save:
+        with open(resolve(args.save), "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from concurrent.futures import as_completed
+from typing import Dict, List
+
+from telebot.apihelper import ApiTelegramException
+
+from config import BROADCAST_BATCH_SIZE, BROADCAST_STATUS_INTERVAL, OUTBOUND_RESULT_TIMEOUT
+from database import db
+from menu import menu
+from outbound import outbound, OutboundStopped, PRIORITY_BROADCAST, PRIORITY_INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+RESULT_FLUSH_SIZE = 50
+
+
+def _failure_reason(e: Exception) -> str:
+    if isinstance(e, ApiTelegramException):
+        return (e.description or f"error {e.error_code}")[:200]
+    return f"{type(e).__name__}: {e}"[:200]
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+
+class BroadcastRunner:
+    """
+    Runs broadcast jobs stored in the broadcast_jobs/broadcast_targets tables.
+
+    Each job runs in its own thread and sends through the outbound queue in batches.
+    Results are written per target, so after a restart unfinished jobs continue with the
+    targets that are still pending (a message in flight during a crash may be sent twice).
+    The admin's status message is edited every BROADCAST_STATUS_INTERVAL seconds.
+    """
+
+    def __init__(self) -> None:
+        self._threads: Dict[int, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Resumes every broadcast that did not finish before the last shutdown."""
+        self._stop.clear()
+        unfinished = db.get_unfinished_broadcast_jobs()
+        if unfinished:
+            logger.info(f"BroadcastRunner: resuming {len(unfinished)} unfinished broadcast job(s): {unfinished}")
+        for job_id in unfinished:
+            self.enqueue(job_id)
+
+    def stop(self, timeout: float = 15) -> None:
+        """Starts no new batches and waits for the batches in flight; call before outbound.stop()."""
+        self._stop.set()
+        self.join(timeout)
+
+    def join(self, timeout: float) -> None:
+        """Waits for the job threads, e.g. to record the sends outbound.stop() dropped before the DB closes."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            threads = list(self._threads.values())
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def enqueue(self, job_id: int) -> None:
+        with self._lock:
+            if job_id in self._threads:
+                return
+            thread = threading.Thread(target=self._run_job, args=(job_id,), name=f"broadcast-{job_id}", daemon=True)
+            self._threads[job_id] = thread
+        thread.start()
+
+    def _run_job(self, job_id: int) -> None:
+        try:
+            job = db.get_broadcast_job(job_id)
+            if not job or job['status'] == 'done':
+                return
+            db.set_broadcast_job_status(job_id, 'running')
+            logger.info(f"BroadcastRunner: job {job_id} started ({job['sent'] + job['failed']}/{job['total']} already processed)")
+
+            started = time.monotonic()
+            processed_this_run = 0
+            last_status = started
+            outbound_stopped = False
+
+            while not self._stop.is_set() and not outbound_stopped:
+                targets = db.get_pending_broadcast_targets(job_id, BROADCAST_BATCH_SIZE)
+                if not targets:
+                    break
+                futures = {outbound.copy_message(user_id, job['from_chat_id'], job['message_id'], priority=PRIORITY_BROADCAST): user_id
+                           for user_id in targets}
+                results: List[tuple] = []
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                        results.append((futures[future], None))
+                    except OutboundStopped:
+                        # Dropped at shutdown, never sent: the target stays pending for the resumed job
+                        outbound_stopped = True
+                        continue
+                    except Exception as e:
+                        results.append((futures[future], _failure_reason(e)))
+                    if len(results) >= RESULT_FLUSH_SIZE:
+                        db.record_broadcast_results(job_id, results)
+                        processed_this_run += len(results)
+                        results = []
+                    if time.monotonic() - last_status >= BROADCAST_STATUS_INTERVAL:
+                        last_status = time.monotonic()
+                        self._report(job_id, started, processed_this_run)
+                if results:
+                    db.record_broadcast_results(job_id, results)
+                    processed_this_run += len(results)
+
+            if self._stop.is_set() or outbound_stopped:
+                logger.info(f"BroadcastRunner: job {job_id} paused for shutdown; it will resume on next start")
+                return
+
+            db.set_broadcast_job_status(job_id, 'done')
+            self._report(job_id, started, processed_this_run, final=True)
+            job = db.get_broadcast_job(job_id)
+            logger.info(f"BroadcastRunner: job {job_id} finished: {job['sent']} sent, {job['failed']} failed")
+        except Exception as e:
+            logger.error(f"BroadcastRunner: job {job_id} crashed: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._threads.pop(job_id, None)
+
+    def _report(self, job_id: int, started: float, processed_this_run: int, final: bool = False) -> None:
+        job = db.get_broadcast_job(job_id)
+        if not job or not job['status_message_id']:
+            return
+        done = job['sent'] + job['failed']
+        elapsed = time.monotonic() - started
+        rate = processed_this_run / elapsed if elapsed > 0 else 0.0
+
+        if final:
+            lines = ["✅ ارسال پیام همگانی تمام شد.",
+                     f"موفق: {job['sent']}", f"ناموفق: {job['failed']}", f"مدت: {_format_duration(elapsed)}"]
+            reasons = db.get_broadcast_failure_reasons(job_id)
+            if reasons:
+                lines.append("\nدلایل خطا:")
+                lines += [f"- {error} ({count})" for error, count in reasons]
+        else:
+            remaining = max(0, job['total'] - done)
+            eta = _format_duration(remaining / rate) if rate > 0 else "-"
+            lines = ["⏳ در حال ارسال پیام همگانی...",
+                     f"پیشرفت: {done} از {job['total']}",
+                     f"موفق: {job['sent']} | ناموفق: {job['failed']}",
+                     f"سرعت: {rate:.1f} پیام در ثانیه | زمان باقیمانده: {eta}"]
+
+        kwargs = {'parse_mode': None}
+        if final:
+            kwargs['reply_markup'] = menu.admin_panel()
+        future = outbound.edit_message_text("\n".join(lines), job['admin_id'], job['status_message_id'],
+                                            priority=PRIORITY_INTERACTIVE, **kwargs)
+        if final:
+            try:
+                future.result(timeout=OUTBOUND_RESULT_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"BroadcastRunner: could not edit status message of job {job_id}: {e}")
+
+
+broadcast_runner = BroadcastRunner()
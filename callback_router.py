@@ -1,7 +1,20 @@
 from telebot import types, telebot
 from config import ADMIN_IDS
-from admin_router import handle_admin_callbacks
-from user_handlers import handle_user_callbacks
+from admin_router import handle_admin_callbacks, ADMIN_CALLBACK_HANDLERS
+from user_handlers import handle_user_callbacks, USER_CALLBACK_MAP
+from metrics import registry
+
+_callback_seconds = registry.histogram('callback_handler_duration_seconds', 'Callback query handling time per action key.',
+                                       ('scope', 'action'))
+
+def _action_key(data: str, is_admin: bool) -> tuple:
+    """Low-cardinality label: the handler key, or the prefix of parameterized user callbacks (acc_12 -> acc)."""
+    if is_admin and data.startswith("admin:"):
+        action = data.split(':')[1] if ':' in data else ''
+        return 'admin', action if action in ADMIN_CALLBACK_HANDLERS else 'unknown'
+    if data in USER_CALLBACK_MAP:
+        return 'user', data
+    return 'user', data.split('_')[0] or 'unknown'
 
 def register_callback_router(bot: telebot.TeleBot):
 
@@ -16,7 +29,9 @@ def register_callback_router(bot: telebot.TeleBot):
             bot.answer_callback_query(call.id)
         except Exception:
             pass
-        if is_admin and data.startswith("admin:"):
-            handle_admin_callbacks(call)
-        else:
-            handle_user_callbacks(call)
+        scope, action = _action_key(data, is_admin)
+        with _callback_seconds.time(scope=scope, action=action):
+            if is_admin and data.startswith("admin:"):
+                handle_admin_callbacks(call)
+            else:
+                handle_user_callbacks(call)
@@ -1,36 +1,57 @@
-from typing import Optional, Dict, Any, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional, Dict, Any, List, Callable, Tuple
 from datetime import datetime, timedelta
 
 from hiddify_api_handler import hiddify_handler
 from marzban_api_handler import marzban_handler
 from database import db
+from cachetools import TTLCache
+from config import (PANEL_FETCH_PARALLEL, PANEL_FETCH_TIMEOUT, USER_INFO_CACHE_TTL, USER_INFO_CACHE_SIZE,
+                    USER_INFO_SNAPSHOT_MAX_AGE, BULK_PROGRESS_INTERVAL)
+from async_http import PanelRequest, PanelResponse
+from panel_cache import panel_cache
+from metrics import registry, hit_ratio
+from user_directory import UserDirectory
+from user_records import UserRecord
 from utils import validate_uuid
 import logging
 import pytz
 
 logger = logging.getLogger(__name__)
 
-def get_combined_user_info(identifier: str) -> Optional[Dict[str, Any]]:
-    is_uuid = validate_uuid(identifier)
-    h_info, m_info = None, None
+# Each combined fetch needs one worker per panel. Bulk changes refresh both lists on their own pool,
+# so fetches stuck on a hung panel cannot hold up a bulk change (or the other way round).
+_panel_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="panel-fetch")
+_bulk_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="panel-bulk-refresh")
 
-    if is_uuid:
-        h_info = hiddify_handler.user_info(identifier)
-        m_info = marzban_handler.get_user_info(identifier)
-    else:
-        m_info = marzban_handler.get_user_by_username(identifier)
-        if m_info and m_info.get('uuid'):
-            h_info = hiddify_handler.user_info(m_info['uuid'])
-            
+# Per-panel timing/status of the most recent get_all_users_combined() call; replaced, never changed in place.
+last_fetch_report: Dict[str, Any] = {}
+
+def _set_last_fetch_report(report: Dict[str, Any]) -> None:
+    global last_fetch_report
+    last_fetch_report = report
+
+# Search index, rebuilt whenever the cached panel lists change.
+_directory_lock = threading.Lock()
+_directory_state: Dict[str, Any] = {'directory': None, 'versions': None}
+
+# Per-user info cache (keyed by UUID and Marzban username) with write invalidation.
+_user_info_lock = threading.Lock()
+_user_info_cache = TTLCache(maxsize=USER_INFO_CACHE_SIZE, ttl=USER_INFO_CACHE_TTL)
+# A snapshot taken before a write is served for at most USER_INFO_SNAPSHOT_MAX_AGE, so writes are remembered that long
+_user_written_at = TTLCache(maxsize=USER_INFO_CACHE_SIZE, ttl=USER_INFO_SNAPSHOT_MAX_AGE)
+_snapshot_index_state: Dict[str, Any] = {}
+_user_info_stats = {'hits': 0, 'snapshot_hits': 0, 'misses': 0}
+
+def _build_combined_info(h_info: Optional[Dict[str, Any]], m_info: Optional[Dict[str, Any]]) -> Optional[UserRecord]:
+    """Merges one user's Hiddify/Marzban records (daily usage is attached separately)."""
     if not h_info and not m_info: return None
 
-    base_info = (h_info or m_info).copy()
-    
-    base_info['breakdown'] = {
-        'hiddify': h_info if h_info else {},
-        'marzban': m_info if m_info else {}
-    }
-    
+    primary = h_info or m_info
+    breakdown = {'hiddify': h_info or {}, 'marzban': m_info or {}}
+
     h_limit = h_info.get('usage_limit_GB', 0) if h_info else 0
     m_limit = m_info.get('usage_limit_GB', 0) if m_info else 0
     total_limit = h_limit + m_limit
@@ -38,29 +59,9 @@ def get_combined_user_info(identifier: str) -> Optional[Dict[str, Any]]:
     h_usage = h_info.get('current_usage_GB', 0) if h_info else 0
     m_usage = m_info.get('current_usage_GB', 0) if m_info else 0
     total_usage = h_usage + m_usage
-    
-    base_info['usage_limit_GB'] = total_limit
-    base_info['current_usage_GB'] = total_usage
-    base_info['remaining_GB'] = max(0, total_limit - total_usage)
-    base_info['usage_percentage'] = (total_usage / total_limit * 100) if total_limit > 0 else 0
-    
-    base_info['name'] = (h_info or m_info).get('name')
+
     h_online = h_info.get('last_online') if h_info else None
     m_online = m_info.get('last_online') if m_info else None
-    
-    # **تغییر اصلی اول: محاسبه مصرف روزانه در همین تابع**
-    uuid = base_info.get('uuid')
-    if uuid:
-        uuid_id = db.get_uuid_id_by_uuid(uuid)
-        if uuid_id:
-            daily_usage_dict = db.get_usage_since_midnight(uuid_id)
-            # افزودن مجموع مصرف روزانه به اطلاعات اصلی
-            base_info['daily_usage_GB'] = sum(daily_usage_dict.values())
-            # افزودن جزئیات مصرف روزانه به هر پنل
-            if base_info.get('breakdown', {}).get('hiddify'):
-                base_info['breakdown']['hiddify']['daily_usage'] = daily_usage_dict.get('hiddify', 0.0)
-            if base_info.get('breakdown', {}).get('marzban'):
-                base_info['breakdown']['marzban']['daily_usage'] = daily_usage_dict.get('marzban', 0.0)
 
     # مقایسه امن تاریخ‌ها برای پیدا کردن جدیدترین زمان آنلاین بودن
     latest_online = None
@@ -71,16 +72,177 @@ def get_combined_user_info(identifier: str) -> Optional[Dict[str, Any]]:
     else:
         latest_online = h_online or m_online
 
-    base_info['last_online'] = latest_online
+    # The panel records are shared (they may be cached); only the merged fields are stored here
+    return UserRecord(primary, breakdown, {
+        'usage_limit_GB': total_limit,
+        'current_usage_GB': total_usage,
+        'remaining_GB': max(0, total_limit - total_usage),
+        'usage_percentage': (total_usage / total_limit * 100) if total_limit > 0 else 0,
+        'last_online': latest_online,
+    })
+
+def _attach_daily_usage(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a copy of a (possibly cached) combined info with today's usage from the DB."""
+    info = {**info, 'breakdown': {panel: dict(data) for panel, data in info.get('breakdown', {}).items()}}
+
+    # **تغییر اصلی اول: محاسبه مصرف روزانه در همین تابع**
+    uuid = info.get('uuid')
+    if uuid:
+        uuid_id = db.get_uuid_id_by_uuid(uuid)
+        if uuid_id:
+            daily_usage_dict = db.get_usage_since_midnight(uuid_id)
+            # افزودن مجموع مصرف روزانه به اطلاعات اصلی
+            info['daily_usage_GB'] = sum(daily_usage_dict.values())
+            # افزودن جزئیات مصرف روزانه به هر پنل
+            if info['breakdown'].get('hiddify'):
+                info['breakdown']['hiddify']['daily_usage'] = daily_usage_dict.get('hiddify', 0.0)
+            if info['breakdown'].get('marzban'):
+                info['breakdown']['marzban']['daily_usage'] = daily_usage_dict.get('marzban', 0.0)
+    return info
+
+def _fetch_combined_user_info(identifier: str) -> Optional[Dict[str, Any]]:
+    """Live lookup of one user on both panels."""
+    is_uuid = validate_uuid(identifier)
+    h_info, m_info = None, None
+
+    if is_uuid:
+        h_info = hiddify_handler.user_info(identifier)
+        m_info = marzban_handler.get_user_info(identifier)
+    else:
+        m_info = marzban_handler.get_user_by_username(identifier)
+        if m_info and m_info.get('uuid'):
+            h_info = hiddify_handler.user_info(m_info['uuid'])
+
+    return _build_combined_info(h_info, m_info)
+
+def _get_snapshot_index() -> Optional[Dict[str, Any]]:
+    """
+    Lookup maps over the cached full panel lists, or None when the lists are missing or
+    older than USER_INFO_SNAPSHOT_MAX_AGE. Never triggers a panel download.
+    """
+    h_users, h_age, h_version = panel_cache.peek('hiddify')
+    m_users, m_age, m_version = panel_cache.peek('marzban')
+    if h_users is None or m_users is None or max(h_age, m_age) > USER_INFO_SNAPSHOT_MAX_AGE:
+        return None
+
+    versions = (h_version, m_version)
+    with _user_info_lock:
+        index = _snapshot_index_state.get('index')
+        if index is None or index['versions'] != versions:
+            index = {
+                'versions': versions,
+                'fetched_at': time.monotonic() - max(h_age, m_age),
+                'h_by_uuid': {u['uuid']: u for u in h_users if u.get('uuid')},
+                'm_by_uuid': {u['uuid']: u for u in m_users if u.get('uuid')},
+                'm_by_name': {u['name']: u for u in m_users if u.get('name')},
+            }
+            _snapshot_index_state['index'] = index
+        return index
+
+def _user_info_from_snapshot(identifier: str) -> Optional[Dict[str, Any]]:
+    index = _get_snapshot_index()
+    if index is None:
+        return None
+    if validate_uuid(identifier):
+        h_info = index['h_by_uuid'].get(identifier.lower())
+        m_info = index['m_by_uuid'].get(identifier.lower())
+    else:
+        m_info = index['m_by_name'].get(identifier)
+        h_info = index['h_by_uuid'].get(m_info['uuid']) if m_info and m_info.get('uuid') else None
+
+    info = _build_combined_info(h_info, m_info)
+    if info is None:
+        return None
 
-    return base_info
+    # Skip the snapshot if this user was modified after the snapshot was taken
+    with _user_info_lock:
+        written_at = max([_user_written_at.get(key, 0.0) for key in _user_info_keys(identifier, info)]
+                         + [_snapshot_index_state.get('written_floor', 0.0)])
+    return info if written_at < index['fetched_at'] else None
+
+def _user_info_keys(identifier: str, info: Optional[Dict[str, Any]] = None) -> set:
+    keys = {identifier}
+    if info:
+        keys.update(key for key in (info.get('uuid'), (info.get('breakdown', {}).get('marzban') or {}).get('name')) if key)
+    return keys
+
+def get_combined_user_info(identifier: str, force_refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Combined Hiddify/Marzban info of one user.
+    Served from a short-TTL per-user cache, then from a fresh full-list snapshot, and only
+    then from the panels; force_refresh=True always asks the panels.
+    """
+    info, source = None, 'misses'
+    if not force_refresh:
+        with _user_info_lock:
+            info = _user_info_cache.get(identifier)
+        source = 'hits'
+        if info is None:
+            info, source = _user_info_from_snapshot(identifier), 'snapshot_hits'
+
+    if info is None:
+        info, source = _fetch_combined_user_info(identifier), 'misses'
+
+    with _user_info_lock:
+        _user_info_stats[source] += 1
+        if info is None:
+            return None
+        for key in _user_info_keys(identifier, info):
+            _user_info_cache[key] = info
+
+    return _attach_daily_usage(info)
+
+def invalidate_user_info(identifier: str) -> None:
+    """Drops a user's cached info after a write, and keeps older snapshots from serving it."""
+    now = time.monotonic()
+    with _user_info_lock:
+        cached = _user_info_cache.get(identifier)
+        for key in _user_info_keys(identifier, cached):
+            _user_info_cache.pop(key, None)
+            if key not in _user_written_at and len(_user_written_at) >= _user_written_at.maxsize:
+                # Too many recent writes to track one by one (bulk changes): distrust every older snapshot
+                _snapshot_index_state['written_floor'] = now
+            _user_written_at[key] = now
+    # The full lists are now outdated for this user; refresh them in the background
+    panel_cache.invalidate()
+
+def user_info_cache_stats() -> Dict[str, Any]:
+    with _user_info_lock:
+        return {**_user_info_stats, 'size': len(_user_info_cache)}
+
+registry.callback('user_info_cache_requests_total', 'Single-user info lookups by source (hits, snapshot_hits, misses).',
+                  lambda: {(source,): count for source, count in user_info_cache_stats().items() if source != 'size'},
+                  ('source',), kind='counter')
+def _user_info_hit_ratio() -> Optional[float]:
+    stats = user_info_cache_stats()
+    return hit_ratio(stats['hits'] + stats['snapshot_hits'], stats['misses'])
+
+registry.callback('user_info_cache_hit_ratio', 'Share of single-user lookups answered without a panel request.', _user_info_hit_ratio)
+registry.callback('user_info_cache_size', 'Entries in the single-user info cache.', lambda: user_info_cache_stats()['size'])
+
+def _hiddify_modify_payload(h_info: Dict[str, Any], add_gb: float = 0, add_days: int = 0) -> Dict[str, Any]:
+    """Hiddify stores absolute values, so relative additions are computed from the current record."""
+    h_payload = {}
+
+    if add_gb != 0:
+        current_limit = h_info.get('usage_limit_GB', 0)
+        h_payload['usage_limit_GB'] = current_limit + add_gb
+
+    if add_days != 0:
+        # Hiddify needs an absolute number of days, so we calculate it.
+        current_expire = h_info.get('expire', 0)
+        # If expired, start from today. Otherwise, add to remaining days.
+        base_days = current_expire if current_expire is not None and current_expire > 0 else 0
+        h_payload['package_days'] = base_days + add_days
+
+    return h_payload
 
 def modify_user_on_all_panels(identifier: str, add_gb: float = 0, add_days: int = 0, target_panel: str = 'both') -> bool:
     """
     Modifies a user on Hiddify, Marzban, or both, handling relative additions.
     This is a new, crucial function to fix editing bugs.
     """
-    info = get_combined_user_info(identifier)
+    info = get_combined_user_info(identifier, force_refresh=True)
     if not info:
         logger.error(f"Cannot modify non-existent user: {identifier}")
         return False
@@ -90,18 +252,7 @@ def modify_user_on_all_panels(identifier: str, add_gb: float = 0, add_days: int
     # --- Hiddify Modification ---
     if target_panel in ['hiddify', 'both'] and 'hiddify' in info.get('breakdown', {}):
         h_info = info['breakdown']['hiddify']
-        h_payload = {}
-        
-        if add_gb != 0:
-            current_limit = h_info.get('usage_limit_GB', 0)
-            h_payload['usage_limit_GB'] = current_limit + add_gb
-        
-        if add_days != 0:
-            # Hiddify needs an absolute number of days, so we calculate it.
-            current_expire = h_info.get('expire', 0)
-            # If expired, start from today. Otherwise, add to remaining days.
-            base_days = current_expire if current_expire is not None and current_expire > 0 else 0
-            h_payload['package_days'] = base_days + add_days
+        h_payload = _hiddify_modify_payload(h_info, add_gb, add_days)
 
         if h_payload:
             h_success = hiddify_handler.modify_user(h_info['uuid'], h_payload)
@@ -118,10 +269,133 @@ def modify_user_on_all_panels(identifier: str, add_gb: float = 0, add_days: int
             add_days=add_days
         )
 
+    invalidate_user_info(identifier)
     return h_success and m_success
 
+def bulk_modify_users(users: List[Dict[str, Any]], add_gb: float = 0, add_days: int = 0,
+                      on_progress: Optional[Callable[[int, int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Applies the same relative change to many users at once.
+
+    `users` (from get_all_users_combined) selects who is changed. The absolute values sent
+    are computed from both panel lists downloaded again just before (one request per panel,
+    not per user), so edits made since `users` was read are not overwritten; users of a panel
+    whose list cannot be downloaded are reported as failed. All PATCH/PUT requests go through
+    the panels' async clients with bounded concurrency and retry of transient failures. `on_progress(done, total, failed)` is called
+    from the calling thread at most every BULK_PROGRESS_INTERVAL seconds.
+    Returns {'total', 'succeeded', 'failed', 'results': {identifier: {...}}}.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    h_batch: List[PanelRequest] = []
+    m_batch: List[PanelRequest] = []
+    h_current, m_current = _current_panel_records()
+
+    for user in users:
+        identifier = user.get('uuid') or user.get('name')
+        breakdown = user.get('breakdown', {})
+        h_info, m_info = breakdown.get('hiddify'), breakdown.get('marzban')
+        result = {'name': user.get('name'), 'hiddify': None, 'marzban': None, 'pending': 0, 'error': None}
+        results[identifier] = result
+
+        # Replace the (possibly stale) records with the ones just downloaded
+        if h_info and h_info.get('uuid'):
+            h_info = h_current.get(h_info['uuid']) if h_current is not None else None
+            if h_info is None:
+                result['hiddify'], result['error'] = False, "hiddify: current values unavailable"
+        if m_info and m_info.get('name'):
+            m_info = m_current.get(m_info['name']) if m_current is not None else None
+            if m_info is None:
+                result['marzban'], result['error'] = False, "marzban: current values unavailable"
+
+        if h_info and h_info.get('uuid'):
+            h_payload = _hiddify_modify_payload(h_info, add_gb, add_days)
+            if h_payload:
+                # The payload holds absolute values, so a retried PATCH is safe
+                h_batch.append(PanelRequest("PATCH", f"/admin/user/{h_info['uuid']}/", json=h_payload, key=identifier, retry=True))
+                result['pending'] += 1
+        if m_info and m_info.get('name'):
+            current = {'data_limit': m_info.get('data_limit'), 'expire': m_info.get('expire_timestamp')}
+            m_payload = marzban_handler.modification_payload(current, add_usage_gb=add_gb, add_days=add_days)
+            if m_payload:
+                m_batch.append(PanelRequest("PUT", f"user/{m_info['name']}", json=m_payload, key=identifier))
+                result['pending'] += 1
+
+    progress_lock = threading.Lock()
+    settled = [r for r in results.values() if r['pending'] == 0]
+    counters = {'done': len(settled), 'failed': sum(1 for r in settled if r['hiddify'] is False or r['marzban'] is False)}
+
+    def record(panel: str, response: PanelResponse) -> None:
+        with progress_lock:
+            result = results[response.request.key]
+            result[panel] = response.ok
+            if not response.ok:
+                result['error'] = f"{panel}: {response.error}"
+            result['pending'] -= 1
+            if result['pending'] == 0:
+                counters['done'] += 1
+                if result['hiddify'] is False or result['marzban'] is False:
+                    counters['failed'] += 1
+
+    futures = []
+    if h_batch:
+        futures.append(hiddify_handler.submit_many(h_batch, lambda r: record('hiddify', r)))
+    if m_batch:
+        m_future = marzban_handler.submit_many(m_batch, lambda r: record('marzban', r))
+        if m_future is None:
+            for req in m_batch:
+                record('marzban', PanelResponse(request=req, error="no access token"))
+        else:
+            futures.append(m_future)
+
+    total = len(results)
+    while futures:
+        done, not_done = wait(futures, timeout=BULK_PROGRESS_INTERVAL)
+        futures = list(not_done)
+        if futures and on_progress:
+            with progress_lock:
+                snapshot = counters['done'], counters['failed']
+            try:
+                on_progress(snapshot[0], total, snapshot[1])
+            except Exception as e:
+                logger.warning(f"bulk_modify_users: progress callback failed: {e}")
+
+    for identifier, result in results.items():
+        del result['pending']
+        result['ok'] = result['hiddify'] is not False and result['marzban'] is not False
+        invalidate_user_info(identifier)
+
+    failed = sum(1 for r in results.values() if not r['ok'])
+    logger.info(f"Bulk modify: {total - failed}/{total} users updated (add_gb={add_gb}, add_days={add_days})")
+    return {'total': total, 'succeeded': total - failed, 'failed': failed, 'results': results}
+
+def _current_panel_records() -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Downloads both panel lists now (in parallel) and returns (Hiddify users by UUID,
+    Marzban users by username); a panel whose download failed is None instead of its stale list.
+    """
+    started = time.monotonic()
+    futures = {panel: _bulk_refresh_executor.submit(handler.get_all_users, force_refresh=True)
+               for panel, handler in (('hiddify', hiddify_handler), ('marzban', marzban_handler))}
+    current = {}
+    for panel, future in futures.items():
+        try:
+            users = future.result()
+        except Exception as e:
+            logger.error(f"COMBINED_HANDLER: Refreshing {panel} before a bulk change failed: {e}")
+            current[panel] = None
+            continue
+        _, age, _ = panel_cache.peek(panel)
+        if age is None or age > time.monotonic() - started:
+            logger.error(f"COMBINED_HANDLER: {panel} list could not be refreshed; its users are left unchanged.")
+            current[panel] = None
+        else:
+            current[panel] = users
+    h_users, m_users = current['hiddify'], current['marzban']
+    return ({u['uuid']: u for u in h_users if u.get('uuid')} if h_users is not None else None,
+            {u['name']: u for u in m_users if u.get('name')} if m_users is not None else None)
+
 def delete_user_from_all_panels(identifier: str) -> bool:
-    info = get_combined_user_info(identifier)
+    info = get_combined_user_info(identifier, force_refresh=True)
     if not info: return False
     h_success, m_success = True, True
     h_uuid = info.get('uuid')
@@ -130,6 +404,7 @@ def delete_user_from_all_panels(identifier: str) -> bool:
         h_success = hiddify_handler.delete_user(h_uuid)
     if m_username and 'marzban' in info.get('breakdown', {}):
         m_success = marzban_handler.delete_user(m_username)
+    invalidate_user_info(identifier)
     if h_success and m_success and h_uuid:
         db_id = db.get_uuid_id_by_uuid(h_uuid)
         if db_id:
@@ -137,53 +412,100 @@ def delete_user_from_all_panels(identifier: str) -> bool:
             db.delete_user_snapshots(db_id)
     return h_success and m_success
 
-def get_all_users_combined() -> List[Dict[str, Any]]:
-    logger.info("COMBINED_HANDLER: Starting to fetch users from all panels.") # لاگ شروع
+def _fetch_panel(panel: str, fetcher: Callable[[], Optional[List[Dict[str, Any]]]]) -> Tuple[List[Dict[str, Any]], float, Optional[str]]:
+    """Runs a single panel's get_all_users and returns (users, elapsed_seconds, error)."""
+    started = time.monotonic()
+    try:
+        # FIX: Handle None return from API handlers to prevent crashes
+        users = fetcher() or []
+        return users, time.monotonic() - started, None
+    except Exception as e:
+        logger.error(f"COMBINED_HANDLER: Fetching from {panel} failed: {e}", exc_info=True)
+        return [], time.monotonic() - started, str(e)
+
+def _merge_panel_users(h_users: List[Dict[str, Any]], m_users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merges both panels' users by UUID; the (cached) panel records are shared, not copied or mutated."""
     all_users_map = {}
-    
-    # FIX: Handle None return from API handlers to prevent crashes
-    h_users = hiddify_handler.get_all_users() or []
-    logger.info("COMBINED_HANDLER: Fetching from Hiddify...") # لاگ هیدیفای
-    logger.info(f"COMBINED_HANDLER: Fetched {len(h_users)} users from Hiddify.") # لاگ تعداد
+
     for user in h_users:
-        uuid = user['uuid']
-        user['breakdown'] = {'hiddify': user.copy()}
-        all_users_map[uuid] = user
-
-    # FIX: Handle None return from API handlers
-    logger.info("COMBINED_HANDLER: Fetching from Marzban...") # لاگ مرزبان
-    m_users = marzban_handler.get_all_users() or []
-    logger.info(f"COMBINED_HANDLER: Fetched {len(m_users)} users from Marzban.") # لاگ تعداد
+        all_users_map[user['uuid']] = UserRecord(user, {'hiddify': user})
+
     for user in m_users:
         uuid = user.get('uuid')
         if uuid and uuid in all_users_map:
             # User exists in Hiddify, add Marzban data to their breakdown
-            all_users_map[uuid]['breakdown']['marzban'] = user.copy()
+            all_users_map[uuid].breakdown['marzban'] = user
         elif uuid:
             # User only exists in Marzban but has a UUID
-            user['breakdown'] = {'marzban': user.copy()}
-            all_users_map[uuid] = user
+            all_users_map[uuid] = UserRecord(user, {'marzban': user})
         else:
             # User only exists in Marzban and has no UUID (use username as key)
-            user['breakdown'] = {'marzban': user.copy()}
-            all_users_map[user['name']] = user
-            
+            all_users_map[user['name']] = UserRecord(user, {'marzban': user})
+
     return list(all_users_map.values())
 
-def search_user(query: str) -> List[Dict[str, Any]]:
-    query_lower = query.lower()
-    results, found_identifiers = [], set()
+def get_all_users_combined(parallel: bool = PANEL_FETCH_PARALLEL) -> List[Dict[str, Any]]:
+    """
+    Fetches users from both panels and merges them by UUID.
+    In parallel mode both panels are queried at once; a panel that does not answer
+    within PANEL_FETCH_TIMEOUT is reported as 'timeout' and the other half is still returned.
+    Per-panel timing and status of the latest fetch is kept in `last_fetch_report`.
+    """
+    logger.info("COMBINED_HANDLER: Starting to fetch users from all panels.") # لاگ شروع
+    fetchers = {'hiddify': hiddify_handler.get_all_users, 'marzban': marzban_handler.get_all_users}
+    results = {}
+    started = time.monotonic()
 
-    all_users = get_all_users_combined()
-    for user in all_users:
-        identifier = user.get('uuid') or user.get('name')
-        if identifier in found_identifiers: continue
-        
-        match = query_lower in user.get('name', '').lower() or \
-                (user.get('uuid') and query_lower in user.get('uuid'))
-        
-        if match:
-            panel = 'hiddify' if 'hiddify' in user.get('breakdown', {}) else 'marzban'
-            results.append({**user, 'panel': panel})
-            found_identifiers.add(identifier)
-    return results
\ No newline at end of file
+    if parallel:
+        futures = {panel: _panel_executor.submit(_fetch_panel, panel, fetcher) for panel, fetcher in fetchers.items()}
+        done, _ = wait(futures.values(), timeout=PANEL_FETCH_TIMEOUT)
+        for panel, future in futures.items():
+            if future in done:
+                results[panel] = future.result()
+            else:
+                # Drops the fetch if it is still queued behind other stuck fetches; a running one ends with its HTTP timeout
+                future.cancel()
+                logger.warning(f"COMBINED_HANDLER: {panel} did not answer within {PANEL_FETCH_TIMEOUT}s, continuing without it.")
+                results[panel] = ([], time.monotonic() - started, 'timeout')
+    else:
+        for panel, fetcher in fetchers.items():
+            results[panel] = _fetch_panel(panel, fetcher)
+
+    report = {'mode': 'parallel' if parallel else 'sequential', 'finished_at': datetime.now(pytz.utc)}
+    for panel, (users, elapsed, error) in results.items():
+        report[panel] = {'ok': error is None, 'error': error, 'count': len(users), 'elapsed': round(elapsed, 3)}
+        logger.info(f"COMBINED_HANDLER: Fetched {len(users)} users from {panel} in {elapsed:.2f}s" + (f" (error: {error})" if error else "."))
+    report['partial'] = any(not report[panel]['ok'] for panel in fetchers)
+    report['elapsed'] = round(time.monotonic() - started, 3)
+    _set_last_fetch_report(report)
+
+    return _merge_panel_users(results['hiddify'][0], results['marzban'][0])
+
+def get_user_directory() -> UserDirectory:
+    """
+    Search index over the combined panel snapshot. The panel lists come from panel_cache
+    (stale-while-revalidate), and the index is only rebuilt when either list has changed.
+    """
+    # Served from panel_cache; this also kicks a background refresh when a list is stale
+    h_users = hiddify_handler.get_all_users()
+    m_users = marzban_handler.get_all_users()
+    h_cached, _, h_version = panel_cache.peek('hiddify')
+    m_cached, _, m_version = panel_cache.peek('marzban')
+    versions = (h_version, m_version)
+
+    with _directory_lock:
+        if _directory_state['directory'] is None or _directory_state['versions'] != versions:
+            h_list = h_cached if h_cached is not None else h_users
+            m_list = m_cached if m_cached is not None else m_users
+            _directory_state['directory'] = UserDirectory(_merge_panel_users(h_list, m_list))
+            _directory_state['versions'] = versions
+            logger.info(f"COMBINED_HANDLER: Rebuilt user directory with {len(_directory_state['directory'])} users.")
+        return _directory_state['directory']
+
+def search_user(query: str) -> List[Dict[str, Any]]:
+    results = []
+    for user in get_user_directory().search(query):
+        result = user.copy()
+        result['panel'] = 'hiddify' if 'hiddify' in user.get('breakdown', {}) else 'marzban'
+        results.append(result)
+    return results
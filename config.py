@@ -1,7 +1,6 @@
 import os
 from datetime import time
 import pytz
-from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -45,9 +44,16 @@ TELEGRAM_FILE_SIZE_LIMIT_BYTES = 50 * 1024 * 1024
 
 CUSTOM_SUB_LINK_BASE_URL = "https://drive.google.com/uc?export=download&id="
 
-# --- تعریف یک کش با زمان انقضای ۶۰ ثانیه ---
-# maxsize=2 یعنی حداکثر ۲ نتیجه متفاوت (معمولاً ۱ نتیجه get_all_users) را نگه می‌دارد
-api_cache = TTLCache(maxsize=2, ttl=60)
+# --- کش لیست کاربران پنل‌ها (stale-while-revalidate) ---
+# تا PANEL_CACHE_TTL ثانیه لیست تازه محسوب می‌شود؛ پس از آن تا PANEL_CACHE_MAX_STALE ثانیه
+# لیست قبلی فوراً برگردانده شده و در پس‌زمینه به‌روزرسانی می‌شود
+PANEL_CACHE_TTL = 60
+PANEL_CACHE_MAX_STALE = 15 * 60
+
+# --- کش اطلاعات تک‌کاربر (get_combined_user_info) ---
+USER_INFO_CACHE_TTL = 30
+USER_INFO_CACHE_SIZE = 2048
+USER_INFO_SNAPSHOT_MAX_AGE = 60   # حداکثر عمر لیست کامل پنل‌ها برای استفاده به جای درخواست مستقیم
 
 DAILY_USAGE_ALERT_THRESHOLD_GB = 5
 WARNING_USAGE_THRESHOLD = 85 # آستانه هشدار مصرف به درصد
@@ -59,10 +65,87 @@ ONLINE_REPORT_UPDATE_HOURS = 3 # فاصله زمانی آپدیت گزارش ک
 WARNING_90_PERCENT = 90
 WARNING_DAYS_BEFORE_EXPIRY = 2
 
+# --- SQLite Settings ---
+DB_SYNCHRONOUS = "NORMAL"            # در حالت WAL امن است و fsync کمتری دارد
+DB_CACHE_SIZE_KB = 16 * 1024
+DB_MMAP_SIZE_BYTES = 64 * 1024 * 1024
+DB_BUSY_TIMEOUT_MS = 5000
+
+# --- Usage Snapshot Retention ---
+# اسنپ‌شات‌های خام باید حداقل یک روز کامل نگه داشته شوند (مصرف امروز از آن‌ها محاسبه می‌شود)
+USAGE_RAW_RETENTION_HOURS = 48
+USAGE_HOURLY_RETENTION_DAYS = 35
+USAGE_DAILY_RETENTION_DAYS = 400
+
+# بازه‌های نمایش داده شده در «آمار مصرف سرور» (به ساعت)
+USAGE_INTERVAL_HOURS = [3, 6, 12, 24]
+
 # --- API Settings ---
 API_TIMEOUT = 15
 API_RETRY_COUNT = 3
 
+# هر دو پنل به صورت همزمان خوانده می‌شوند؛ پنلی که در این زمان پاسخ ندهد نادیده گرفته می‌شود
+PANEL_FETCH_PARALLEL = True
+PANEL_FETCH_TIMEOUT = API_TIMEOUT * 2
+
+# حداکثر درخواست‌های همزمان به هر پنل (کلاینت async در async_http.py)
+PANEL_HTTP_CONCURRENCY = 20
+
+# لیست کاربران مرزبان صفحه‌به‌صفحه (offset/limit) دریافت می‌شود؛ چند صفحه به صورت همزمان
+MARZBAN_PAGE_SIZE = 500
+MARZBAN_PAGE_CONCURRENCY = 4
+
+# لیست کامل کاربران هیدیفای به صورت جریانی (تکه به تکه) خوانده و تجزیه می‌شود؛ اندازه هر تکه (بایت)
+PANEL_STREAM_CHUNK_SIZE = 64 * 1024
+
+# تعداد زمان‌های پردازش‌شده (آخرین اتصال، تاریخ انقضا) که برای دریافت‌های بعدی در حافظه نگه داشته می‌شوند
+NORMALIZE_CACHE_SIZE = 65536
+
+# فاصله ویرایش پیام پیشرفت در عملیات گروهی (ثانیه)
+BULK_PROGRESS_INTERVAL = 3
+
+# --- Scheduler ---
+# همه‌ی جاب‌هایی که در این بازه (ثانیه) اجرا شوند از یک لیست کاربران مشترک استفاده می‌کنند
+SCHEDULER_SNAPSHOT_MAX_AGE = 120
+SCHEDULER_WORKERS = 4             # جاب‌های مستقل به صورت همزمان اجرا می‌شوند
+NIGHTLY_REPORT_WORKERS = 4        # تعداد ترد‌های ساخت گزارش‌های شبانه‌ی کاربران
+NIGHTLY_REPORT_CHUNK_SIZE = 50    # تعداد کاربرانی که هر ترد در هر مرحله گزارششان را می‌سازد
+
+# --- Outbound Telegram Queue ---
+# محدودیت‌های تلگرام: حدود ۳۰ پیام در ثانیه در کل، ۱ پیام در ثانیه برای هر چت خصوصی و ۲۰ پیام در دقیقه برای گروه‌ها
+OUTBOUND_GLOBAL_RATE = 30
+OUTBOUND_CHAT_INTERVAL = 1.0
+OUTBOUND_GROUP_CHAT_INTERVAL = 3.0
+OUTBOUND_WORKERS = 8
+OUTBOUND_MAX_FLOOD_RETRIES = 5
+# حداکثر زمان انتظار (ثانیه) برای نتیجه یک پیام صف‌شده در کارهای زمان‌بندی‌شده
+OUTBOUND_RESULT_TIMEOUT = 300
+
+# --- Broadcast Jobs ---
+BROADCAST_BATCH_SIZE = 100        # تعداد گیرندگانی که در هر مرحله در صف ارسال قرار می‌گیرند
+BROADCAST_STATUS_INTERVAL = 10    # فاصله به‌روزرسانی پیام وضعیت ارسال (ثانیه)
+
+# --- Update Ingestion (polling / webhook) ---
+# در حالت webhook تلگرام آپدیت‌ها را به WEBHOOK_URL ارسال می‌کند و یک سرور محلی آن‌ها را در صف پردازش قرار می‌دهد
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()                  # polling | webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")              # آدرس عمومی https (پشت reverse proxy)
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_LISTEN_HOST = os.getenv("WEBHOOK_LISTEN_HOST", "127.0.0.1")
+WEBHOOK_LISTEN_PORT = int(os.getenv("WEBHOOK_LISTEN_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")                    # در صورت خالی بودن، هنگام اجرا ساخته می‌شود
+WEBHOOK_QUEUE_SIZE = 1000         # با پر شدن صف، پاسخ 503 داده می‌شود تا تلگرام بعداً دوباره ارسال کند
+WEBHOOK_MAX_CONNECTIONS = 40      # حداکثر اتصال همزمان تلگرام به وب‌هوک
+
+# --- Update Handlers ---
+# آپدیت‌های هر کاربر به ترتیب و یکی‌یکی اجرا می‌شوند؛ آپدیت‌های کاربران مختلف به صورت همزمان
+HANDLER_WORKERS = 16
+HANDLER_MAX_PENDING = 500         # با رسیدن به این تعداد آپدیت در انتظار، دریافت آپدیت جدید متوقف می‌شود
+
+# --- Metrics ---
+# آمار داخلی ربات با فرمت Prometheus روی http://METRICS_LISTEN_HOST:METRICS_PORT/metrics (مقدار 0 یعنی غیرفعال)
+METRICS_LISTEN_HOST = os.getenv("METRICS_LISTEN_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
 # --- Emojis & Visuals ---
 EMOJIS = {
     "fire": "🔥", "chart": "📊", "warning": "⚠️", "error": "❌",
@@ -3,10 +3,15 @@ import sys
 import signal
 import time
 from datetime import datetime
-from telebot import TeleBot
 
-from config import LOG_LEVEL, ADMIN_IDS, BOT_TOKEN
+from config import LOG_LEVEL, ADMIN_IDS, BOT_TOKEN, BOT_MODE
 from database import db
+from async_http import shutdown_async_clients
+from outbound import outbound
+from broadcast_runner import broadcast_runner
+from webhook_server import webhook_server
+from update_dispatcher import DispatchingTeleBot, update_dispatcher
+from metrics import metrics_server
 from scheduler import SchedulerManager
 from user_handlers import register_user_handlers
 from admin_router import register_admin_handlers
@@ -67,7 +72,8 @@ root_logger.addHandler(stream_handler)
 logger = logging.getLogger(__name__)
 
 # Create the single bot instance
-bot = TeleBot(BOT_TOKEN, parse_mode=None)
+# Handlers run on the update dispatcher (ordered per user) instead of telebot's own thread pool
+bot = DispatchingTeleBot(BOT_TOKEN, update_dispatcher, parse_mode=None)
 initialize_utils(bot)
 scheduler = SchedulerManager(bot)
 
@@ -109,6 +115,9 @@ class HiddifyBot:
             db.user(0)  # Test DB connection
             logger.info("✅ SQLite ready")
 
+            metrics_server.start()
+            outbound.start(bot)
+            broadcast_runner.start()
             scheduler.start()
             logger.info("✅ Scheduler thread started")
 
@@ -117,7 +126,13 @@ class HiddifyBot:
             self.running = True
             self.started_at = datetime.now()
 
+            if BOT_MODE == "webhook":
+                logger.info("🚀 Webhook mode...")
+                webhook_server.serve(self.bot)
+                return
+
             logger.info("🚀 Polling...")
+            self.bot.remove_webhook()
             while self.running:
                 try:
                     self.bot.infinity_polling(timeout=20, skip_pending=True)
@@ -138,8 +153,21 @@ class HiddifyBot:
         try:
             scheduler.shutdown()
             logger.info("Scheduler stopped")
-            self.bot.stop_polling()
-            logger.info("Telegram polling stopped")
+            if BOT_MODE == "webhook":
+                webhook_server.stop()
+                logger.info("Webhook server stopped")
+            else:
+                self.bot.stop_polling()
+                logger.info("Telegram polling stopped")
+            update_dispatcher.shutdown()
+            broadcast_runner.stop()
+            outbound.stop()
+            # Sends outbound dropped come back as OutboundStopped; let the runner record the rest before the DB closes
+            broadcast_runner.join(5)
+            logger.info(f"SQLite connection stats: {db.pool_stats()}")
+            db.close_all()
+            shutdown_async_clients()
+            metrics_server.stop()
             if self.started_at:
                 uptime = datetime.now() - self.started_at
                 logger.info(f"Uptime: {uptime}")
@@ -1,27 +1,92 @@
 # -*- coding: utf-8 -*-
 
 import sqlite3
+import threading
+from bisect import bisect_left
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 import logging
 import pytz
+from metrics import registry, instrument_methods
+from config import (DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_BYTES, DB_BUSY_TIMEOUT_MS,
+                    USAGE_RAW_RETENTION_HOURS, USAGE_HOURLY_RETENTION_DAYS, USAGE_DAILY_RETENTION_DAYS,
+                    USAGE_INTERVAL_HOURS)
 
 logger = logging.getLogger(__name__)
 
+@instrument_methods('db_calls_total', 'db_call_duration_seconds', 'SQLite DatabaseManager', exclude=('pool_stats', 'close_all'))
 class DatabaseManager:
+    # Keeps "IN (...)" queries below SQLite's default host-parameter limit (999).
+    SQL_VARIABLE_CHUNK = 900
+    # Rollup tiers for usage_snapshots; buckets follow Tehran local hours/days.
+    ROLLUP_TABLES = {'hour': 'usage_rollup_hourly', 'day': 'usage_rollup_daily'}
+
     def __init__(self, path: str = "bot_data.db"):
         self.path = path
+        # One cached connection per thread (scheduler, telebot workers, ...).
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._connections: Dict[int, tuple] = {}  # thread ident -> (thread, connection)
+        self._opened_count = 0
+        self._reused_count = 0
         self._init_db()
 
     def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
-        conn.execute("PRAGMA journal_mode=WAL")
+        """Returns this thread's connection, opening and configuring it on first use.
+        `with self._conn() as c:` still commits/rolls back, but no longer closes the connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._pool_lock:
+                self._reused_count += 1
+            return conn
+
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES,
+                               timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
         conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS};")
+        conn.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)};")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE_BYTES)};")
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)};")
         conn.row_factory = sqlite3.Row
+        self._local.conn = conn
+
+        current = threading.current_thread()
+        with self._pool_lock:
+            self._opened_count += 1
+            self._connections[current.ident] = (current, conn)
+            # Close connections left behind by threads that have finished.
+            for ident, (thread, old_conn) in list(self._connections.items()):
+                if not thread.is_alive():
+                    old_conn.close()
+                    del self._connections[ident]
         return conn
 
+    def pool_stats(self) -> Dict[str, int]:
+        """Connection counters: how many were opened vs. served from the per-thread cache."""
+        with self._pool_lock:
+            return {
+                'opened': self._opened_count,
+                'reused': self._reused_count,
+                'open_connections': len(self._connections)
+            }
+
+    def close_all(self) -> None:
+        """Closes every cached connection (used on shutdown)."""
+        with self._pool_lock:
+            for _thread, conn in self._connections.values():
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not close SQLite connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
     def _init_db(self) -> None:
         with self._conn() as c:
+            # journal_mode is persistent in the database file, so it only needs to be set once.
+            c.execute("PRAGMA journal_mode=WAL")
             try:
                 c.execute("ALTER TABLE users ADD COLUMN data_warning_hiddify INTEGER DEFAULT 1;")
                 logger.info("Column 'data_warning_hiddify' added to 'users' table.")
@@ -67,6 +132,28 @@ class DatabaseManager:
                                     taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                                     FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
                                 );
+                                CREATE TABLE IF NOT EXISTS usage_rollup_hourly (
+                                    uuid_id INTEGER NOT NULL,
+                                    bucket_start TIMESTAMP NOT NULL,
+                                    first_at TIMESTAMP NOT NULL,
+                                    last_at TIMESTAMP NOT NULL,
+                                    hiddify_first REAL, hiddify_last REAL, hiddify_min REAL, hiddify_max REAL,
+                                    marzban_first REAL, marzban_last REAL, marzban_min REAL, marzban_max REAL,
+                                    samples INTEGER DEFAULT 0,
+                                    PRIMARY KEY (uuid_id, bucket_start),
+                                    FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+                                );
+                                CREATE TABLE IF NOT EXISTS usage_rollup_daily (
+                                    uuid_id INTEGER NOT NULL,
+                                    bucket_start TIMESTAMP NOT NULL,
+                                    first_at TIMESTAMP NOT NULL,
+                                    last_at TIMESTAMP NOT NULL,
+                                    hiddify_first REAL, hiddify_last REAL, hiddify_min REAL, hiddify_max REAL,
+                                    marzban_first REAL, marzban_last REAL, marzban_min REAL, marzban_max REAL,
+                                    samples INTEGER DEFAULT 0,
+                                    PRIMARY KEY (uuid_id, bucket_start),
+                                    FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+                                );
                                 CREATE TABLE IF NOT EXISTS scheduled_messages (
                                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                                     job_type TEXT NOT NULL,
@@ -82,6 +169,34 @@ class DatabaseManager:
                                     sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                                     UNIQUE(uuid_id, warning_type)
                                 );
+                                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    admin_id INTEGER NOT NULL,
+                                    from_chat_id INTEGER NOT NULL,
+                                    message_id INTEGER NOT NULL,
+                                    target_group TEXT,
+                                    status_message_id INTEGER,
+                                    status TEXT NOT NULL DEFAULT 'pending', -- pending, running, done
+                                    total INTEGER DEFAULT 0,
+                                    sent INTEGER DEFAULT 0,
+                                    failed INTEGER DEFAULT 0,
+                                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                    finished_at TIMESTAMP
+                                );
+                                CREATE TABLE IF NOT EXISTS broadcast_targets (
+                                    job_id INTEGER NOT NULL,
+                                    user_id INTEGER NOT NULL,
+                                    status TEXT NOT NULL DEFAULT 'pending', -- pending, sent, failed
+                                    error TEXT,
+                                    PRIMARY KEY (job_id, user_id),
+                                    FOREIGN KEY(job_id) REFERENCES broadcast_jobs(id) ON DELETE CASCADE
+                                );
+                                CREATE TABLE IF NOT EXISTS scheduler_jobs (
+                                    name TEXT PRIMARY KEY,
+                                    last_run_at TIMESTAMP NOT NULL,
+                                    last_duration REAL,
+                                    last_error TEXT
+                                );
                                 CREATE TABLE IF NOT EXISTS payments (
                                     payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
                                     uuid_id INTEGER NOT NULL,
@@ -91,9 +206,21 @@ class DatabaseManager:
                                     CREATE INDEX IF NOT EXISTS idx_user_uuids_uuid ON user_uuids(uuid);
                                     CREATE INDEX IF NOT EXISTS idx_user_uuids_user_id ON user_uuids(user_id);
                                     CREATE INDEX IF NOT EXISTS idx_snapshots_uuid_id_taken_at ON usage_snapshots(uuid_id, taken_at);
+                                    CREATE INDEX IF NOT EXISTS idx_snapshots_taken_at ON usage_snapshots(taken_at);
+                                    CREATE INDEX IF NOT EXISTS idx_rollup_hourly_bucket ON usage_rollup_hourly(bucket_start);
+                                    CREATE INDEX IF NOT EXISTS idx_rollup_daily_bucket ON usage_rollup_daily(bucket_start);
                                     CREATE INDEX IF NOT EXISTS idx_scheduled_messages_job_type ON scheduled_messages(job_type);
                                     CREATE INDEX IF NOT EXISTS idx_warning_log_uuid_type ON warning_log(uuid_id, warning_type);
+                                    CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status);
+                                    CREATE INDEX IF NOT EXISTS idx_broadcast_targets_status ON broadcast_targets(job_id, status);
                             """)
+            if c.execute("PRAGMA user_version").fetchone()[0] < 1:
+                # Welcome messages were never actually sent before; accounts that already connected
+                # must not all get one at once now that they are.
+                marked = c.execute("UPDATE user_uuids SET welcome_message_sent = 1 "
+                                   "WHERE first_connection_time IS NOT NULL AND welcome_message_sent = 0").rowcount
+                c.execute("PRAGMA user_version = 1")
+                logger.info(f"Marked {marked} already-connected accounts as welcomed.")
         logger.info("SQLite schema and indexes are ready.")
 
     def add_usage_snapshot(self, uuid_id: int, hiddify_usage: float, marzban_usage: float) -> None:
@@ -103,12 +230,34 @@ class DatabaseManager:
                 (uuid_id, hiddify_usage, marzban_usage, datetime.now(pytz.utc))
             )
 
-    def get_usage_since_midnight(self, uuid_id: int) -> Dict[str, float]:
-        """Calculates daily usage for both panels with a single, simplified, and robust query."""
+    def add_usage_snapshots(self, rows: List[tuple]) -> int:
+        """Inserts many (uuid_id, hiddify_usage, marzban_usage) snapshots in a single transaction."""
+        if not rows: return 0
+        taken_at = datetime.now(pytz.utc)
+        with self._conn() as c:
+            c.executemany(
+                "INSERT INTO usage_snapshots (uuid_id, hiddify_usage_gb, marzban_usage_gb, taken_at) VALUES (?, ?, ?, ?)",
+                [(uuid_id, h_usage, m_usage, taken_at) for uuid_id, h_usage, m_usage in rows]
+            )
+        return len(rows)
+
+    @staticmethod
+    def _today_midnight_utc() -> datetime:
+        """Start of the current day in Tehran, expressed in UTC (snapshots are stored in UTC)."""
         tehran_tz = pytz.timezone("Asia/Tehran")
         today_midnight_tehran = datetime.now(tehran_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_midnight_utc = today_midnight_tehran.astimezone(pytz.utc)
-        
+        return today_midnight_tehran.astimezone(pytz.utc)
+
+    @staticmethod
+    def _daily_usage_from_row(row) -> Dict[str, float]:
+        # Use max(0, ...) to prevent negative results if usage resets during the day
+        return {
+            'hiddify': max(0, row['h_diff'] or 0.0),
+            'marzban': max(0, row['m_diff'] or 0.0)
+        }
+
+    def get_usage_since_midnight(self, uuid_id: int) -> Dict[str, float]:
+        """Calculates daily usage for both panels with a single, simplified, and robust query."""
         result = {'hiddify': 0.0, 'marzban': 0.0}
 
         with self._conn() as c:
@@ -120,39 +269,241 @@ class DatabaseManager:
                 FROM usage_snapshots
                 WHERE uuid_id = ? AND taken_at >= ?;
             """
-            params = (uuid_id, today_midnight_utc)
+            params = (uuid_id, self._today_midnight_utc())
             row = c.execute(query, params).fetchone()
 
             if row:
-                # Use max(0, ...) to prevent negative results if usage resets during the day
-                result['hiddify'] = max(0, row['h_diff'] or 0.0)
-                result['marzban'] = max(0, row['m_diff'] or 0.0)
+                result = self._daily_usage_from_row(row)
 
         return result
-    
-    def get_panel_usage_in_intervals(self, uuid_id: int, panel_name: str) -> Dict[int, float]:
-        if panel_name not in ['hiddify_usage_gb', 'marzban_usage_gb']:
-            return {}
 
-        now_utc = datetime.now(pytz.utc)
-        intervals = {3: 0.0, 6: 0.0, 12: 0.0, 24: 0.0}
-        
+    def get_usage_since_midnight_bulk(self, uuid_ids: List[int]) -> Dict[int, Dict[str, float]]:
+        """Daily usage of several accounts from one GROUP BY scan per chunk of ids.
+        Every requested id is present in the result (0.0 when it has no snapshots today)."""
+        result = {uuid_id: {'hiddify': 0.0, 'marzban': 0.0} for uuid_id in uuid_ids}
+        if not result: return result
+
+        ids = list(result)
+        since = self._today_midnight_utc()
         with self._conn() as c:
-            for hours in intervals.keys():
-                time_ago = now_utc - timedelta(hours=hours)
-                
+            for i in range(0, len(ids), self.SQL_VARIABLE_CHUNK):
+                chunk = ids[i:i + self.SQL_VARIABLE_CHUNK]
+                placeholders = ','.join('?' for _ in chunk)
                 query = f"""
-                    SELECT
-                        (SELECT {panel_name} FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at ASC LIMIT 1) as start_usage,
-                        (SELECT {panel_name} FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at DESC LIMIT 1) as end_usage
+                    SELECT uuid_id,
+                        (MAX(hiddify_usage_gb) - MIN(hiddify_usage_gb)) as h_diff,
+                        (MAX(marzban_usage_gb) - MIN(marzban_usage_gb)) as m_diff
+                    FROM usage_snapshots
+                    WHERE uuid_id IN ({placeholders}) AND taken_at >= ?
+                    GROUP BY uuid_id
                 """
-                params = (uuid_id, time_ago, uuid_id, time_ago)
-                row = c.execute(query, params).fetchone()
-                
-                if row and row['start_usage'] is not None and row['end_usage'] is not None:
-                    intervals[hours] = max(0, row['end_usage'] - row['start_usage'])
-                    
-        return intervals
+                for row in c.execute(query, (*chunk, since)):
+                    result[row['uuid_id']] = self._daily_usage_from_row(row)
+        return result
+
+    def get_usage_since_midnight_all(self) -> Dict[int, Dict[str, float]]:
+        """Daily usage of every account that has snapshots today, keyed by uuid_id."""
+        query = """
+            SELECT uuid_id,
+                (MAX(hiddify_usage_gb) - MIN(hiddify_usage_gb)) as h_diff,
+                (MAX(marzban_usage_gb) - MIN(marzban_usage_gb)) as m_diff
+            FROM usage_snapshots
+            WHERE taken_at >= ?
+            GROUP BY uuid_id
+        """
+        with self._conn() as c:
+            rows = c.execute(query, (self._today_midnight_utc(),)).fetchall()
+            return {row['uuid_id']: self._daily_usage_from_row(row) for row in rows}
+
+    def get_usage_since_midnight_all_by_uuid(self) -> Dict[str, Dict[str, float]]:
+        """Same as get_usage_since_midnight_all, but keyed by the UUID string."""
+        query = """
+            SELECT uu.uuid,
+                (MAX(s.hiddify_usage_gb) - MIN(s.hiddify_usage_gb)) as h_diff,
+                (MAX(s.marzban_usage_gb) - MIN(s.marzban_usage_gb)) as m_diff
+            FROM usage_snapshots s
+            JOIN user_uuids uu ON uu.id = s.uuid_id
+            WHERE s.taken_at >= ?
+            GROUP BY s.uuid_id
+        """
+        with self._conn() as c:
+            rows = c.execute(query, (self._today_midnight_utc(),)).fetchall()
+            return {row['uuid']: self._daily_usage_from_row(row) for row in rows}
+    
+    # ------------------------------------------------------------------
+    # Usage rollups: raw snapshots -> hourly buckets -> daily buckets
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _parse_db_timestamp(value: str) -> datetime:
+        """Parses a timestamp read as TEXT; naive values are stored in UTC."""
+        dt_obj = datetime.fromisoformat(value)
+        return dt_obj.astimezone(pytz.utc) if dt_obj.tzinfo else pytz.utc.localize(dt_obj)
+
+    @staticmethod
+    def _bucket_start(moment: datetime, unit: str) -> datetime:
+        """Start of the Tehran-local hour/day containing `moment`, as a naive UTC datetime."""
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        local = moment.astimezone(tehran_tz)
+        local = local.replace(minute=0, second=0, microsecond=0)
+        if unit == 'day':
+            local = local.replace(hour=0)
+        return tehran_tz.normalize(local).astimezone(pytz.utc).replace(tzinfo=None)
+
+    @staticmethod
+    def _merge_usage_point(bucket: Optional[list], point: tuple) -> list:
+        """Folds a usage point (first_at, last_at, h_first, h_last, h_min, h_max,
+        m_first, m_last, m_min, m_max, samples) into a bucket; points arrive in time order."""
+        if bucket is None:
+            return list(point)
+        bucket[1], bucket[3], bucket[7] = point[1], point[3], point[7]
+        bucket[4], bucket[5] = min(bucket[4], point[4]), max(bucket[5], point[5])
+        bucket[8], bucket[9] = min(bucket[8], point[8]), max(bucket[9], point[9])
+        bucket[10] += point[10]
+        return bucket
+
+    def _upsert_rollup_buckets(self, c: sqlite3.Connection, table: str, buckets: Dict[tuple, list]) -> None:
+        c.executemany(f"""
+            INSERT INTO {table} (uuid_id, bucket_start, first_at, last_at,
+                hiddify_first, hiddify_last, hiddify_min, hiddify_max,
+                marzban_first, marzban_last, marzban_min, marzban_max, samples)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(uuid_id, bucket_start) DO UPDATE SET
+                hiddify_first = CASE WHEN excluded.first_at < first_at THEN excluded.hiddify_first ELSE hiddify_first END,
+                marzban_first = CASE WHEN excluded.first_at < first_at THEN excluded.marzban_first ELSE marzban_first END,
+                hiddify_last = CASE WHEN excluded.last_at > last_at THEN excluded.hiddify_last ELSE hiddify_last END,
+                marzban_last = CASE WHEN excluded.last_at > last_at THEN excluded.marzban_last ELSE marzban_last END,
+                first_at = MIN(first_at, excluded.first_at),
+                last_at = MAX(last_at, excluded.last_at),
+                hiddify_min = MIN(hiddify_min, excluded.hiddify_min),
+                hiddify_max = MAX(hiddify_max, excluded.hiddify_max),
+                marzban_min = MIN(marzban_min, excluded.marzban_min),
+                marzban_max = MAX(marzban_max, excluded.marzban_max),
+                samples = samples + excluded.samples
+        """, [
+            (uuid_id, bucket_start, b[0].replace(tzinfo=None), b[1].replace(tzinfo=None), *b[2:])
+            for (uuid_id, bucket_start), b in buckets.items()
+        ])
+
+    def _rollup_rows(self, c: sqlite3.Connection, rows, unit: str) -> Dict[tuple, list]:
+        buckets: Dict[tuple, list] = {}
+        for row in rows:
+            point = (self._parse_db_timestamp(row['first_at']), self._parse_db_timestamp(row['last_at']), *tuple(row)[3:])
+            key = (row['uuid_id'], self._bucket_start(point[0], unit))
+            buckets[key] = self._merge_usage_point(buckets.get(key), point)
+        return buckets
+
+    def rollup_usage_snapshots(self) -> Dict[str, int]:
+        """
+        Compacts raw snapshots older than USAGE_RAW_RETENTION_HOURS into hourly buckets,
+        hourly buckets older than USAGE_HOURLY_RETENTION_DAYS into daily buckets, and drops
+        daily buckets older than USAGE_DAILY_RETENTION_DAYS. Runs in a single transaction,
+        so a moment in time is always represented by exactly one tier.
+        """
+        now_utc = datetime.now(pytz.utc)
+        raw_cutoff = pytz.utc.localize(self._bucket_start(now_utc - timedelta(hours=USAGE_RAW_RETENTION_HOURS), 'hour'))
+        hourly_cutoff = self._bucket_start(now_utc - timedelta(days=USAGE_HOURLY_RETENTION_DAYS), 'day')
+        daily_cutoff = self._bucket_start(now_utc - timedelta(days=USAGE_DAILY_RETENTION_DAYS), 'day')
+        stats = {}
+
+        with self._conn() as c:
+            raw_rows = c.execute("""
+                SELECT uuid_id, CAST(taken_at AS TEXT) AS first_at, CAST(taken_at AS TEXT) AS last_at,
+                    hiddify_usage_gb, hiddify_usage_gb, hiddify_usage_gb, hiddify_usage_gb,
+                    marzban_usage_gb, marzban_usage_gb, marzban_usage_gb, marzban_usage_gb, 1
+                FROM usage_snapshots WHERE taken_at < ? ORDER BY uuid_id, taken_at
+            """, (raw_cutoff,))
+            hourly = self._rollup_rows(c, raw_rows, 'hour')
+            self._upsert_rollup_buckets(c, self.ROLLUP_TABLES['hour'], hourly)
+            stats['raw_deleted'] = c.execute("DELETE FROM usage_snapshots WHERE taken_at < ?", (raw_cutoff,)).rowcount
+            stats['hourly_buckets'] = len(hourly)
+
+            hourly_rows = c.execute(f"""
+                SELECT uuid_id, CAST(first_at AS TEXT) AS first_at, CAST(last_at AS TEXT) AS last_at,
+                    hiddify_first, hiddify_last, hiddify_min, hiddify_max,
+                    marzban_first, marzban_last, marzban_min, marzban_max, samples
+                FROM {self.ROLLUP_TABLES['hour']} WHERE bucket_start < ? ORDER BY uuid_id, bucket_start
+            """, (hourly_cutoff,))
+            daily = self._rollup_rows(c, hourly_rows, 'day')
+            self._upsert_rollup_buckets(c, self.ROLLUP_TABLES['day'], daily)
+            stats['hourly_deleted'] = c.execute(f"DELETE FROM {self.ROLLUP_TABLES['hour']} WHERE bucket_start < ?", (hourly_cutoff,)).rowcount
+            stats['daily_buckets'] = len(daily)
+
+            stats['daily_deleted'] = c.execute(f"DELETE FROM {self.ROLLUP_TABLES['day']} WHERE bucket_start < ?", (daily_cutoff,)).rowcount
+
+        logger.info(f"Usage rollup finished: {stats}")
+        return stats
+
+    def _usage_points(self, c: sqlite3.Connection, uuid_ids: List[int], since: datetime) -> List[tuple]:
+        """
+        Usage points of the given accounts starting at or after `since`, read from whichever
+        tier holds each period (raw snapshots, hourly or daily buckets). Every point is
+        (uuid_id, first_at, last_at, h_first, h_last, h_min, h_max, m_first, m_last, m_min, m_max),
+        sorted by uuid_id and time.
+        """
+        since_utc = since.astimezone(pytz.utc)
+        since_naive = since_utc.replace(tzinfo=None)
+        points = []
+        for i in range(0, len(uuid_ids), self.SQL_VARIABLE_CHUNK):
+            chunk = uuid_ids[i:i + self.SQL_VARIABLE_CHUNK]
+            placeholders = ','.join('?' for _ in chunk)
+            rollup_select = """
+                SELECT uuid_id, CAST(first_at AS TEXT), CAST(last_at AS TEXT),
+                    hiddify_first, hiddify_last, hiddify_min, hiddify_max,
+                    marzban_first, marzban_last, marzban_min, marzban_max
+                FROM {table} WHERE uuid_id IN ({placeholders}) AND first_at >= ?
+            """
+            query = f"""
+                SELECT uuid_id, CAST(taken_at AS TEXT), CAST(taken_at AS TEXT),
+                    hiddify_usage_gb, hiddify_usage_gb, hiddify_usage_gb, hiddify_usage_gb,
+                    marzban_usage_gb, marzban_usage_gb, marzban_usage_gb, marzban_usage_gb
+                FROM usage_snapshots WHERE uuid_id IN ({placeholders}) AND taken_at >= ?
+                UNION ALL {rollup_select.format(table=self.ROLLUP_TABLES['hour'], placeholders=placeholders)}
+                UNION ALL {rollup_select.format(table=self.ROLLUP_TABLES['day'], placeholders=placeholders)}
+            """
+            params = (*chunk, since_utc, *chunk, since_naive, *chunk, since_naive)
+            for row in c.execute(query, params):
+                points.append((row[0], self._parse_db_timestamp(row[1]), self._parse_db_timestamp(row[2]), *tuple(row)[3:]))
+        points.sort(key=lambda p: (p[0], p[1]))
+        return points
+
+    def get_usage_in_windows(self, uuid_ids: List[int], windows: List[timedelta]) -> Dict[int, Dict[timedelta, Dict[str, float]]]:
+        """
+        Usage of each account over every window ending now (e.g. 1h, 24h, 7d, 30d).
+        All windows are answered from one range scan of the largest window; each window's
+        usage is the last reading minus the first reading taken inside it.
+        """
+        windows = sorted(set(windows))
+        result = {uuid_id: {w: {'hiddify': 0.0, 'marzban': 0.0} for w in windows} for uuid_id in uuid_ids}
+        if not result or not windows:
+            return result
+
+        now_utc = datetime.now(pytz.utc)
+        with self._conn() as c:
+            points = self._usage_points(c, list(result), now_utc - windows[-1])
+
+        for uuid_id, group in groupby(points, key=itemgetter(0)):
+            group = list(group)
+            starts = [point[1] for point in group]
+            last = group[-1]
+            for window in windows:
+                i = bisect_left(starts, now_utc - window)
+                if i < len(group):
+                    first = group[i]
+                    result[uuid_id][window] = {
+                        'hiddify': max(0, last[4] - first[3]),
+                        'marzban': max(0, last[8] - first[7])
+                    }
+        return result
+
+    def get_panel_usage_in_intervals(self, uuid_id: int, panel_name: str, hours: Optional[List[int]] = None) -> Dict[int, float]:
+        if panel_name not in ['hiddify_usage_gb', 'marzban_usage_gb']:
+            return {}
+
+        panel = panel_name.replace('_usage_gb', '')
+        hours = hours or USAGE_INTERVAL_HOURS
+        windows = self.get_usage_in_windows([uuid_id], [timedelta(hours=h) for h in hours])[uuid_id]
+        return {h: windows[timedelta(hours=h)][panel] for h in hours}
         
     def log_warning(self, uuid_id: int, warning_type: str):
         with self._conn() as c:
@@ -171,6 +522,62 @@ class DatabaseManager:
             ).fetchone()
             return row is not None
 
+    def get_warning_candidates(self) -> List[Dict[str, Any]]:
+        """Every active account with its owner's notification settings, in one query (warnings job)."""
+        query = """
+            SELECT uu.id, uu.user_id, uu.uuid, uu.welcome_message_sent,
+                   CAST(uu.first_connection_time AS TEXT) AS first_connection_time,
+                   COALESCE(u.expiry_warnings, 1) AS expiry_warnings,
+                   COALESCE(u.data_warning_hiddify, 1) AS data_warning_hiddify,
+                   COALESCE(u.data_warning_marzban, 1) AS data_warning_marzban
+            FROM user_uuids uu
+            LEFT JOIN users u ON u.user_id = uu.user_id
+            WHERE uu.is_active = 1
+        """
+        with self._conn() as c:
+            rows = c.execute(query).fetchall()
+        candidates = []
+        for row in rows:
+            candidate = dict(row)
+            if candidate['first_connection_time']:
+                candidate['first_connection_time'] = self._parse_db_timestamp(candidate['first_connection_time'])
+            for setting in ('expiry_warnings', 'data_warning_hiddify', 'data_warning_marzban', 'welcome_message_sent'):
+                candidate[setting] = bool(candidate[setting])
+            candidates.append(candidate)
+        return candidates
+
+    def get_recent_warnings(self, hours: int = 24) -> set:
+        """(uuid_id, warning_type) pairs logged in the last `hours` hours."""
+        time_ago = datetime.now(pytz.utc) - timedelta(hours=hours)
+        with self._conn() as c:
+            rows = c.execute("SELECT uuid_id, warning_type FROM warning_log WHERE sent_at >= ?", (time_ago,)).fetchall()
+            return {(row['uuid_id'], row['warning_type']) for row in rows}
+
+    def log_warnings(self, rows: List[tuple]) -> int:
+        """Batch version of log_warning for (uuid_id, warning_type) pairs."""
+        if not rows:
+            return 0
+        now = datetime.now(pytz.utc)
+        with self._conn() as c:
+            c.executemany(
+                "INSERT INTO warning_log (uuid_id, warning_type, sent_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(uuid_id, warning_type) DO UPDATE SET sent_at=excluded.sent_at",
+                ((uuid_id, warning_type, now) for uuid_id, warning_type in rows)
+            )
+        return len(rows)
+
+    def set_first_connection_times(self, uuid_ids: List[int], time: datetime) -> None:
+        if not uuid_ids:
+            return
+        with self._conn() as c:
+            c.executemany("UPDATE user_uuids SET first_connection_time = ? WHERE id = ?", ((time, uuid_id) for uuid_id in uuid_ids))
+
+    def mark_welcome_messages_as_sent(self, uuid_ids: List[int]) -> None:
+        if not uuid_ids:
+            return
+        with self._conn() as c:
+            c.executemany("UPDATE user_uuids SET welcome_message_sent = 1 WHERE id = ?", ((uuid_id,) for uuid_id in uuid_ids))
+
     def get_user_ids_by_uuids(self, uuids: List[str]) -> List[int]:
         if not uuids: return []
         placeholders = ','.join('?' for _ in uuids)
@@ -209,6 +616,76 @@ class DatabaseManager:
         with self._conn() as c:
             c.execute("DELETE FROM scheduled_messages WHERE id=?", (job_id,))
             
+    def create_broadcast_job(self, admin_id: int, from_chat_id: int, message_id: int, target_group: str,
+                             user_ids: List[int], status_message_id: Optional[int] = None) -> int:
+        """Stores a broadcast and its (deduplicated) target list in one transaction; returns the job id."""
+        with self._conn() as c:
+            job_id = c.execute(
+                "INSERT INTO broadcast_jobs (admin_id, from_chat_id, message_id, target_group, status_message_id) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (admin_id, from_chat_id, message_id, target_group, status_message_id)
+            ).lastrowid
+            c.executemany("INSERT OR IGNORE INTO broadcast_targets (job_id, user_id) VALUES (?, ?)",
+                          ((job_id, user_id) for user_id in user_ids))
+            c.execute("UPDATE broadcast_jobs SET total = (SELECT COUNT(*) FROM broadcast_targets WHERE job_id = ?) WHERE id = ?",
+                      (job_id, job_id))
+            return job_id
+
+    def get_broadcast_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._conn() as c:
+            row = c.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    def get_unfinished_broadcast_jobs(self) -> List[int]:
+        with self._conn() as c:
+            rows = c.execute("SELECT id FROM broadcast_jobs WHERE status != 'done' ORDER BY id").fetchall()
+            return [row['id'] for row in rows]
+
+    def set_broadcast_job_status(self, job_id: int, status: str) -> None:
+        with self._conn() as c:
+            finished_at = datetime.now(pytz.utc) if status == 'done' else None
+            c.execute("UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE id = ?", (status, finished_at, job_id))
+
+    def get_pending_broadcast_targets(self, job_id: int, limit: int) -> List[int]:
+        with self._conn() as c:
+            rows = c.execute("SELECT user_id FROM broadcast_targets WHERE job_id = ? AND status = 'pending' ORDER BY user_id LIMIT ?",
+                             (job_id, limit)).fetchall()
+            return [row['user_id'] for row in rows]
+
+    def record_broadcast_results(self, job_id: int, results: List[tuple]) -> None:
+        """`results` holds (user_id, error) pairs, error None on success. Already-recorded targets are left untouched."""
+        sent = [(job_id, user_id) for user_id, error in results if error is None]
+        failed = [(error, job_id, user_id) for user_id, error in results if error is not None]
+        with self._conn() as c:
+            sent_count = c.executemany("UPDATE broadcast_targets SET status = 'sent' WHERE job_id = ? AND user_id = ? AND status = 'pending'",
+                                       sent).rowcount if sent else 0
+            failed_count = c.executemany("UPDATE broadcast_targets SET status = 'failed', error = ? WHERE job_id = ? AND user_id = ? AND status = 'pending'",
+                                         failed).rowcount if failed else 0
+            c.execute("UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ? WHERE id = ?",
+                      (sent_count, failed_count, job_id))
+
+    def get_broadcast_failure_reasons(self, job_id: int, limit: int = 5) -> List[tuple]:
+        """Most common failure reasons of a job as (error, count)."""
+        with self._conn() as c:
+            rows = c.execute("SELECT error, COUNT(*) AS n FROM broadcast_targets WHERE job_id = ? AND status = 'failed' "
+                             "GROUP BY error ORDER BY n DESC LIMIT ?", (job_id, limit)).fetchall()
+            return [(row['error'], row['n']) for row in rows]
+
+    def get_scheduler_job_runs(self) -> Dict[str, datetime]:
+        """Last start time (aware UTC) of every scheduler job that ever ran."""
+        with self._conn() as c:
+            rows = c.execute("SELECT name, CAST(last_run_at AS TEXT) AS last_run_at FROM scheduler_jobs").fetchall()
+            return {row['name']: self._parse_db_timestamp(row['last_run_at']).replace(tzinfo=pytz.utc) for row in rows}
+
+    def record_scheduler_job_run(self, name: str, started_at: datetime, duration: float, error: Optional[str]) -> None:
+        with self._conn() as c:
+            c.execute(
+                "INSERT INTO scheduler_jobs (name, last_run_at, last_duration, last_error) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET last_run_at=excluded.last_run_at, last_duration=excluded.last_duration, "
+                "last_error=excluded.last_error",
+                (name, started_at.astimezone(pytz.utc).replace(tzinfo=None), duration, error)
+            )
+
     def user(self, user_id: int) -> Optional[Dict[str, Any]]:
         with self._conn() as c:
             row = c.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
@@ -293,6 +770,25 @@ class DatabaseManager:
         with self._conn() as c:
             return [r['user_id'] for r in c.execute("SELECT user_id FROM users")]
         
+    def get_report_recipients(self) -> List[Dict[str, Any]]:
+        """Every bot user with their daily_reports setting and active accounts, in one query (nightly report)."""
+        query = """
+            SELECT u.user_id, u.daily_reports, uu.id AS uuid_id, uu.uuid
+            FROM users u
+            LEFT JOIN user_uuids uu ON uu.user_id = u.user_id AND uu.is_active = 1
+            ORDER BY u.user_id, uu.created_at
+        """
+        recipients: Dict[int, Dict[str, Any]] = {}
+        with self._conn() as c:
+            for row in c.execute(query):
+                recipient = recipients.setdefault(row['user_id'], {
+                    'user_id': row['user_id'],
+                    'daily_reports': bool(row['daily_reports']),
+                    'accounts': []})
+                if row['uuid_id'] is not None:
+                    recipient['accounts'].append({'id': row['uuid_id'], 'uuid': row['uuid']})
+        return list(recipients.values())
+
     def get_all_bot_users(self) -> List[Dict[str, Any]]:
         with self._conn() as c:
             rows = c.execute("SELECT user_id, username, first_name, last_name FROM users ORDER BY user_id").fetchall()
@@ -323,6 +819,8 @@ class DatabaseManager:
     def delete_user_snapshots(self, uuid_id: int) -> int:
         with self._conn() as c:
             cursor = c.execute("DELETE FROM usage_snapshots WHERE uuid_id = ?", (uuid_id,))
+            for table in self.ROLLUP_TABLES.values():
+                c.execute(f"DELETE FROM {table} WHERE uuid_id = ?", (uuid_id,))
             return cursor.rowcount
     
     def get_todays_birthdays(self) -> list:
@@ -370,13 +868,6 @@ class DatabaseManager:
                     result_map[row['uuid']] = dict(row)
         return result_map
     
-    def delete_daily_snapshots(self, uuid_id: int) -> None:
-        """Deletes all usage snapshots for a given uuid_id that were taken today (UTC)."""
-        today_start_utc = datetime.now(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-        with self._conn() as c:
-            c.execute("DELETE FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ?", (uuid_id, today_start_utc))
-            logger.info(f"Deleted daily snapshots for uuid_id {uuid_id}.")
-
     def set_first_connection_time(self, uuid_id: int, time: datetime):
         with self._conn() as c:
             c.execute("UPDATE user_uuids SET first_connection_time = ? WHERE id = ?", (time, uuid_id))
@@ -417,4 +908,5 @@ class DatabaseManager:
         with self._conn() as c:
             c.execute("UPDATE users SET admin_note = ? WHERE user_id = ?", (note, user_id))
 
-db = DatabaseManager()
\ No newline at end of file
+db = DatabaseManager()
+registry.callback('db_connections', 'SQLite connection pool counters.', lambda: {(k,): v for k, v in db.pool_stats().items()}, ('kind',))
@@ -1,98 +1,58 @@
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
-import pytz
-import requests
-from requests.adapters import HTTPAdapter, Retry
-from cachetools import cached
-from config import HIDDIFY_DOMAIN, ADMIN_PROXY_PATH, ADMIN_UUID, API_TIMEOUT, api_cache
-from utils import safe_float
+from typing import Dict, Any, Optional, List, Iterator
+from config import HIDDIFY_DOMAIN, ADMIN_PROXY_PATH, ADMIN_UUID
+from async_http import AsyncPanelClient, PanelRequest, PanelRequestError
+from json_stream import iter_json_items
+from panel_cache import panel_cache
+from user_normalizer import UserNormalizer
+from user_records import PanelUser
 
 logger = logging.getLogger(__name__)
 
 class HiddifyAPIHandler:
     def __init__(self):
-        self.base_url = f"{HIDDIFY_DOMAIN.rstrip('/')}/{ADMIN_PROXY_PATH.strip('/')}/api/v2/admin"
+        # The client is rooted at /api/v2 so admin (/admin/user/...) and panel (/panel/info/) endpoints share it
+        self.base_url = f"{HIDDIFY_DOMAIN.rstrip('/')}/{ADMIN_PROXY_PATH.strip('/')}/api/v2"
         self.api_key = ADMIN_UUID
-        self.tehran_tz = pytz.timezone("Asia/Tehran")
-        self.session = self._create_session()
+        self.client = AsyncPanelClient("Hiddify", self.base_url, self._headers)
 
-    def _create_session(self) -> requests.Session:
-        session = requests.Session()
-        session.headers.update({"Hiddify-API-Key": self.api_key, "Accept": "application/json"})
-        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
-        session.mount('https://', adapter)
-        return session
+    def _headers(self) -> Dict[str, str]:
+        return {"Hiddify-API-Key": self.api_key, "Accept": "application/json"}
 
     def _request(self, method: str, endpoint: str, **kwargs) -> Optional[Any]:
-        url = f"{self.base_url}{endpoint}"
-        try:
-            response = self.session.request(method, url, timeout=API_TIMEOUT, **kwargs)
-            response.raise_for_status()
-            return response.json() if response.status_code != 204 else True
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Hiddify API request failed: {method} {url} - {e}")
-            return None
+        """Sync facade over the pooled async client; returns the JSON body, True for 204, None on failure."""
+        response = self.client.run(PanelRequest(method, endpoint, **kwargs))
+        return response.data if response.ok else None
 
-    def _parse_api_datetime(self, date_str: Optional[str]) -> Optional[datetime]:
-        if not date_str or date_str.startswith('0001-01-01'):
-            return None
+    def _norm(self, raw: Dict[str, Any], normalizer: Optional[UserNormalizer] = None) -> Optional[PanelUser]:
+        return (normalizer or UserNormalizer('Hiddify')).hiddify(raw)
+
+    def get_all_users(self, force_refresh: bool = False) -> List[PanelUser]:
+        """فقط کاربران پنل Hiddify را برمیگرداند (از کش panel_cache)."""
+        return panel_cache.get('hiddify', self._fetch_all_users, force_refresh=force_refresh) or []
+
+    def _fetch_all_users(self) -> Optional[List[PanelUser]]:
+        """Downloads the full user list; returns None when the request fails."""
         try:
-            if 'Z' in date_str or '+' in date_str[10:] or '-' in date_str[10:]:
-                clean_str = date_str.replace('Z', '+00:00').split('.')[0]
-                dt_obj = datetime.fromisoformat(clean_str)
-            else:
-                dt_obj = datetime.fromisoformat(date_str.split('.')[0])
-                dt_obj = self.tehran_tz.localize(dt_obj)
-            return dt_obj
-        except (ValueError, TypeError):
-            logger.warning(f"Could not parse Hiddify datetime string: {date_str}")
+            return list(self.iter_users())
+        except (PanelRequestError, ValueError) as e:
+            logger.error(f"Hiddify: Failed to list users: {e}")
             return None
 
-    def _calculate_remaining_days(self, start_date_str: Optional[str], package_days: Optional[int]) -> Optional[int]:
-        if package_days in [None, 0]: return None
-        try:
-            start_date = datetime.fromisoformat(start_date_str.split('T')[0]).date()
-            expiration_date = start_date + timedelta(days=package_days)
-            return (expiration_date - datetime.now(self.tehran_tz).date()).days
-        except (ValueError, TypeError, AttributeError):
-            # Fallback to now if start_date is invalid
-            start_date = datetime.now(self.tehran_tz).date()
-            expiration_date = start_date + timedelta(days=package_days)
-            return (expiration_date - start_date).days
-
-    def _norm(self, raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-            if not isinstance(raw, dict): return None
-            
-            usage_limit = safe_float(raw.get("usage_limit_GB", 0))
-            current_usage = safe_float(raw.get("current_usage_GB", 0))
-            
-            normalized_data = {
-                "name": raw.get("name") or "کاربر ناشناس",
-                "uuid": raw.get("uuid", "").lower(),
-                "is_active": bool(raw.get("enable", False)),
-                "last_online": self._parse_api_datetime(raw.get("last_online")),
-                "usage_limit_GB": usage_limit,
-                "current_usage_GB": current_usage,
-                "remaining_GB": max(0, usage_limit - current_usage),
-                "usage_percentage": (current_usage / usage_limit * 100) if usage_limit > 0 else 0,
-                "expire": self._calculate_remaining_days(raw.get("start_date"), raw.get("package_days")),
-                "mode": raw.get("mode", "no_reset")
-            }
-            return normalized_data
-
-    @cached(api_cache)
-    def get_all_users(self) -> List[Dict[str, Any]]:
-        """فقط کاربران پنل Hiddify را برمیگرداند."""
-        data = self._request("GET", "/user/")
-        if not data: return []
-        raw_users = data if isinstance(data, list) else data.get("results", []) or data.get("users", [])
-        return [norm_user for u in raw_users if (norm_user := self._norm(u))]
+    def iter_users(self) -> Iterator[PanelUser]:
+        """
+        Streams /admin/user/ and yields normalized users while the body is still downloading, so the raw
+        payload and its decoded list are never held in full. Raises PanelRequestError or ValueError.
+        """
+        normalizer = UserNormalizer('Hiddify')
+        for raw in iter_json_items(self.client.stream(PanelRequest("GET", "/admin/user/"))):
+            if (norm_user := normalizer.hiddify(raw)):
+                yield norm_user
+        normalizer.report()
 
     def user_info(self, uuid: str) -> Optional[Dict[str, Any]]:
         """فقط اطلاعات یک کاربر از پنل Hiddify را برمیگرداند."""
-        data = self._request("GET", f"/user/{uuid}/")
+        data = self._request("GET", f"/admin/user/{uuid}/")
         return self._norm(data) if data else None
 
     def add_user(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -103,16 +63,20 @@ class HiddifyAPIHandler:
             "package_days": data.get("package_days", 0),
             "mode": data.get("mode", "no_reset")
         }
-        new_user_raw = self._request("POST", "/user/", json=payload)
+        new_user_raw = self._request("POST", "/admin/user/", json=payload)
         return self.user_info(new_user_raw['uuid']) if new_user_raw and new_user_raw.get('uuid') else None
 
     def modify_user(self, uuid: str, data: dict) -> bool:
         """یک کاربر را فقط در پنل Hiddify ویرایش میکند."""
-        return self._request("PATCH", f"/user/{uuid}/", json=data) is not None
+        return self._request("PATCH", f"/admin/user/{uuid}/", json=data) is not None
+
+    def submit_many(self, batch: List[PanelRequest], on_result=None):
+        """Starts a batch of requests without waiting; returns a Future of the PanelResponse list."""
+        return self.client.submit_many(batch, on_result)
 
     def delete_user(self, uuid: str) -> bool:
         """یک کاربر را فقط از پنل Hiddify حذف میکند."""
-        return self._request("DELETE", f"/user/{uuid}/") is True
+        return self._request("DELETE", f"/admin/user/{uuid}/") is True
 
     def reset_user_usage(self, uuid: str) -> bool:
         """مصرف یک کاربر را فقط در پنل Hiddify صفر میکند."""
@@ -120,13 +84,6 @@ class HiddifyAPIHandler:
 
     def get_panel_info(self) -> Optional[Dict[str, Any]]:
         """اطلاعات پنل Hiddify را برمیگرداند."""
-        panel_info_url = f"{HIDDIFY_DOMAIN.rstrip('/')}/{ADMIN_PROXY_PATH.strip('/')}/api/v2/panel/info/"
-        try:
-            response = self.session.get(panel_info_url, timeout=API_TIMEOUT)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Hiddify API request for panel info failed: {e}")
-            return None
+        return self._request("GET", "/panel/info/")
 
 hiddify_handler = HiddifyAPIHandler()
\ No newline at end of file
@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, time as dtime
+from typing import Any, Callable, Dict, List, Optional
+
+import pytz
+
+from config import SCHEDULER_WORKERS
+from database import db
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_job_seconds = registry.histogram('scheduler_job_duration_seconds', 'Scheduler job run duration.', ('job',),
+                                  buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800))
+_job_runs = registry.counter('scheduler_job_runs_total', 'Scheduler job runs by result (ok, error, overlap).', ('job', 'result'))
+
+
+# --- Triggers ------------------------------------------------------------
+
+class Interval:
+    """Every `seconds` seconds, counted from the previous run."""
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime) -> datetime:
+        return moment + timedelta(seconds=self.seconds)
+
+    def __str__(self) -> str:
+        return f"every {self.seconds / 3600:g}h" if self.seconds >= 3600 else f"every {self.seconds:g}s"
+
+
+class HourlyAt:
+    """Every hour at the given minute of the local hour in `tz` (Tehran is UTC+3:30)."""
+
+    def __init__(self, minute: int, tz: pytz.BaseTzInfo) -> None:
+        self.minute = minute
+        self.tz = tz
+
+    def next_after(self, moment: datetime) -> datetime:
+        local = moment.astimezone(self.tz)
+        candidate = local.replace(minute=self.minute, second=0, microsecond=0)
+        if candidate <= local:
+            candidate += timedelta(hours=1)
+        return candidate.astimezone(pytz.utc)
+
+    def __str__(self) -> str:
+        return f"hourly at :{self.minute:02d}"
+
+
+class DailyAt:
+    """Every day at a wall-clock time in `tz`."""
+
+    def __init__(self, at: dtime, tz: pytz.BaseTzInfo) -> None:
+        self.at = at
+        self.tz = tz
+
+    def next_after(self, moment: datetime) -> datetime:
+        local = moment.astimezone(self.tz)
+        candidate = self.tz.localize(datetime.combine(local.date(), self.at))
+        if candidate <= local:
+            candidate = self.tz.localize(datetime.combine(local.date() + timedelta(days=1), self.at))
+        return candidate.astimezone(pytz.utc)
+
+    def __str__(self) -> str:
+        return f"daily at {self.at.strftime('%H:%M')} ({self.tz})"
+
+
+def _latest_missed(trigger, last_run: datetime, now: datetime) -> Optional[datetime]:
+    """The most recent fire time after `last_run` that is not later than `now` (None if there is none)."""
+    missed, upcoming = None, trigger.next_after(last_run)
+    while upcoming <= now:
+        missed, upcoming = upcoming, trigger.next_after(upcoming)
+    return missed
+
+
+# --- Engine --------------------------------------------------------------
+
+class _Job:
+    __slots__ = ('name', 'func', 'trigger', 'catch_up_window', 'next_run', 'lock', 'runs', 'failures',
+                 'overlaps', 'catch_ups', 'last_started', 'last_duration', 'total_duration', 'last_error')
+
+    def __init__(self, name: str, func: Callable[[], Any], trigger, catch_up_window: Optional[timedelta]) -> None:
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.catch_up_window = catch_up_window
+        self.next_run: Optional[datetime] = None
+        self.lock = threading.Lock()   # held while the job runs; prevents overlapping runs
+        self.runs = self.failures = self.overlaps = self.catch_ups = 0
+        self.last_started: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.total_duration = 0.0
+        self.last_error: Optional[str] = None
+
+
+class JobScheduler:
+    """
+    Event-driven job scheduler.
+
+    - a heap of next fire times; the loop sleeps exactly until the earliest one
+    - due jobs run on a worker pool, so a slow job does not delay the others
+    - a job that is still running when it is due again is skipped (counted as an overlap)
+    - last run times are stored in the scheduler_jobs table; after downtime the most recent
+      missed run is executed once on start if it is not older than the job's catch-up window
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS) -> None:
+        self.workers = workers
+        self._jobs: Dict[str, _Job] = {}
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running = False
+
+    def add_job(self, name: str, func: Callable[[], Any], trigger,
+                catch_up_window: Optional[timedelta] = None) -> None:
+        """`catch_up_window`: how late a missed run may still be executed after downtime (None: never)."""
+        with self._cond:
+            self._jobs[name] = _Job(name, func, trigger, catch_up_window)
+
+    def start(self) -> None:
+        with self._cond:
+            if self._running:
+                return
+            now = datetime.now(pytz.utc)
+            last_runs = db.get_scheduler_job_runs()
+            for job in self._jobs.values():
+                last_run = last_runs.get(job.name)
+                missed = _latest_missed(job.trigger, last_run, now) if last_run else None
+                if missed and job.catch_up_window is not None and now - missed <= job.catch_up_window:
+                    logger.info(f"JobScheduler: '{job.name}' missed its run at {missed:%Y-%m-%d %H:%M} UTC, catching up now")
+                    job.catch_ups += 1
+                    job.next_run = now
+                elif last_run and isinstance(job.trigger, Interval) and missed is None:
+                    # Keep the interval cadence across restarts
+                    job.next_run = job.trigger.next_after(last_run)
+                else:
+                    job.next_run = job.trigger.next_after(now)
+                self._push(job)
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+            self._running = True
+        threading.Thread(target=self._loop, name="job-scheduler", daemon=True).start()
+        logger.info(f"JobScheduler started with {len(self._jobs)} jobs and {self.workers} workers")
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+    def _push(self, job: _Job) -> None:
+        heapq.heappush(self._heap, (job.next_run.timestamp(), next(self._seq), job.name))
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                fire_at, _, name = self._heap[0]
+                delay = fire_at - time.time()
+                if delay > 0:
+                    # Capped so wall-clock jumps (NTP, suspend) are noticed
+                    self._cond.wait(min(delay, 60))
+                    continue
+                heapq.heappop(self._heap)
+                job = self._jobs[name]
+                planned = job.next_run
+                now = datetime.now(pytz.utc)
+                job.next_run = job.trigger.next_after(planned)
+                if job.next_run <= now:
+                    # Far behind (e.g. after the machine slept): skip the backlog instead of firing repeatedly
+                    job.next_run = job.trigger.next_after(now)
+                self._push(job)
+                # Submitted under the lock: shutdown() clears _running before it stops the executor
+                self._executor.submit(self._run, job)
+
+    def _run(self, job: _Job) -> None:
+        if not job.lock.acquire(blocking=False):
+            job.overlaps += 1
+            _job_runs.inc(job=job.name, result='overlap')
+            logger.warning(f"JobScheduler: '{job.name}' is still running; skipping this run")
+            return
+        started_at = datetime.now(pytz.utc)
+        started = time.monotonic()
+        error = None
+        try:
+            job.last_started = started_at
+            job.func()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"JobScheduler: job '{job.name}' failed: {e}", exc_info=True)
+        finally:
+            duration = time.monotonic() - started
+            job.runs += 1
+            job.failures += error is not None
+            job.last_duration = duration
+            job.total_duration += duration
+            job.last_error = error
+            job.lock.release()
+            _job_seconds.observe(duration, job=job.name)
+            _job_runs.inc(job=job.name, result='error' if error else 'ok')
+        logger.info(f"JobScheduler: '{job.name}' finished in {duration:.2f}s{' with error' if error else ''}")
+        try:
+            db.record_scheduler_job_run(job.name, started_at, duration, error)
+        except Exception as e:
+            logger.error(f"JobScheduler: could not persist run of '{job.name}': {e}")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            jobs = list(self._jobs.values())
+        return [{
+            'name': job.name,
+            'trigger': str(job.trigger),
+            'running': job.lock.locked(),
+            'next_run': job.next_run,
+            'last_started': job.last_started,
+            'last_duration': job.last_duration,
+            'avg_duration': job.total_duration / job.runs if job.runs else None,
+            'runs': job.runs,
+            'failures': job.failures,
+            'overlaps': job.overlaps,
+            'catch_ups': job.catch_ups,
+            'last_error': job.last_error,
+        } for job in sorted(jobs, key=lambda j: j.next_run or datetime.max.replace(tzinfo=pytz.utc))]
+
+
+job_scheduler = JobScheduler()
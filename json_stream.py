@@ -0,0 +1,144 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator, Sequence
+
+try:  # optional: event-based parser (the yajl2_c backend is the fastest when compiled)
+    import ijson
+except ImportError:
+    ijson = None
+
+try:  # optional: faster decoder for bodies that are not a top-level array
+    import orjson
+except ImportError:
+    orjson = None
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+
+
+class _ChunkReader:
+    """File-like wrapper over an iterator of byte chunks (what ijson reads from)."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        if size < 0:
+            data, self._pending = self._pending, b''
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def _loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _items_from_document(document: Any, keys: Sequence[str]) -> list:
+    if isinstance(document, list):
+        return document
+    if isinstance(document, dict):
+        for key in keys:
+            if isinstance(document.get(key), list):
+                return document[key]
+    return []
+
+
+def _iter_raw_decode(first: str, text_chunks: Iterator[str]) -> Iterator[Any]:
+    """
+    Decodes a top-level JSON array one element at a time with json.JSONDecoder.raw_decode.
+    An element that is cut off at the end of the buffer is retried once more text has arrived.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, exhausted = first, first.index('[') + 1, False
+    state = 'first'  # 'first': after '[', 'value': after ',', 'separator': after an element
+
+    def more() -> bool:
+        nonlocal buf, pos, exhausted
+        chunk = next(text_chunks, None)
+        if chunk is None:
+            exhausted = True
+            return False
+        buf, pos = buf[pos:] + chunk, 0
+        return True
+
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buf):
+            if not more():
+                raise ValueError("JSON array ended unexpectedly")
+            continue
+        char = buf[pos]
+        if state == 'separator':
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            pos, state = pos + 1, 'value'
+            continue
+        if char == ']' and state == 'first':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if more():
+                continue
+            raise
+        # A number cut at the buffer edge ("12", "-1.") decodes early; wait until a delimiter follows it
+        if (end == len(buf) or buf[end] not in _DELIMITERS) and not exhausted and more():
+            continue
+        yield item
+        pos, state = end, 'separator'
+
+
+def iter_json_items(chunks: Iterable[bytes], keys: Sequence[str] = ('results', 'users')) -> Iterator[Any]:
+    """
+    Yields the elements of a JSON array as the bytes arrive, without holding the whole body.
+    A body that is an object is decoded in one go and the first list under `keys` is used,
+    matching what panels return when they wrap the list. Raises ValueError on invalid JSON.
+    """
+    chunks = iter(chunks)
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    head = b''
+    # Peek far enough to see the first non-whitespace character
+    for chunk in chunks:
+        head += chunk
+        if head.removeprefix(codecs.BOM_UTF8).lstrip() and not codecs.BOM_UTF8.startswith(head):
+            break
+    stripped = head.removeprefix(codecs.BOM_UTF8).lstrip()
+    if not stripped:
+        return
+    if stripped[:1] != b'[':
+        yield from _items_from_document(_loads(stripped + b''.join(chunks)), keys)
+        return
+
+    if ijson is not None:
+        # ijson's errors do not derive from ValueError; callers only catch ValueError
+        try:
+            yield from ijson.items(_ChunkReader(_prepend(stripped, chunks)), 'item', use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(f"Invalid JSON array: {e}") from e
+        return
+
+    def text_chunks() -> Iterator[str]:
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                yield text
+        tail = text_decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+    yield from _iter_raw_decode(text_decoder.decode(stripped), text_chunks())
+
+
+def _prepend(head: bytes, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    yield head
+    yield from chunks
@@ -2,13 +2,19 @@ import requests
 import logging
 import json
 from datetime import datetime, timedelta
-import pytz
-from config import MARZBAN_API_BASE_URL, MARZBAN_API_USERNAME, MARZBAN_API_PASSWORD, API_TIMEOUT, api_cache
+from config import (MARZBAN_API_BASE_URL, MARZBAN_API_USERNAME, MARZBAN_API_PASSWORD, API_TIMEOUT,
+                    MARZBAN_PAGE_SIZE, MARZBAN_PAGE_CONCURRENCY)
 from database import db
-from cachetools import cached
+from async_http import AsyncPanelClient, PanelRequest
+from panel_cache import panel_cache
+from user_normalizer import UserNormalizer
+from user_records import PanelUser
 
 logger = logging.getLogger(__name__)
 
+class MarzbanListingError(Exception):
+    """A page of the paginated user list could not be fetched."""
+
 class MarzbanAPIHandler:
     def __init__(self):
         self.base_url = MARZBAN_API_BASE_URL.rstrip('/')
@@ -16,9 +22,9 @@ class MarzbanAPIHandler:
         self.username = MARZBAN_API_USERNAME
         self.password = MARZBAN_API_PASSWORD
         self.access_token = None
-        self.utc_tz = pytz.utc
         self.uuid_to_username_map, self.username_to_uuid_map = {}, {}
         self.session = self._create_session() 
+        self.client = AsyncPanelClient("Marzban", self.api_base_url, self._headers, on_unauthorized=self._refresh_token)
         self.reload_uuid_maps()
 
     def _create_session(self) -> requests.Session:
@@ -33,6 +39,8 @@ class MarzbanAPIHandler:
                 self.uuid_to_username_map = {k.lower(): v for k, v in data.items()}
                 self.username_to_uuid_map = {v: k.lower() for k, v in data.items()}
                 logger.info(f"Successfully loaded/reloaded {len(self.uuid_to_username_map)} user mappings from JSON.")
+                # Cached users carry the old UUID mapping
+                panel_cache.invalidate('marzban')
                 return True
         except (FileNotFoundError, json.JSONDecodeError) as e:
             logger.error(f"Could not load or reload uuid_to_marzban_user.json: {e}")
@@ -57,32 +65,28 @@ class MarzbanAPIHandler:
             self.access_token = None
             return False
         
-    def _request(self, method, endpoint, retry=True, **kwargs):
-        """A central request function with automatic token refresh."""
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.access_token}", "Accept": "application/json"}
+
+    def _refresh_token(self) -> bool:
+        logger.warning("Marzban: Access token expired or invalid. Retrying to get a new one.")
+        return self._get_access_token()
+
+    def _request(self, method, endpoint, **kwargs):
+        """A central request function with automatic token refresh (sync facade over the async client)."""
         if not self.access_token:
             if not self._get_access_token():
                 return None
 
-        url = f"{self.api_base_url}/{endpoint.strip('/')}"
-        headers = {"Authorization": f"Bearer {self.access_token}", "Accept": "application/json"}
-        kwargs['headers'] = headers
-        
-        try:
-            response = self.session.request(method, url, timeout=API_TIMEOUT, **kwargs) 
-            if response.status_code == 401 and retry:
-                logger.warning("Marzban: Access token expired or invalid. Retrying to get a new one.")
-                if self._get_access_token():
-                    return self._request(method, endpoint, retry=False, **kwargs)
+        response = self.client.run(PanelRequest(method, endpoint.strip('/'), **kwargs))
+        return response.data if response.ok else None
 
-            response.raise_for_status()
-            
-            if response.status_code == 204:
-                return True
-            return response.json()
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Marzban API request failed: {method} {url} - {e}")
-            return None
+    def _request_many(self, batch: list[PanelRequest]) -> list:
+        """Runs several requests concurrently; returns the PanelResponse list (empty without a token)."""
+        if not self.access_token:
+            if not self._get_access_token():
+                return []
+        return self.client.run_many(batch)
 
     def add_user(self, user_data: dict) -> dict | None:
         expire_timestamp = 0
@@ -107,27 +111,11 @@ class MarzbanAPIHandler:
             logger.error(f"Marzban: Failed to get current data for user '{username}' before modification.")
             return False
 
-        # بقیه کد شما کاملاً درست است و بدون تغییر باقی می‌ماند
         try:
-            payload = data.copy() if data else {}
-
-            if add_usage_gb != 0:
-                current_limit = current_data.get('data_limit', 0)
-                payload['data_limit'] = current_limit + int(add_usage_gb * (1024**3))
-
-            if add_days != 0:
-                current_expire_ts = current_data.get('expire', 0)
-                base_time = datetime.fromtimestamp(current_expire_ts) if current_expire_ts > 0 else datetime.now()
-                if base_time < datetime.now():
-                    base_time = datetime.now()
-                new_expire_dt = base_time + timedelta(days=add_days)
-                payload['expire'] = int(new_expire_dt.timestamp())
-
+            payload = self.modification_payload(current_data, data, add_usage_gb, add_days)
             if not payload:
                 return True
 
-            # برای درخواست PUT نیز از self._request استفاده می‌کنیم تا کد یکپارچه باشد
-            # (گرچه کد قبلی شما برای این بخش هم کار می‌کرد، اما این روش تمیزتر است)
             response = self._request("PUT", f"/user/{username}", json=payload)
             
             # self._request در صورت موفقیت True برمی‌گرداند یا JSON، پس باید بررسی کنیم None نباشد
@@ -136,20 +124,31 @@ class MarzbanAPIHandler:
         except Exception as e:
             logger.error(f"Marzban: Failed to process payload for modifying user '{username}': {e}")
         return False
-        
-    def _parse_marzban_datetime(self, date_str: str | None) -> datetime | None:
-            if not date_str:
-                return None
-            try:
-                clean_str = date_str.replace('Z', '+00:00').split('.')[0]
-                dt_obj = datetime.fromisoformat(clean_str)
-
-                if dt_obj.tzinfo is None:
-                    dt_obj = self.utc_tz.localize(dt_obj)
-                return dt_obj
-            except (ValueError, TypeError):
-                logger.warning(f"Could not parse Marzban datetime string: {date_str}")
+
+    def modification_payload(self, current_data: dict, data: dict = None, add_usage_gb: float = 0, add_days: int = 0) -> dict:
+        """Builds the PUT payload for relative changes from the user's raw data_limit/expire."""
+        payload = data.copy() if data else {}
+
+        if add_usage_gb != 0:
+            current_limit = current_data.get('data_limit') or 0
+            payload['data_limit'] = current_limit + int(add_usage_gb * (1024**3))
+
+        if add_days != 0:
+            current_expire_ts = current_data.get('expire') or 0
+            base_time = datetime.fromtimestamp(current_expire_ts) if current_expire_ts > 0 else datetime.now()
+            if base_time < datetime.now():
+                base_time = datetime.now()
+            new_expire_dt = base_time + timedelta(days=add_days)
+            payload['expire'] = int(new_expire_dt.timestamp())
+
+        return payload
+
+    def submit_many(self, batch: list[PanelRequest], on_result=None):
+        """Starts a batch of requests without waiting; returns a Future of the PanelResponse list (None without a token)."""
+        if not self.access_token:
+            if not self._get_access_token():
                 return None
+        return self.client.submit_many(batch, on_result)
         
     def get_user_info(self, uuid: str) -> dict | None:
         """Gets a single user's details from Marzban by their Hiddify UUID."""
@@ -163,106 +162,99 @@ class MarzbanAPIHandler:
 
         return self.get_user_by_username(marzban_username)
 
-    @cached(api_cache)
-    def get_all_users(self) -> list[dict]:
-            all_users_raw = self._request("GET", "/users")
-            if not all_users_raw or 'users' not in all_users_raw:
-                return []
+    def get_all_users(self, force_refresh: bool = False) -> list[PanelUser]:
+        """Marzban users, served from panel_cache."""
+        return panel_cache.get('marzban', self._fetch_all_users, force_refresh=force_refresh) or []
 
-            normalized_users = []
-            for user in all_users_raw['users']:
-                username = user.get("username")
-                if not username:
-                    continue
-
-                data_limit = user.get('data_limit')
-                limit_gb = (data_limit / (1024**3)) if data_limit is not None else 0
-                
-                used_traffic = user.get('used_traffic', 0)
-                usage_gb = used_traffic / (1024 ** 3)
-                
-                uuid = self.username_to_uuid_map.get(username)
-                expire_timestamp = user.get('expire')
-                expire_days = None
-                if expire_timestamp and expire_timestamp > 0:
-                    expire_datetime = datetime.fromtimestamp(expire_timestamp, tz=self.utc_tz)
-                    expire_days = (expire_datetime - datetime.now(self.utc_tz)).days
-
-                normalized_data = {
-                    "name": username,
-                    "uuid": uuid,
-                    "is_active": user.get('status') == 'active',
-                    "last_online": self._parse_marzban_datetime(user.get('online_at')),
-                    "usage_limit_GB": limit_gb,
-                    "current_usage_GB": usage_gb,
-                    "remaining_GB": max(0, limit_gb - usage_gb),
-                    "usage_percentage": (usage_gb / limit_gb * 100) if limit_gb > 0 else 0,
-                    "expire": expire_days,
-                }
-                normalized_users.append(normalized_data)
-                
-            return normalized_users
-        
-    def get_user_by_username(self, username: str) -> dict | None:
+    def _fetch_all_users(self) -> list[PanelUser] | None:
+        """Downloads the full user list page by page; returns None when a page fails."""
+        normalized_users = []
+        try:
+            for page in self.iter_user_pages():
+                normalized_users.extend(page)
+        except MarzbanListingError as e:
+            logger.error(f"Marzban: Failed to list users: {e}")
+            return None
+        return normalized_users
+
+    def iter_user_pages(self, page_size: int = MARZBAN_PAGE_SIZE, concurrency: int = MARZBAN_PAGE_CONCURRENCY):
+        """
+        Yields the user list as normalized pages, using /users?offset=&limit=.
+        Once the first page reports `total`, up to `concurrency` pages are requested at once; pages are
+        yielded in order, so only about concurrency * page_size raw users are held at any time.
+        Each user is yielded once. Users created or deleted while paging shift records across page
+        boundaries; when fewer users than `total` came back, the list is read once more in a single
+        request and the skipped users are yielded as a last page.
+        Raises MarzbanListingError when a page cannot be fetched.
+        """
+        normalizer = UserNormalizer('Marzban')
+        seen, total = set(), None
+        for users, total in self._iter_raw_pages(page_size, concurrency):
+            page = [user for user in users if user.get('username') and user['username'] not in seen]
+            seen.update(user['username'] for user in page)
+            yield self._norm_page(page, normalizer)
+
+        if total is not None and len(seen) < total:
+            logger.warning(f"Marzban: paged listing returned {len(seen)} of {total} users; re-listing in one request")
+            full = self._request("GET", "/users")
+            if not isinstance(full, dict):
+                raise MarzbanListingError("full re-list after a short paged listing failed")
+            yield self._norm_page([user for user in full.get('users') or []
+                                   if user.get('username') and user['username'] not in seen], normalizer)
+        normalizer.report()
+
+    def _iter_raw_pages(self, page_size: int, concurrency: int):
+        """Yields (raw users, total reported by the first page) per page."""
+        first = self._request("GET", "/users", params={'offset': 0, 'limit': page_size})
+        if first is None:
+            raise MarzbanListingError("first page could not be fetched")
+        if not first or 'users' not in first:
+            return
+        users = first['users']
+        total = first.get('total')
+        yield users, total
+        # A short page is the last one; a longer one means the panel ignores offset/limit
+        if len(users) != page_size:
+            return
+        if total is None:
+            concurrency = 1
+
+        offset = page_size
+        while total is None or offset < total:
+            end = offset + page_size * concurrency if total is None else min(total, offset + page_size * concurrency)
+            offsets = range(offset, end, page_size)
+            responses = self._request_many([PanelRequest("GET", "users", params={'offset': o, 'limit': page_size}, key=o)
+                                            for o in offsets])
+            if len(responses) != len(offsets):
+                raise MarzbanListingError("no access token")
+            for response in responses:
+                if not response.ok or not isinstance(response.data, dict):
+                    raise MarzbanListingError(f"page at offset {response.request.key} failed: {response.error}")
+                users = response.data.get('users') or []
+                yield users, total
+                if len(users) < page_size:
+                    return
+            offset = offsets[-1] + page_size
+
+    def _norm_page(self, users: list[dict], normalizer: UserNormalizer) -> list[PanelUser]:
+        return [self._norm_user(user['username'], user, normalizer) for user in users if user.get('username')]
+
+    def get_user_by_username(self, username: str) -> PanelUser | None:
         user = self._request("GET", f"/user/{username}")
         if not user: return None
+        return self._norm_user(username, user)
 
+    def _norm_user(self, username: str, user: dict, normalizer: UserNormalizer | None = None) -> PanelUser:
         uuid = self.username_to_uuid_map.get(username, None)
-        usage_gb = user.get('used_traffic', 0) / (1024 ** 3)
-        limit_gb = user.get('data_limit', 0) / (1024 ** 3)
-        expire_timestamp = user.get('expire')
-        expire_days = None
-        if expire_timestamp and expire_timestamp > 0:
-            expire_datetime = datetime.fromtimestamp(expire_timestamp, tz=self.utc_tz)
-            expire_days = (expire_datetime - datetime.now(self.utc_tz)).days
-
-        normalized_data = {
-            "name": username, "uuid": uuid, "is_active": user.get('status') == 'active',
-            "last_online": self._parse_marzban_datetime(user.get('online_at')),
-            "usage_limit_GB": limit_gb, "current_usage_GB": usage_gb,
-            "remaining_GB": max(0, limit_gb - usage_gb),
-            "usage_percentage": (usage_gb / limit_gb * 100) if limit_gb > 0 else 0,
-            "expire": expire_days,
-        }
-        return normalized_data
+        return (normalizer or UserNormalizer('Marzban')).marzban(username, user, uuid)
 
     def get_system_stats(self) -> dict | None:
-            if not self.access_token:
-                return None
-            try:
-                url = f"{self.base_url}/api/system"
-                headers = {"Authorization": f"Bearer {self.access_token}"}
-                response = requests.get(url, headers=headers, timeout=API_TIMEOUT)
-                response.raise_for_status()
-                return response.json()
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Marzban: Failed to get system stats: {e}")
-                return None
+        return self._request("GET", "/system")
 
     def delete_user(self, username: str) -> bool:
-        if not self.access_token:
-            return False
-        try:
-            url = f"{self.base_url}/api/user/{username}"
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            response = requests.delete(url, headers=headers, timeout=API_TIMEOUT)
-            response.raise_for_status()
-            return True
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Marzban: Failed to delete user '{username}': {e}")
-            return False
+        return self._request("DELETE", f"/user/{username}") is not None
 
     def reset_user_usage(self, username: str) -> bool:
-        if not self.access_token:
-            return False
-        try:
-            url = f"{self.base_url}/api/user/{username}/reset"
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            response = requests.post(url, headers=headers, timeout=API_TIMEOUT)
-            response.raise_for_status()
-            return True
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Marzban: Failed to reset usage for user '{username}': {e}")
-            return False
+        return self._request("POST", f"/user/{username}/reset") is not None
 
 marzban_handler = MarzbanAPIHandler()
\ No newline at end of file
@@ -390,6 +390,7 @@ class Menu:
             types.InlineKeyboardButton("آلمان 🇩🇪", callback_data="admin:health_check"),
             types.InlineKeyboardButton("فرانسه 🇫🇷", callback_data="admin:marzban_stats")
         )
+        kb.add(types.InlineKeyboardButton("⏱ وضعیت زمان‌بندها", callback_data="admin:scheduler_stats"))
         kb.add(types.InlineKeyboardButton("🔙 بازگشت به پنل اصلی", callback_data="admin:panel"))
         return kb
 
@@ -0,0 +1,310 @@
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from metrics import registry
+
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_INTERVAL, OUTBOUND_GROUP_CHAT_INTERVAL,
+                    OUTBOUND_WORKERS, OUTBOUND_MAX_FLOOD_RETRIES)
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes: lower value is sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_WARNING = 1
+PRIORITY_REPORT = 2
+PRIORITY_BROADCAST = 3
+LANE_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_WARNING: 'warning',
+              PRIORITY_REPORT: 'report', PRIORITY_BROADCAST: 'broadcast'}
+
+
+class OutboundStopped(RuntimeError):
+    """Set on the futures of calls that were still queued when the outbound queue stopped."""
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'method', 'args', 'kwargs', 'future', 'flood_retries')
+
+    def __init__(self, priority: int, seq: int, chat_id: int, method: str, args: tuple, kwargs: dict) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.flood_retries = 0
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Chat:
+    __slots__ = ('jobs', 'next_at', 'busy')
+
+    def __init__(self) -> None:
+        self.jobs: List[_Job] = []   # heap, highest priority first, FIFO inside a lane
+        self.next_at = 0.0           # earliest time the next message may go to this chat
+        self.busy = False            # one in-flight request per chat keeps messages ordered
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float = 1) -> None:
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+def _retry_after(e: ApiTelegramException) -> Optional[int]:
+    if e.error_code != 429:
+        return None
+    params = (e.result_json or {}).get('parameters') or {}
+    if params.get('retry_after'):
+        return int(params['retry_after'])
+    match = re.search(r'retry after (\d+)', e.description or '')
+    return int(match.group(1)) if match else 5
+
+
+class OutboundQueue:
+    """
+    Central, rate-limited queue for outgoing Telegram calls.
+
+    - global token bucket (OUTBOUND_GLOBAL_RATE msg/s)
+    - per-chat pacing (1 msg/s for private chats, slower for groups) with one in-flight call per chat
+    - a 429 only pauses the chat that received it, for `retry_after` seconds, then the call is retried
+    - priority lanes: interactive > warning > report > broadcast
+    Every submit returns a concurrent Future resolving to the Telegram API result.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, chat_interval: float = OUTBOUND_CHAT_INTERVAL,
+                 group_chat_interval: float = OUTBOUND_GROUP_CHAT_INTERVAL, workers: int = OUTBOUND_WORKERS) -> None:
+        self.bot: Optional[TeleBot] = None
+        self.chat_interval = chat_interval
+        self.group_chat_interval = group_chat_interval
+        self.workers = workers
+        self._bucket = _TokenBucket(global_rate)
+        self._cond = threading.Condition()
+        self._chats: Dict[int, _Chat] = {}
+        self._ready: List[tuple] = []     # (priority, seq, chat_id) of chats that may send now
+        self._waiting: List[tuple] = []   # (next_at, chat_id) of paced/flood-limited chats with pending jobs
+        self._seq = itertools.count()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._running = False
+        self._stopped = False
+        self._stats = {'sent': 0, 'failed': 0, 'flood_waits': 0}
+        self._lane_sent = {lane: 0 for lane in LANE_NAMES}
+
+    # --- lifecycle -------------------------------------------------------
+
+    def start(self, bot: TeleBot) -> None:
+        with self._cond:
+            self.bot = bot
+            if self._running:
+                return
+            self._running = True
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbound")
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="outbound-dispatcher", daemon=True)
+            self._dispatcher.start()
+        logger.info(f"Outbound queue started ({self.workers} workers)")
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        Stops dispatching; waits up to `timeout` seconds for queued messages to drain. Calls still
+        queued after that fail with OutboundStopped, so nobody waits on their futures forever.
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.2)
+        with self._cond:
+            self._running = False
+            self._stopped = True
+            self._cond.notify_all()
+        if self._executor:
+            # In-flight calls finish first; a flood-limited one is queued again and dropped below
+            self._executor.shutdown(wait=True)
+        with self._cond:
+            dropped = [job for chat in self._chats.values() for job in chat.jobs]
+            self._chats.clear()
+            self._ready.clear()
+            self._waiting.clear()
+        for job in dropped:
+            if not job.future.done():
+                job.future.set_exception(OutboundStopped("outbound queue stopped before the message was sent"))
+        if dropped:
+            logger.warning(f"Outbound: {len(dropped)} queued messages dropped on shutdown")
+        logger.info(f"Outbound queue stopped: {self.stats()}")
+
+    # --- submitting ------------------------------------------------------
+
+    def submit(self, chat_id: int, method: str, *args, priority: int = PRIORITY_REPORT, **kwargs) -> Future:
+        """Queues `bot.<method>(chat_id, *args, **kwargs)`."""
+        job = _Job(priority, next(self._seq), chat_id, method, args, kwargs)
+        with self._cond:
+            if self._stopped:
+                job.future.set_exception(OutboundStopped("outbound queue is stopped"))
+                return job.future
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat()
+            heapq.heappush(chat.jobs, job)
+            if chat.jobs[0] is job:
+                self._schedule_chat(chat_id, chat)
+            self._cond.notify()
+        return job.future
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_REPORT, **kwargs) -> Future:
+        return self.submit(chat_id, 'send_message', text, priority=priority, **kwargs)
+
+    def copy_message(self, chat_id: int, from_chat_id: int, message_id: int,
+                     priority: int = PRIORITY_BROADCAST, **kwargs) -> Future:
+        return self.submit(chat_id, 'copy_message', from_chat_id, message_id, priority=priority, **kwargs)
+
+    def edit_message_text(self, text: str, chat_id: int, message_id: int,
+                          priority: int = PRIORITY_REPORT, **kwargs) -> Future:
+        return self.submit(chat_id, '_edit_message_text', text, message_id, priority=priority, **kwargs)
+
+    # --- dispatching -----------------------------------------------------
+
+    def _schedule_chat(self, chat_id: int, chat: _Chat) -> None:
+        """Must hold the lock. Puts a chat with pending jobs on the ready or waiting heap."""
+        if chat.busy or not chat.jobs:
+            return
+        if chat.next_at <= time.monotonic():
+            head = chat.jobs[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (chat.next_at, chat_id))
+
+    def _pop_ready(self) -> Optional[_Job]:
+        """Must hold the lock. Returns the highest-priority sendable job (stale heap entries are skipped)."""
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats.get(chat_id)
+            if chat and not chat.busy and chat.jobs and chat.next_at <= now:
+                head = chat.jobs[0]
+                heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        while self._ready:
+            _, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat and not chat.busy and chat.jobs and chat.jobs[0].seq == seq and chat.next_at <= now:
+                chat.busy = True
+                return heapq.heappop(chat.jobs)
+        return None
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                delay = self._bucket.delay()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                job = self._pop_ready()
+                if job is None:
+                    timeout = max(0.0, self._waiting[0][0] - time.monotonic()) if self._waiting else None
+                    self._cond.wait(timeout)
+                    continue
+                self._bucket.take()
+            self._executor.submit(self._run, job)
+
+    def _call(self, job: _Job) -> Any:
+        if job.method == '_edit_message_text':
+            text, message_id = job.args
+            return self.bot.edit_message_text(text, job.chat_id, message_id, **job.kwargs)
+        return getattr(self.bot, job.method)(job.chat_id, *job.args, **job.kwargs)
+
+    def _run(self, job: _Job) -> None:
+        result, error, retry_after = None, None, None
+        try:
+            result = self._call(job)
+        except ApiTelegramException as e:
+            retry_after = _retry_after(e)
+            if retry_after is None or job.flood_retries >= OUTBOUND_MAX_FLOOD_RETRIES:
+                error = e
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            chat = self._chats[job.chat_id]
+            chat.busy = False
+            interval = self.group_chat_interval if job.chat_id < 0 else self.chat_interval
+            chat.next_at = max(chat.next_at, time.monotonic() + interval)
+            if retry_after is not None and error is None:
+                job.flood_retries += 1
+                self._stats['flood_waits'] += 1
+                chat.next_at = time.monotonic() + retry_after
+                heapq.heappush(chat.jobs, job)
+                logger.warning(f"Outbound: flood control for chat {job.chat_id}, retrying in {retry_after}s")
+            elif error is None:
+                self._stats['sent'] += 1
+                self._lane_sent[job.priority] = self._lane_sent.get(job.priority, 0) + 1
+            else:
+                self._stats['failed'] += 1
+            if chat.jobs:
+                self._schedule_chat(job.chat_id, chat)
+            elif chat.next_at <= time.monotonic():
+                del self._chats[job.chat_id]
+            self._prune_idle_chats()
+            self._cond.notify()
+
+        if retry_after is not None and error is None:
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def _prune_idle_chats(self) -> None:
+        """Must hold the lock. Forgets chats whose pacing window is over and that have nothing queued."""
+        if len(self._chats) < 1024:
+            return
+        now = time.monotonic()
+        for chat_id in [cid for cid, c in self._chats.items() if not c.jobs and not c.busy and c.next_at <= now]:
+            del self._chats[chat_id]
+
+    # --- introspection ---------------------------------------------------
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(c.jobs) + c.busy for c in self._chats.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = {name: 0 for name in LANE_NAMES.values()}
+            for chat in self._chats.values():
+                for job in chat.jobs:
+                    queued[LANE_NAMES.get(job.priority, str(job.priority))] += 1
+            return {**self._stats,
+                    'sent_by_lane': {LANE_NAMES.get(p, str(p)): n for p, n in self._lane_sent.items()},
+                    'queued': queued}
+
+
+outbound = OutboundQueue()
+
+registry.callback('outbound_messages_total', 'Telegram calls made by the outbound queue (sent, failed, flood_waits).',
+                  lambda: {(key,): value for key, value in outbound.stats().items() if isinstance(value, int)},
+                  ('result',), kind='counter')
+registry.callback('outbound_queued', 'Telegram calls waiting in the outbound queue per lane.',
+                  lambda: {(lane,): count for lane, count in outbound.stats()['queued'].items()}, ('lane',))
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import PANEL_CACHE_TTL, PANEL_CACHE_MAX_STALE
+from metrics import registry, hit_ratio
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('value', 'fetched_at', 'version', 'inflight', 'hits', 'stale_hits', 'misses',
+                 'refreshes', 'errors', 'last_duration', 'last_error')
+
+    def __init__(self) -> None:
+        self.value: Any = None
+        self.fetched_at = 0.0
+        self.version = 0
+        self.inflight: Optional[Future] = None
+        self.hits = self.stale_hits = self.misses = self.refreshes = self.errors = 0
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class PanelSnapshotCache:
+    """
+    Stale-while-revalidate cache for full panel user lists (one entry per panel).
+
+    - fresh (age < ttl): served from memory.
+    - stale (ttl <= age < max_stale): the last good list is served immediately and
+      a background refresh is started.
+    - missing or older than max_stale: the caller waits for a refresh.
+    Concurrent refreshes of the same panel are coalesced into one request (single-flight).
+    A loader returning None (or raising) counts as a failed refresh and keeps the last good list.
+    """
+
+    def __init__(self, ttl: float = PANEL_CACHE_TTL, max_stale: float = PANEL_CACHE_MAX_STALE) -> None:
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="panel-cache")
+
+    def get(self, key: str, loader: Callable[[], Any], force_refresh: bool = False) -> Any:
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            has_value = entry.value is not None
+            age = time.monotonic() - entry.fetched_at
+
+            if has_value and not force_refresh and age < self.ttl:
+                entry.hits += 1
+                return entry.value
+
+            if has_value and not force_refresh and age < self.max_stale:
+                entry.stale_hits += 1
+                self._start_refresh(key, entry, loader)
+                return entry.value
+
+            entry.misses += 1
+            future = self._start_refresh(key, entry, loader)
+
+        value = future.result()
+        return value if value is not None else entry.value
+
+    def _start_refresh(self, key: str, entry: _Entry, loader: Callable[[], Any]) -> Future:
+        """Must be called with self._lock held; returns the in-flight refresh of `key`."""
+        if entry.inflight is None:
+            entry.inflight = self._executor.submit(self._refresh, key, entry, loader)
+        return entry.inflight
+
+    def _refresh(self, key: str, entry: _Entry, loader: Callable[[], Any]) -> Any:
+        started = time.monotonic()
+        value, error = None, None
+        try:
+            value = loader()
+            if value is None:
+                error = "loader returned no data"
+        except Exception as e:
+            error = str(e)
+            logger.error(f"PanelCache: refresh of '{key}' failed: {e}", exc_info=True)
+
+        with self._lock:
+            entry.refreshes += 1
+            entry.last_duration = time.monotonic() - started
+            entry.last_error = error
+            if error is None:
+                entry.value = value
+                entry.fetched_at = time.monotonic()
+                entry.version += 1
+            else:
+                entry.errors += 1
+            entry.inflight = None
+        return value
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Marks one entry (or all) as stale: the next read serves it once more and refreshes in the background."""
+        with self._lock:
+            for entry_key, entry in self._entries.items():
+                if key is None or entry_key == key:
+                    entry.fetched_at = min(entry.fetched_at, time.monotonic() - self.ttl)
+
+    def clear(self) -> None:
+        """Drops every cached list; the next read waits for a fresh download (benchmarks, cold starts)."""
+        with self._lock:
+            self._entries.clear()
+
+    def peek(self, key: str) -> tuple[Any, Optional[float], int]:
+        """Returns (value, age_seconds, version) without triggering a refresh."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.value is None:
+                return None, None, 0
+            return entry.value, time.monotonic() - entry.fetched_at, entry.version
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: {
+                    'age': round(now - entry.fetched_at, 1) if entry.value is not None else None,
+                    'size': len(entry.value) if entry.value is not None else 0,
+                    'version': entry.version,
+                    'hits': entry.hits,
+                    'stale_hits': entry.stale_hits,
+                    'misses': entry.misses,
+                    'refreshes': entry.refreshes,
+                    'errors': entry.errors,
+                    'refreshing': entry.inflight is not None,
+                    'last_duration': round(entry.last_duration, 3) if entry.last_duration is not None else None,
+                    'last_error': entry.last_error,
+                }
+                for key, entry in self._entries.items()
+            }
+
+
+panel_cache = PanelSnapshotCache()
+
+registry.callback('panel_cache_requests_total', 'Panel list cache lookups by result (hit, stale_hit, miss).',
+                  lambda: {(key, result): s[field] for key, s in panel_cache.stats().items()
+                           for result, field in (('hit', 'hits'), ('stale_hit', 'stale_hits'), ('miss', 'misses'))},
+                  ('cache', 'result'), kind='counter')
+registry.callback('panel_cache_hit_ratio', 'Share of panel list lookups served from the cache (fresh or stale).',
+                  lambda: {(key,): hit_ratio(s['hits'] + s['stale_hits'], s['misses']) for key, s in panel_cache.stats().items()},
+                  ('cache',))
+registry.callback('panel_cache_age_seconds', 'Age of the cached panel user list.',
+                  lambda: {(key,): s['age'] for key, s in panel_cache.stats().items()}, ('cache',))
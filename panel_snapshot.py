@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import pytz
+
+import combined_handler
+from config import SCHEDULER_SNAPSHOT_MAX_AGE
+from user_records import UserRecord
+
+logger = logging.getLogger(__name__)
+
+
+def _freeze_user(user: Dict[str, Any]) -> Mapping[str, Any]:
+    """Read-only view of a combined user record (breakdown included); use dict(user) for a mutable copy."""
+    breakdown = user.get('breakdown')
+    frozen_breakdown = None
+    if breakdown is not None:
+        frozen_breakdown = MappingProxyType({panel: MappingProxyType(info or {}) for panel, info in breakdown.items()})
+    if isinstance(user, UserRecord):
+        # Views over the shared panel records; no field is copied
+        return MappingProxyType(user.with_breakdown(frozen_breakdown))
+    frozen = dict(user)
+    if frozen_breakdown is not None:
+        frozen['breakdown'] = frozen_breakdown
+    return MappingProxyType(frozen)
+
+
+class PanelSnapshot:
+    """One combined user list shared by every scheduler job of a tick. Never mutate it; copy what you change."""
+
+    __slots__ = ('seq', 'users', 'by_uuid', 'taken_at', 'created', 'partial', 'consumers')
+
+    def __init__(self, seq: int, users: List[Dict[str, Any]], partial: bool) -> None:
+        self.seq = seq
+        self.users: Tuple[Mapping[str, Any], ...] = tuple(_freeze_user(u) for u in users)
+        self.by_uuid: Mapping[str, Mapping[str, Any]] = MappingProxyType({u['uuid']: u for u in self.users if u.get('uuid')})
+        self.taken_at = datetime.now(pytz.utc)
+        self.created = time.monotonic()
+        self.partial = partial
+        self.consumers: List[Tuple[str, float]] = []  # (job name, snapshot age when consumed)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+
+class PanelSnapshotProvider:
+    """
+    Fetches the combined user list once and hands the same snapshot to every job that asks
+    within `max_age` seconds. Concurrent callers wait for a single fetch.
+    Snapshots missing a panel (partial) or empty ones are returned but never reused.
+    """
+
+    def __init__(self, max_age: float = SCHEDULER_SNAPSHOT_MAX_AGE,
+                 fetcher: Callable[[], List[Dict[str, Any]]] = combined_handler.get_all_users_combined) -> None:
+        self.max_age = max_age
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+        self._current: Optional[PanelSnapshot] = None
+        self._seq = 0
+        self._stats = {'fetches': 0, 'reuses': 0}
+
+    def get(self, consumer: str) -> PanelSnapshot:
+        with self._lock:
+            snapshot = self._current
+            if snapshot is not None and snapshot.age < self.max_age:
+                self._stats['reuses'] += 1
+                logger.info(f"PanelSnapshot #{snapshot.seq}: reused by '{consumer}' (age {snapshot.age:.0f}s, {len(snapshot)} users)")
+            else:
+                started = time.monotonic()
+                users = self.fetcher() or []
+                self._seq += 1
+                self._stats['fetches'] += 1
+                snapshot = PanelSnapshot(self._seq, users, partial=bool(combined_handler.last_fetch_report.get('partial')))
+                self._current = snapshot if users and not snapshot.partial else None
+                logger.info(f"PanelSnapshot #{snapshot.seq}: fetched {len(snapshot)} users for '{consumer}' in "
+                            f"{time.monotonic() - started:.2f}s{' (partial, not shared)' if snapshot.partial else ''}")
+            snapshot.consumers.append((consumer, round(snapshot.age, 1)))
+            return snapshot
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._current = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            current = self._current
+            return {**self._stats,
+                    'current': None if current is None else {
+                        'seq': current.seq, 'age': round(current.age, 1), 'users': len(current),
+                        'consumers': list(current.consumers)}}
@@ -1,18 +1,20 @@
 import logging
-import threading
 import time
-from datetime import datetime
-import schedule
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, time as dtime
 import pytz
 from telebot import apihelper, TeleBot
 from config import (DAILY_REPORT_TIME, TEHRAN_TZ, ADMIN_IDS,BIRTHDAY_GIFT_GB, BIRTHDAY_GIFT_DAYS,
-                     WARNING_USAGE_THRESHOLD,WARNING_DAYS_BEFORE_EXPIRY,
-                     USAGE_WARNING_CHECK_HOURS, ONLINE_REPORT_UPDATE_HOURS, EMOJIS,
-                     DAILY_USAGE_ALERT_THRESHOLD_GB)
+                     USAGE_WARNING_CHECK_HOURS, ONLINE_REPORT_UPDATE_HOURS, NIGHTLY_REPORT_WORKERS, NIGHTLY_REPORT_CHUNK_SIZE,
+                     OUTBOUND_RESULT_TIMEOUT, DAILY_USAGE_ALERT_THRESHOLD_GB)
 from database import db
 import combined_handler
-from utils import escape_markdown, format_daily_usage
+from utils import escape_markdown
 from menu import menu
+from outbound import outbound, PRIORITY_WARNING, PRIORITY_REPORT
+from panel_snapshot import PanelSnapshotProvider
+from job_scheduler import job_scheduler, Interval, HourlyAt, DailyAt
+from warning_engine import evaluate_warnings
 from admin_formatters import fmt_admin_report, fmt_online_users_list
 from user_formatters import fmt_user_report
 import jdatetime
@@ -26,20 +28,22 @@ class SchedulerManager:
         self.running = False
         self.tz = pytz.timezone(TEHRAN_TZ) if isinstance(TEHRAN_TZ, str) else TEHRAN_TZ
         self.tz_str = str(self.tz)
+        self.snapshots = PanelSnapshotProvider()
 
     def _hourly_snapshots(self) -> None:
         logger.info("Scheduler: Running hourly usage snapshot job.")
         
-        all_users_info = combined_handler.get_all_users_combined()
-        if not all_users_info:
+        snapshot = self.snapshots.get('hourly_snapshots')
+        if not snapshot.users:
             return
             
-        user_info_map = {user['uuid']: user for user in all_users_info}
+        user_info_map = snapshot.by_uuid
 
         all_uuids_from_db = db.all_active_uuids()
         if not all_uuids_from_db:
             return
 
+        snapshot_rows = []
         for u_row in all_uuids_from_db:
             try:
                 uuid_str = u_row['uuid']
@@ -53,211 +57,150 @@ class SchedulerManager:
                     h_usage = h_info.get('current_usage_GB', 0.0) if h_info else 0.0
                     m_usage = m_info.get('current_usage_GB', 0.0) if m_info else 0.0
 
-                    db.add_usage_snapshot(u_row['id'], h_usage, m_usage)
+                    snapshot_rows.append((u_row['id'], h_usage, m_usage))
 
             except Exception as e:
                 logger.error(f"Scheduler: Failed to process snapshot for uuid_id {u_row['id']}: {e}")
 
+        try:
+            saved = db.add_usage_snapshots(snapshot_rows)
+            logger.info(f"Scheduler: Saved {saved} usage snapshots in one batch.")
+        except Exception as e:
+            logger.error(f"Scheduler: Failed to save usage snapshots batch: {e}")
+
     def _check_for_warnings(self) -> None:
-            logger.info("Scheduler: Running warnings check job.")
-            
-            all_uuids_from_db = db.all_active_uuids()
-            if not all_uuids_from_db:
-                logger.info("SCHEDULER: No active UUIDs in DB to check warnings for. JOB STOPPED.") # لاگ مهم
-                return
+        logger.info("Scheduler: Running warnings check job.")
 
-            all_users_info_map = {u['uuid']: u for u in combined_handler.get_all_users_combined()}
-            
-            for u_row in all_uuids_from_db:
-                uuid_str = u_row['uuid']
-                uuid_id_in_db = u_row['id']
-                user_id_in_telegram = u_row['user_id']
-                logger.info(f"SCHEDULER: Checking warnings for UUID: {uuid_str} (User ID: {user_id_in_telegram})") # لاگ برای هر کاربر
-                
-                info = all_users_info_map.get(uuid_str)
-                if not info:
-                    continue
-
-                user_settings = db.get_user_settings(user_id_in_telegram)
-                user_name = escape_markdown(info.get('name', 'کاربر ناشناس'))
-
-                # 1. Welcome Message Logic
-                if info.get('last_online') and not u_row.get('first_connection_time'):
-                    db.set_first_connection_time(uuid_id_in_db, datetime.now(pytz.utc))
-                
-                if u_row.get('first_connection_time') and not u_row.get('welcome_message_sent'):
-                    first_conn_time = u_row['first_connection_time'].replace(tzinfo=pytz.utc)
-                    if (datetime.now(pytz.utc) - first_conn_time).total_seconds() >= 48 * 3600:
-                        welcome_text = (
-                            f"🎉 *به جمع ما خوش آمدی!* 🎉\n\n"
-                            f"از اینکه به ما اعتماد کردی خوشحالیم. امیدواریم از کیفیت سرویس لذت ببری.\n\n"
-                            f"💬 در صورت داشتن هرگونه سوال یا نیاز به پشتیبانی، ما همیشه در کنار شما هستیم.\n\n"
-                            f"با آرزوی بهترین‌ها ✨"
-                        )
-                        try:
-                            self.bot.send_message(user_id_in_telegram, welcome_text, parse_mode="MarkdownV2")
-                            db.mark_welcome_message_as_sent(uuid_id_in_db)
-                            logger.info(f"Welcome message sent to user {user_id_in_telegram}")
-                        except Exception as e:
-                            logger.error(f"Failed to send welcome message to user {user_id_in_telegram}: {e}")
-
-                # 2. Expiry Warning
-                if user_settings.get('expiry_warnings'):
-                    expire_days = info.get('expire')
-                    if expire_days is not None and 0 <= expire_days <= WARNING_DAYS_BEFORE_EXPIRY:
-                        if not db.has_recent_warning(uuid_id_in_db, 'expiry'):
-                            msg = (f"{EMOJIS['warning']} *هشدار انقضای اکانت*\n\n"
-                                f"اکانت *{user_name}* شما تا *{expire_days}* روز دیگر منقضی می‌شود.")
-                            try:
-                                self.bot.send_message(user_id_in_telegram, msg, parse_mode="MarkdownV2")
-                                db.log_warning(uuid_id_in_db, 'expiry')
-                            except Exception as e:
-                                logger.error(f"Failed to send expiry warning to user {user_id_in_telegram}: {e}")
-
-                # 3. Data Usage Warning (for each panel)
-                breakdown = info.get('breakdown', {})
-                server_map = {
-                    'hiddify': {'name': 'آلمان 🇩🇪', 'setting': 'data_warning_hiddify'},
-                    'marzban': {'name': 'فرانسه 🇫🇷', 'setting': 'data_warning_marzban'}
-                }
-                list_bullet = escape_markdown("- ")
-                for code, details in server_map.items():
-                    if user_settings.get(details['setting']) and code in breakdown and breakdown[code]:
-                        server_info = breakdown[code]
-                        limit = server_info.get('usage_limit_GB', 0.0)
-                        usage = server_info.get('current_usage_GB', 0.0)
-                        if limit > 0:
-                            usage_percent = (usage / limit) * 100
-                            if usage_percent >= WARNING_USAGE_THRESHOLD:
-                                warning_type = f'low_data_{code}'
-                                if not db.has_recent_warning(uuid_id_in_db, warning_type):
-                                    remaining_gb = max(0, limit - usage)
-                                    server_name = details['name']
-                                    msg = (f"{EMOJIS['warning']} *هشدار اتمام حجم*\n\n"
-                                        f"کاربر گرامی، حجم اکانت *{user_name}* شما در سرور *{server_name}* رو به اتمام است.\n"
-                                        f"{list_bullet}حجم باقیمانده: *{remaining_gb:.2f} GB*")
-                                    try:
-                                        self.bot.send_message(user_id_in_telegram, msg, parse_mode="MarkdownV2")
-                                        db.log_warning(uuid_id_in_db, warning_type)
-                                    except Exception as e:
-                                        logger.error(f"Failed to send data warning to user {user_id_in_telegram}: {e}")
-                
-                # 4. Unusual Daily Usage Alert (for Admin)
-                if DAILY_USAGE_ALERT_THRESHOLD_GB > 0:
-                    daily_usage_dict = db.get_usage_since_midnight(uuid_id_in_db)
-                    total_daily_usage = sum(daily_usage_dict.values())
-                    if total_daily_usage >= DAILY_USAGE_ALERT_THRESHOLD_GB:
-                        warning_type = 'unusual_daily_usage'
-                        if not db.has_recent_warning(uuid_id_in_db, warning_type, hours=24):
-                            list_bullet = escape_markdown("- ")
-                            alert_msg = (f"{EMOJIS['warning']} *هشدار مصرف غیرعادی روزانه*\n\n"
-                                        f"کاربر *{user_name}* (`{escape_markdown(uuid_str)}`) از حد مجاز مصرف روزانه عبور کرده است.\n\n"
-                                        f"{list_bullet}*میزان مصرف امروز:* `{escape_markdown(format_daily_usage(total_daily_usage))}`\n"
-                                        f"{list_bullet}*حد مجاز تعریف شده:* `{DAILY_USAGE_ALERT_THRESHOLD_GB} GB`")
-                            for admin_id in ADMIN_IDS:
-                                try:
-                                    self.bot.send_message(admin_id, alert_msg, parse_mode="MarkdownV2")
-                                except Exception as e:
-                                    logger.error(f"Failed to send unusual usage alert to admin {admin_id}: {e}")
-                            db.log_warning(uuid_id_in_db, warning_type)
+        candidates = db.get_warning_candidates()
+        if not candidates:
+            logger.info("SCHEDULER: No active UUIDs in DB to check warnings for. JOB STOPPED.") # لاگ مهم
+            return
+
+        users_by_uuid = self.snapshots.get('check_for_warnings').by_uuid
+        recent_warnings = db.get_recent_warnings(hours=24)
+        daily_usage_map = db.get_usage_since_midnight_bulk([c['id'] for c in candidates]) if DAILY_USAGE_ALERT_THRESHOLD_GB > 0 else {}
+        now = datetime.now(pytz.utc)
+
+        batch = evaluate_warnings(candidates, users_by_uuid, recent_warnings, daily_usage_map, now)
+        db.set_first_connection_times(batch.first_connections, now)
+
+        futures = [(warning, outbound.send_message(warning.chat_id, warning.text, priority=PRIORITY_WARNING, parse_mode="MarkdownV2"))
+                   for warning in batch.messages]
+
+        # Warnings are only logged once delivered, so a failed send is retried on the next run
+        delivered_logs, welcomed, failed = list(batch.log_now), [], 0
+        for warning, future in futures:
+            try:
+                future.result(timeout=OUTBOUND_RESULT_TIMEOUT)
+            except Exception as e:
+                failed += 1
+                logger.error(f"Failed to send warning to {warning.chat_id}: {e}")
+                continue
+            if warning.warning_type:
+                delivered_logs.append((warning.uuid_id, warning.warning_type))
+            if warning.welcome:
+                welcomed.append(warning.uuid_id)
+
+        db.log_warnings(delivered_logs)
+        db.mark_welcome_messages_as_sent(welcomed)
+        logger.info(f"Scheduler: Warnings check evaluated {len(candidates)} accounts; "
+                    f"sent {len(futures) - failed}/{len(futures)} messages ({len(welcomed)} welcome).")
+
+    def _render_user_reports(self, recipients: list, user_info_map, daily_usage_map: dict, header: str) -> list:
+        """Renders the personal reports of a chunk of recipients; returns (user_id, text) pairs."""
+        rendered = []
+        for recipient in recipients:
+            user_infos_for_report = [{**user_info_map[account['uuid']], 'db_id': account['id']}
+                                     for account in recipient['accounts'] if account['uuid'] in user_info_map]
+            if not user_infos_for_report:
+                continue
+            try:
+                rendered.append((recipient['user_id'], header + fmt_user_report(user_infos_for_report, daily_usage_map)))
+            except Exception as e:
+                logger.error(f"SCHEDULER: Failed to render nightly report for user {recipient['user_id']}: {e}", exc_info=True)
+        return rendered
 
     def _nightly_report(self) -> None:
+            started = time.monotonic()
             tehran_tz = pytz.timezone("Asia/Tehran")
             now_gregorian = datetime.now(tehran_tz)
             now_shamsi = jdatetime.datetime.fromgregorian(datetime=now_gregorian)
             now_str = now_shamsi.strftime("%Y/%m/%d - %H:%M")
             logger.info(f"SCHEDULER: ----- Running nightly report at {now_str} -----")
 
-            all_users_info_from_api = combined_handler.get_all_users_combined()
+            snapshot = self.snapshots.get('nightly_report')
+            all_users_info_from_api = list(snapshot.users)
             if not all_users_info_from_api:
                 logger.warning("SCHEDULER: Could not fetch any user info from API. JOB STOPPED.")
                 return
-                
+
             logger.info(f"SCHEDULER: Fetched {len(all_users_info_from_api)} total users from API.")
 
-            user_info_map = {user['uuid']: user for user in all_users_info_from_api}
-            all_bot_users = db.get_all_user_ids()
+            # --- Shared data, loaded once for every report ---
+            user_info_map = snapshot.by_uuid
+            recipients = [r for r in db.get_report_recipients() if r['daily_reports']]
+            daily_usage_map = db.get_usage_since_midnight_bulk([a['id'] for r in recipients for a in r['accounts']])
             separator = '\n' + '─' * 18 + '\n'
+            pending_sends = []  # (future, description)
 
-            for user_id in all_bot_users:
-                logger.info(f"SCHEDULER: ----- Processing user_id: {user_id} -----")
-                
+            # --- Admin Report: identical for every admin, so it is rendered once ---
+            admin_recipients = [r['user_id'] for r in recipients if r['user_id'] in ADMIN_IDS]
+            if admin_recipients:
                 try:
-                    user_settings = db.get_user_settings(user_id)
-                    if not user_settings.get('daily_reports', True):
-                        logger.info(f"SCHEDULER: User {user_id} has disabled daily reports. Skipping.")
-                        continue
-                    
-                    # --- Admin Report ---
-                    if user_id in ADMIN_IDS:
-                        logger.info(f"SCHEDULER: User {user_id} is an ADMIN. Generating admin report.")
-                        header = f"👑 *گزارش جامع* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
-                        report_text = fmt_admin_report(all_users_info_from_api, db)
-                        try:
-                            self.bot.send_message(user_id, header + report_text, parse_mode="MarkdownV2")
-                            logger.info(f"SCHEDULER: Admin report sent to {user_id}.")
-                        except Exception as e:
-                            logger.error(f"SCHEDULER: Failed to send ADMIN report to {user_id}: {e}", exc_info=True)
-
-                    # --- User Report (for ALL users, including admins) ---
-                    logger.info(f"SCHEDULER: Now checking for personal user report for user_id: {user_id}.")
-                    user_uuids_from_db = db.uuids(user_id)
-                    user_infos_for_report = []
-                    
-                    if not user_uuids_from_db:
-                        logger.warning(f"SCHEDULER: User {user_id} has no UUIDs registered in the bot's DB. Skipping user report.")
-                    else:
-                        logger.info(f"SCHEDULER: User {user_id} has {len(user_uuids_from_db)} UUID(s) in DB. Matching with API data...")
-                        for u_row in user_uuids_from_db:
-                            if u_row['uuid'] in user_info_map:
-                                user_data = user_info_map[u_row['uuid']]
-                                user_data['db_id'] = u_row['id'] 
-                                user_infos_for_report.append(user_data)
-                        
-                        if user_infos_for_report:
-                            logger.info(f"SCHEDULER: Found {len(user_infos_for_report)} active account(s) for user {user_id}. Generating report.")
-                            header = f"🌙 *گزارش روزانه* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
-                            report_text = fmt_user_report(user_infos_for_report)
-                            try:
-                                self.bot.send_message(user_id, header + report_text, parse_mode="MarkdownV2")
-                                logger.info(f"SCHEDULER: Personal user report sent to {user_id}.")
-                            except Exception as e:
-                                logger.error(f"SCHEDULER: Failed to send USER report to {user_id}: {e}", exc_info=True)
-                        else:
-                            logger.warning(f"SCHEDULER: No active accounts found in API for user {user_id} after matching. No user report will be sent.")
-
-                    # --- Cleanup Snapshots ---
-                    if user_uuids_from_db:
-                        for info in user_uuids_from_db:
-                            db.delete_daily_snapshots(info['id'])
-                        logger.info(f"Scheduler: Cleaned up daily snapshots for user {user_id}.")
-                            
+                    admin_text = f"👑 *گزارش جامع* {escape_markdown('-')} {escape_markdown(now_str)}{separator}" + fmt_admin_report(all_users_info_from_api, db)
+                    for admin_id in admin_recipients:
+                        pending_sends.append((outbound.send_message(admin_id, admin_text, priority=PRIORITY_REPORT, parse_mode="MarkdownV2"),
+                                              f"ADMIN report to {admin_id}"))
                 except Exception as e:
-                    logger.error(f"SCHEDULER: CRITICAL FAILURE while processing main loop for user {user_id}: {e}", exc_info=True)
-                    continue # Go to the next user
+                    logger.error(f"SCHEDULER: Failed to render admin nightly report: {e}", exc_info=True)
+
+            # --- User Reports (for ALL users, including admins): rendered in chunks on a pool and queued as each chunk is ready ---
+            header = f"🌙 *گزارش روزانه* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
+            chunks = [recipients[i:i + NIGHTLY_REPORT_CHUNK_SIZE] for i in range(0, len(recipients), NIGHTLY_REPORT_CHUNK_SIZE)]
+            rendered_count = 0
+            with ThreadPoolExecutor(max_workers=NIGHTLY_REPORT_WORKERS, thread_name_prefix="nightly-report") as pool:
+                render_futures = [pool.submit(self._render_user_reports, chunk, user_info_map, daily_usage_map, header) for chunk in chunks]
+                for render_future in as_completed(render_futures):
+                    for user_id, text in render_future.result():
+                        rendered_count += 1
+                        pending_sends.append((outbound.send_message(user_id, text, priority=PRIORITY_REPORT, parse_mode="MarkdownV2"),
+                                              f"USER report to {user_id}"))
+            render_time = time.monotonic() - started
+
+            sent = 0
+            for future, description in pending_sends:
+                try:
+                    future.result(timeout=OUTBOUND_RESULT_TIMEOUT)
+                    sent += 1
+                except Exception as e:
+                    logger.error(f"SCHEDULER: Failed to send {description}: {e}")
+            logger.info(f"SCHEDULER: Nightly report finished in {time.monotonic() - started:.1f}s "
+                        f"(rendering {render_time:.1f}s): {len(recipients)} recipients, {len(admin_recipients)} admin reports, "
+                        f"{rendered_count} user reports, {sent}/{len(pending_sends)} messages delivered.")
 
     def _update_online_reports(self) -> None:
         logger.info("Scheduler: Running 3-hourly online user report update.")
         
         messages_to_update = db.get_scheduled_messages('online_users_report')
+        if not messages_to_update:
+            return
+        daily_usage_map = db.get_usage_since_midnight_all_by_uuid()
+
+        # The list is the same for every subscribed chat, so it is built once per run
+        now_utc = datetime.now(pytz.utc)
+        online_list = [{**u, 'daily_usage_GB': sum(daily_usage_map.get(u['uuid'], {}).values())} if u.get('uuid') else dict(u)
+                       for u in self.snapshots.get('update_online_reports').users
+                       if u.get('last_online') and (now_utc - u['last_online']).total_seconds() < 180]
+        text = fmt_online_users_list(online_list, 0)
+        # Note: The back button here is a placeholder as this is an automated update.
+        kb = menu.create_pagination_menu("admin:list:online_users:both", 0, len(online_list), "admin:reports_menu")
         
         for msg_info in messages_to_update:
+            chat_id = msg_info['chat_id']
             try:
-                chat_id = msg_info['chat_id']
                 message_id = msg_info['message_id']
-                
-                online_list = [u for u in combined_handler.get_all_users_combined() if u.get('last_online') and (datetime.now(pytz.utc) - u['last_online']).total_seconds() < 180]
-
-                for user in online_list:
-                    if user.get('uuid'):
-                        user['daily_usage_GB'] = sum(db.get_usage_since_midnight_by_uuid(user['uuid']).values())
-                
-                text = fmt_online_users_list(online_list, 0)
-                # Note: The back button here is a placeholder as this is an automated update.
-                kb = menu.create_pagination_menu("admin:list:online_users:both", 0, len(online_list), "admin:reports_menu") 
-                
-                self.bot.edit_message_text(text, chat_id, message_id, reply_markup=kb, parse_mode="MarkdownV2")
-                time.sleep(0.5)
+                outbound.edit_message_text(text, chat_id, message_id, priority=PRIORITY_REPORT,
+                                           reply_markup=kb, parse_mode="MarkdownV2").result(timeout=OUTBOUND_RESULT_TIMEOUT)
             except apihelper.ApiTelegramException as e:
                 if 'message to edit not found' in str(e) or 'message is not modified' in str(e):
                     db.delete_scheduled_message(msg_info['id'])
@@ -294,11 +237,19 @@ class SchedulerManager:
                         f"🎁 `{BIRTHDAY_GIFT_GB} GB` حجم و `{BIRTHDAY_GIFT_DAYS}` روز به تمام اکانت‌های شما **به صورت خودکار اضافه شد!**\n\n"
                         f"می‌توانی با مراجعه به بخش مدیریت اکانت، جزئیات جدید را مشاهده کنی."
                     )
-                    self.bot.send_message(user_id, gift_message, parse_mode="MarkdownV2")
+                    outbound.send_message(user_id, gift_message, priority=PRIORITY_WARNING, parse_mode="MarkdownV2").result(timeout=OUTBOUND_RESULT_TIMEOUT)
                     logger.info(f"Scheduler: Sent birthday gift to user {user_id}.")
                 except Exception as e:
                     logger.error(f"Scheduler: Failed to send birthday message to user {user_id}: {e}")
 
+    def _rollup_usage_snapshots(self) -> None:
+        """Compacts old raw usage snapshots into hourly/daily rollups (replaces the old nightly delete)."""
+        logger.info("Scheduler: Running usage snapshot rollup job.")
+        try:
+            db.rollup_usage_snapshots()
+        except Exception as e:
+            logger.error(f"Scheduler: Usage snapshot rollup failed: {e}", exc_info=True)
+
     def _run_monthly_vacuum(self) -> None:
         today = datetime.now(self.tz)
         if today.day == 1:
@@ -313,26 +264,19 @@ class SchedulerManager:
         if self.running: return
         
         report_time_str = DAILY_REPORT_TIME.strftime("%H:%M")
-        schedule.every().hour.at(":01").do(self._hourly_snapshots)
-        schedule.every(USAGE_WARNING_CHECK_HOURS).hours.do(self._check_for_warnings)
-        schedule.every().day.at(report_time_str, self.tz_str).do(self._nightly_report)
-        schedule.every(ONLINE_REPORT_UPDATE_HOURS).hours.do(self._update_online_reports)
-        schedule.every().day.at("00:05", self.tz_str).do(self._birthday_gifts_job)
-        schedule.every().day.at("04:00", self.tz_str).do(self._run_monthly_vacuum)
+        job_scheduler.add_job("hourly_snapshots", self._hourly_snapshots, HourlyAt(1, self.tz), catch_up_window=timedelta(minutes=50))
+        job_scheduler.add_job("rollup_usage_snapshots", self._rollup_usage_snapshots, HourlyAt(10, self.tz), catch_up_window=timedelta(hours=24))
+        job_scheduler.add_job("check_for_warnings", self._check_for_warnings, Interval(USAGE_WARNING_CHECK_HOURS * 3600), catch_up_window=timedelta(hours=USAGE_WARNING_CHECK_HOURS))
+        job_scheduler.add_job("nightly_report", self._nightly_report, DailyAt(DAILY_REPORT_TIME, self.tz), catch_up_window=timedelta(hours=1))
+        job_scheduler.add_job("update_online_reports", self._update_online_reports, Interval(ONLINE_REPORT_UPDATE_HOURS * 3600), catch_up_window=timedelta(hours=ONLINE_REPORT_UPDATE_HOURS))
+        job_scheduler.add_job("birthday_gifts", self._birthday_gifts_job, DailyAt(dtime(0, 5), self.tz), catch_up_window=timedelta(hours=20))
+        job_scheduler.add_job("monthly_vacuum", self._run_monthly_vacuum, DailyAt(dtime(4, 0), self.tz))
         
         self.running = True
-        threading.Thread(target=self._runner, daemon=True).start()
+        job_scheduler.start()
         logger.info(f"Scheduler started. Nightly report at {report_time_str} ({self.tz_str}). Online user reports will update every {ONLINE_REPORT_UPDATE_HOURS} hours. Birthday gift job scheduled for 00:05 ({self.tz_str})")
 
     def shutdown(self) -> None:
         logger.info("Scheduler: Shutting down...")
-        schedule.clear()
+        job_scheduler.shutdown()
         self.running = False
-
-    def _runner(self) -> None:
-        while self.running:
-            try:
-                schedule.run_pending()
-            except Exception as exc:
-                logger.error(f"Scheduler loop error: {exc}")
-            time.sleep(60)
\ No newline at end of file
@@ -0,0 +1,171 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, List
+
+from telebot import TeleBot, types
+
+from config import HANDLER_WORKERS, HANDLER_MAX_PENDING
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_handler_seconds = registry.histogram('update_handler_duration_seconds', 'Time spent handling one update.')
+_wait_seconds = registry.histogram('update_queue_wait_seconds', 'Time an update waited in the dispatcher before a worker ran it.')
+
+# Update fields that carry the user who caused the update, in the order they are checked
+_UPDATE_FIELDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                  'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+                  'chat_join_request')
+
+
+class KeyedDispatcher:
+    """
+    Runs tasks on a fixed worker pool. Tasks with the same key run one at a time and in the order
+    they were submitted; different keys run in parallel.
+
+    - a key's queue is served one task per pool slot, so a busy user cannot hold a worker for long
+    - submit() blocks once `max_pending` tasks are waiting, which pushes back on the update source
+    """
+
+    def __init__(self, workers: int = HANDLER_WORKERS, max_pending: int = HANDLER_MAX_PENDING) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self._queues: Dict[Hashable, Deque[tuple]] = {}
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._running = 0
+        self._stopped = False
+        self._stats = {'submitted': 0, 'processed': 0, 'errors': 0, 'throttled': 0, 'dropped': 0}
+        self._wait_total = self._handle_total = self._handle_max = 0.0
+        self._last_throttle_log = float('-inf')
+
+    def submit(self, key: Hashable, func: Callable[..., Any], *args: Any) -> None:
+        with self._cond:
+            if self._pending >= self.max_pending and not self._stopped:
+                self._stats['throttled'] += 1
+                if time.monotonic() - self._last_throttle_log >= 60:
+                    self._last_throttle_log = time.monotonic()
+                    logger.warning(f"Dispatcher: {self._pending} updates pending; waiting for handlers to catch up")
+                while self._pending >= self.max_pending and not self._stopped:
+                    self._cond.wait()
+            if self._stopped:
+                self._stats['dropped'] += 1
+                logger.warning(f"Dispatcher: stopped; dropping an update for {key}")
+                return
+            self._pending += 1
+            self._stats['submitted'] += 1
+            item = (time.monotonic(), func, args)
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append(item)
+                return
+            self._queues[key] = deque([item])
+            # Under the lock: shutdown() sets _stopped under it before stopping the pool
+            self._executor.submit(self._run_next, key)
+
+    def _run_next(self, key: Hashable) -> None:
+        with self._cond:
+            enqueued, func, args = self._queues[key][0]
+            self._running += 1
+        started = time.monotonic()
+        error = False
+        try:
+            func(*args)
+        except Exception as e:
+            error = True
+            logger.error(f"Dispatcher: handler for {key} failed: {e}", exc_info=True)
+        finished = time.monotonic()
+        _handler_seconds.observe(finished - started)
+        _wait_seconds.observe(started - enqueued)
+
+        with self._cond:
+            queue = self._queues[key]
+            queue.popleft()
+            if queue and self._stopped:
+                # The pool no longer takes work; what is left for this user is dropped
+                logger.warning(f"Dispatcher: stopped; dropping {len(queue)} queued update(s) for {key}")
+                self._stats['dropped'] += len(queue)
+                self._pending -= len(queue)
+                queue.clear()
+            if queue:
+                # Back of the pool's queue, so other users get a turn in between
+                self._executor.submit(self._run_next, key)
+            else:
+                del self._queues[key]
+            self._pending -= 1
+            self._running -= 1
+            self._stats['errors' if error else 'processed'] += 1
+            self._wait_total += started - enqueued
+            self._handle_total += finished - started
+            self._handle_max = max(self._handle_max, finished - started)
+            self._cond.notify_all()
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """Waits up to `timeout` seconds for queued updates, then stops the pool."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending and time.monotonic() < deadline:
+                self._cond.wait(max(0.0, deadline - time.monotonic()))
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False)
+        logger.info(f"Dispatcher stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            handled = self._stats['processed'] + self._stats['errors']
+            return {**self._stats,
+                    'queue_depth': self._pending - self._running,
+                    'running': self._running,
+                    'active_users': len(self._queues),
+                    'workers': self.workers,
+                    'avg_wait': round(self._wait_total / handled, 4) if handled else None,
+                    'avg_latency': round(self._handle_total / handled, 4) if handled else None,
+                    'max_latency': round(self._handle_max, 4)}
+
+
+def update_key(update: types.Update) -> Hashable:
+    """The user an update belongs to (falls back to the chat, then to the update itself)."""
+    for field in _UPDATE_FIELDS:
+        event = getattr(update, field, None)
+        if event is None:
+            continue
+        user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(event, 'chat', None)
+        if chat is not None:
+            return chat.id
+    return ('update', update.update_id)
+
+
+class DispatchingTeleBot(TeleBot):
+    """
+    TeleBot that hands every update to a KeyedDispatcher instead of telebot's own thread pool,
+    so updates of one user (and their register_next_step_handler flows) never run concurrently.
+    """
+
+    def __init__(self, token: str, dispatcher: KeyedDispatcher, **kwargs: Any) -> None:
+        super().__init__(token, threaded=False, **kwargs)
+        self.dispatcher = dispatcher
+
+    def process_new_updates(self, updates: List[types.Update]) -> None:
+        for update in updates:
+            # Advanced here rather than in the worker, so polling never fetches a dispatched update again
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(update_key(update), super().process_new_updates, [update])
+
+
+update_dispatcher = KeyedDispatcher()
+
+registry.callback('update_dispatcher_updates', 'Update dispatcher state (queue_depth, running, active_users).',
+                  lambda: {(key,): value for key, value in update_dispatcher.stats().items()
+                           if key in ('queue_depth', 'running', 'active_users')}, ('state',))
+registry.callback('update_dispatcher_updates_total', 'Updates handled by the dispatcher (processed, errors, throttled, dropped).',
+                  lambda: {(key,): value for key, value in update_dispatcher.stats().items()
+                           if key in ('processed', 'errors', 'throttled', 'dropped')}, ('result',), kind='counter')
@@ -0,0 +1,129 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+NGRAM_SIZE = 3
+UUID_CHARS = frozenset('0123456789abcdef-')
+
+RANK_EXACT, RANK_PREFIX, RANK_SUBSTRING = 0, 1, 2
+
+
+def _ngrams(text: str, size: int = NGRAM_SIZE) -> Set[str]:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class UserDirectory:
+    """
+    Read-only search index over a combined user list (see combined_handler.get_all_users_combined).
+
+    - exact maps: UUID -> user and Marzban username -> user
+    - sorted name/UUID lists for prefix lookups (bisect)
+    - name bigram/trigram index for substring lookups
+    Results are ranked exact > prefix > substring, then by name.
+    """
+
+    def __init__(self, users: Iterable[Dict[str, Any]]) -> None:
+        self.users: List[Dict[str, Any]] = list(users)
+        self._by_uuid: Dict[str, int] = {}
+        self._by_username: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._ngram_index: Dict[str, Set[int]] = {}
+
+        sorted_names, sorted_uuids = [], []
+        for idx, user in enumerate(self.users):
+            name = (user.get('name') or '').lower()
+            uuid = (user.get('uuid') or '').lower()
+            self._names.append(name)
+            if uuid:
+                self._by_uuid[uuid] = idx
+                sorted_uuids.append((uuid, idx))
+            marzban_name = (user.get('breakdown', {}).get('marzban') or {}).get('name')
+            if marzban_name:
+                self._by_username[marzban_name.lower()] = idx
+            sorted_names.append((name, idx))
+            for gram in _ngrams(name) | _ngrams(name, NGRAM_SIZE - 1):
+                self._ngram_index.setdefault(gram, set()).add(idx)
+
+        sorted_names.sort()
+        sorted_uuids.sort()
+        self._sorted_names = [name for name, _ in sorted_names]
+        self._sorted_name_ids = [idx for _, idx in sorted_names]
+        self._sorted_uuids = [uuid for uuid, _ in sorted_uuids]
+        self._sorted_uuid_ids = [idx for _, idx in sorted_uuids]
+        # All UUIDs in one string, so UUID substring search runs as a C-level str.find
+        self._uuid_blob = '\n'.join(self._sorted_uuids)
+        self._uuid_offsets = []
+        offset = 0
+        for uuid in self._sorted_uuids:
+            self._uuid_offsets.append(offset)
+            offset += len(uuid) + 1
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def get(self, identifier: str) -> Optional[Dict[str, Any]]:
+        """Exact lookup by UUID or Marzban username."""
+        key = identifier.lower()
+        idx = self._by_uuid.get(key)
+        if idx is None:
+            idx = self._by_username.get(key)
+        return self.users[idx] if idx is not None else None
+
+    @staticmethod
+    def _prefix_range(sorted_keys: List[str], sorted_ids: List[int], prefix: str) -> List[int]:
+        lo = bisect_left(sorted_keys, prefix)
+        hi = bisect_right(sorted_keys, prefix + '\U0010ffff')
+        return sorted_ids[lo:hi]
+
+    def _name_substring_ids(self, query: str) -> Iterable[int]:
+        if len(query) == 1:
+            return (idx for idx, name in enumerate(self._names) if query in name)
+        if len(query) < NGRAM_SIZE:
+            return self._ngram_index.get(query, ())
+        candidates = None
+        for gram in sorted(_ngrams(query), key=lambda g: len(self._ngram_index.get(g, ()))):
+            posting = self._ngram_index.get(gram)
+            if not posting:
+                return ()
+            candidates = set(posting) if candidates is None else candidates & posting
+            if not candidates:
+                return ()
+        return (idx for idx in candidates if query in self._names[idx])
+
+    def _uuid_substring_ids(self, query: str) -> Iterable[int]:
+        if not UUID_CHARS.issuperset(query):
+            return
+        start = self._uuid_blob.find(query)
+        while start != -1:
+            pos = bisect_right(self._uuid_offsets, start) - 1
+            yield self._sorted_uuid_ids[pos]
+            # Continue after the UUID that just matched
+            start = self._uuid_blob.find(query, self._uuid_offsets[pos] + len(self._sorted_uuids[pos]) + 1)
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        ranks: Dict[int, int] = {}
+
+        def add(ids: Iterable[int], rank: int) -> None:
+            for idx in ids:
+                if rank < ranks.get(idx, RANK_SUBSTRING + 1):
+                    ranks[idx] = rank
+
+        exact = [idx for idx in (self._by_uuid.get(query), self._by_username.get(query)) if idx is not None]
+        add(exact, RANK_EXACT)
+        add(self._prefix_range(self._sorted_names, self._sorted_name_ids, query), RANK_PREFIX)
+        add(self._prefix_range(self._sorted_uuids, self._sorted_uuid_ids, query), RANK_PREFIX)
+        add(self._name_substring_ids(query), RANK_SUBSTRING)
+        add(self._uuid_substring_ids(query), RANK_SUBSTRING)
+
+        # Exact name matches rank with exact UUID/username matches
+        for idx, rank in list(ranks.items()):
+            if rank == RANK_PREFIX and self._names[idx] == query:
+                ranks[idx] = RANK_EXACT
+
+        ordered = sorted(ranks, key=lambda idx: (ranks[idx], self._names[idx]))
+        if limit is not None:
+            ordered = ordered[:limit]
+        return [self.users[idx] for idx in ordered]
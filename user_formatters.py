@@ -3,6 +3,7 @@ from config import EMOJIS, PAGE_SIZE
 from database import db
 import combined_handler
 from datetime import datetime
+from typing import Optional
 from utils import (
     create_progress_bar,
     format_daily_usage, escape_markdown,
@@ -164,7 +165,8 @@ def quick_stats(uuid_rows: list, page: int = 0) -> tuple[str, dict]:
 
     return "\n".join(report), menu_data
 
-def fmt_user_report(user_infos: list) -> str:
+def fmt_user_report(user_infos: list, daily_usage_map: Optional[dict] = None) -> str:
+    """`daily_usage_map` (db_id -> usage per panel) avoids one DB query per account when reports are rendered in bulk."""
     logger.info(f"USER_FORMATTER: fmt_user_report called to format a report for {len(user_infos)} account(s).")
     if not user_infos:
         logger.warning("USER_FORMATTER: No active accounts found for user to generate a report.")
@@ -177,7 +179,10 @@ def fmt_user_report(user_infos: list) -> str:
         name = escape_markdown(info.get("name", "کاربر ناشناس"))
         account_lines = [f"👤 *اکانت : {name}*"]
         
-        daily_usage_dict = db.get_usage_since_midnight(info['db_id'])
+        if daily_usage_map is not None:
+            daily_usage_dict = daily_usage_map.get(info['db_id'], {})
+        else:
+            daily_usage_dict = db.get_usage_since_midnight(info['db_id'])
         total_daily_usage_all_accounts += sum(daily_usage_dict.values())
         
         h_info = info.get('breakdown', {}).get('hiddify', {})
@@ -0,0 +1,130 @@
+import logging
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import pytz
+
+from config import NORMALIZE_CACHE_SIZE
+from metrics import registry
+from user_records import PanelUser
+from utils import safe_float
+
+logger = logging.getLogger(__name__)
+
+TEHRAN_TZ = pytz.timezone("Asia/Tehran")
+_GB = 1024 ** 3
+_SECONDS_PER_DAY = 86400
+
+_normalize_seconds = registry.histogram('panel_normalize_duration_seconds', 'Time spent normalizing one batch of panel users.',
+                                        ('panel',), buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+_normalized_total = registry.counter('panel_normalized_users_total', 'Panel users normalized.', ('panel',))
+
+
+# Parsed values are memoized per raw string: between two fetches most users' timestamps are unchanged
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def parse_hiddify_datetime(date_str: Optional[str]) -> Optional[datetime]:
+    """Hiddify sends naive Tehran times (or an explicit offset); the zero date means 'never'."""
+    if not date_str or date_str.startswith('0001-01-01'):
+        return None
+    try:
+        if 'Z' in date_str or '+' in date_str[10:] or '-' in date_str[10:]:
+            return datetime.fromisoformat(date_str.replace('Z', '+00:00').split('.')[0])
+        return TEHRAN_TZ.localize(datetime.fromisoformat(date_str.split('.')[0]))
+    except (ValueError, TypeError):
+        logger.warning(f"Could not parse Hiddify datetime string: {date_str}")
+        return None
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def parse_marzban_datetime(date_str: Optional[str]) -> Optional[datetime]:
+    """Marzban sends UTC times, usually without an offset."""
+    if not date_str:
+        return None
+    try:
+        dt_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00').split('.')[0])
+        return pytz.utc.localize(dt_obj) if dt_obj.tzinfo is None else dt_obj
+    except (ValueError, TypeError):
+        logger.warning(f"Could not parse Marzban datetime string: {date_str}")
+        return None
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def hiddify_expiration_date(start_date_str: Optional[str], package_days: int) -> Optional[date]:
+    """start_date + package_days, or None when the start date is missing or invalid."""
+    try:
+        return datetime.fromisoformat(start_date_str.split('T')[0]).date() + timedelta(days=package_days)
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class UserNormalizer:
+    """
+    Turns raw panel users into PanelUser records for one batch (a listing or a lookup).
+    "Now" is taken once per batch instead of once per user; timestamp parsing is memoized
+    across batches. Call report() after the batch to log and record the time spent.
+    """
+
+    def __init__(self, panel: str, now: Optional[datetime] = None) -> None:
+        self.panel = panel
+        self.now = now or datetime.now(pytz.utc)
+        self.now_ts = self.now.timestamp()
+        self.today_tehran = self.now.astimezone(TEHRAN_TZ).date()
+        self.count = 0
+        self.seconds = 0.0
+
+    def _remaining_days(self, start_date_str: Optional[str], package_days: Optional[int]) -> Optional[int]:
+        if package_days in [None, 0]: return None
+        expiration_date = hiddify_expiration_date(start_date_str, package_days)
+        # Without a valid start date the package counts from today
+        return (expiration_date - self.today_tehran).days if expiration_date else package_days
+
+    def hiddify(self, raw: Dict[str, Any]) -> Optional[PanelUser]:
+        if not isinstance(raw, dict): return None
+        started = time.perf_counter()
+        usage_limit = safe_float(raw.get("usage_limit_GB", 0))
+        current_usage = safe_float(raw.get("current_usage_GB", 0))
+        # Slots are assigned directly; PanelUser(**fields) would go through __setitem__ per field
+        user = PanelUser()
+        user.name = raw.get("name") or "کاربر ناشناس"
+        user.uuid = raw.get("uuid", "").lower()
+        user.is_active = bool(raw.get("enable", False))
+        user.last_online = parse_hiddify_datetime(raw.get("last_online"))
+        user.usage_limit_GB = usage_limit
+        user.current_usage_GB = current_usage
+        user.remaining_GB = max(0, usage_limit - current_usage)
+        user.usage_percentage = (current_usage / usage_limit * 100) if usage_limit > 0 else 0
+        user.expire = self._remaining_days(raw.get("start_date"), raw.get("package_days"))
+        user.mode = raw.get("mode", "no_reset")
+        self.count += 1
+        self.seconds += time.perf_counter() - started
+        return user
+
+    def marzban(self, username: str, raw: Dict[str, Any], uuid: Optional[str]) -> PanelUser:
+        started = time.perf_counter()
+        usage_gb = (raw.get('used_traffic') or 0) / _GB
+        data_limit = raw.get('data_limit')
+        limit_gb = data_limit / _GB if data_limit is not None else 0
+        expire_timestamp = raw.get('expire')
+        # Same as (fromtimestamp(expire) - now).days, without building datetimes
+        expire_days = int((expire_timestamp - self.now_ts) // _SECONDS_PER_DAY) if expire_timestamp and expire_timestamp > 0 else None
+        user = PanelUser()
+        user.name, user.uuid, user.is_active = username, uuid, raw.get('status') == 'active'
+        user.last_online = parse_marzban_datetime(raw.get('online_at'))
+        user.usage_limit_GB, user.current_usage_GB = limit_gb, usage_gb
+        user.remaining_GB = max(0, limit_gb - usage_gb)
+        user.usage_percentage = (usage_gb / limit_gb * 100) if limit_gb > 0 else 0
+        user.expire = expire_days
+        user.data_limit, user.expire_timestamp = data_limit, expire_timestamp
+        self.count += 1
+        self.seconds += time.perf_counter() - started
+        return user
+
+    def report(self) -> None:
+        """Records the batch; listings (more than a handful of users) are also logged."""
+        _normalize_seconds.observe(self.seconds, panel=self.panel)
+        _normalized_total.inc(self.count, panel=self.panel)
+        if self.count > 10:
+            logger.info(f"{self.panel}: normalized {self.count} users in {self.seconds * 1000:.1f} ms")
@@ -0,0 +1,163 @@
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, Optional
+
+# Every field either panel's normalizer sets; Hiddify users have `mode`, Marzban users
+# `data_limit` / `expire_timestamp`, and a field that was never set is simply not a key.
+PANEL_USER_FIELDS = (
+    'name', 'uuid', 'is_active', 'last_online',
+    'usage_limit_GB', 'current_usage_GB', 'remaining_GB', 'usage_percentage',
+    'expire', 'mode', 'data_limit', 'expire_timestamp',
+)
+_FIELD_SET = frozenset(PANEL_USER_FIELDS)
+
+
+class PanelUser(MutableMapping):
+    """
+    One normalized panel user. Reads and writes like the dict it replaces (`user['name']`,
+    `.get`, `in`, `{**user}`, `dict(user)`), but the known fields live in __slots__;
+    keys that callers attach later (e.g. `daily_usage`) go to a small overflow dict.
+    """
+    __slots__ = PANEL_USER_FIELDS + ('_extra',)
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, **fields: Any) -> None:
+        self._extra: Optional[Dict[str, Any]] = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        return self._extra.get(key, default) if self._extra is not None else default
+
+    def __contains__(self, key: object) -> bool:
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in PANEL_USER_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for key in PANEL_USER_FIELDS if hasattr(self, key)) + len(self._extra or ())
+
+    def copy(self) -> "PanelUser":
+        return PanelUser(self)
+
+    def __repr__(self) -> str:
+        return f"PanelUser({dict(self)!r})"
+
+
+_DELETED = object()
+
+
+class UserRecord(MutableMapping):
+    """
+    One combined (Hiddify + Marzban) user. Top-level fields are read from `primary` (the
+    Hiddify record when the user has one) unless the record overrides them (merged totals);
+    `breakdown` holds the per-panel records by reference instead of copies. Writes go to the
+    record's own overrides, so the shared panel records are never changed through it.
+    """
+    __slots__ = ('primary', 'breakdown', '_overrides')
+
+    def __init__(self, primary: Mapping, breakdown: Mapping, overrides: Optional[Dict[str, Any]] = None) -> None:
+        self.primary = primary
+        self.breakdown = breakdown
+        self._overrides = overrides
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'breakdown':
+            return self.breakdown
+        if self._overrides is not None and key in self._overrides:
+            value = self._overrides[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        return self.primary[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == 'breakdown':
+            return self.breakdown
+        if self._overrides is not None and key in self._overrides:
+            value = self._overrides[key]
+            return default if value is _DELETED else value
+        return self.primary.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        if key == 'breakdown':
+            return True
+        if self._overrides is not None and key in self._overrides:
+            return self._overrides[key] is not _DELETED
+        return key in self.primary
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == 'breakdown':
+            self.breakdown = value
+            return
+        if self._overrides is None:
+            self._overrides = {}
+        self._overrides[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key == 'breakdown' or key not in self:
+            raise KeyError(key)
+        self[key] = _DELETED
+
+    def __iter__(self) -> Iterator[str]:
+        overrides = self._overrides or {}
+        for key in self.primary:
+            if overrides.get(key) is not _DELETED:
+                yield key
+        yield 'breakdown'
+        for key, value in overrides.items():
+            if value is not _DELETED and key not in self.primary:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def copy(self) -> "UserRecord":
+        """Shallow copy; the breakdown mapping is new, the panel records in it are shared."""
+        return UserRecord(self.primary, dict(self.breakdown), dict(self._overrides) if self._overrides else None)
+
+    def with_breakdown(self, breakdown: Mapping) -> "UserRecord":
+        """The same user with another breakdown mapping (e.g. a read-only one)."""
+        return UserRecord(self.primary, breakdown, dict(self._overrides) if self._overrides else None)
+
+    def __repr__(self) -> str:
+        return f"UserRecord({dict(self)!r})"
@@ -0,0 +1,105 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from config import (ADMIN_IDS, EMOJIS, WARNING_USAGE_THRESHOLD, WARNING_DAYS_BEFORE_EXPIRY,
+                    DAILY_USAGE_ALERT_THRESHOLD_GB)
+from utils import escape_markdown, format_daily_usage
+
+WELCOME_DELAY_SECONDS = 48 * 3600
+
+SERVER_MAP = {
+    'hiddify': {'name': 'آلمان 🇩🇪', 'setting': 'data_warning_hiddify'},
+    'marzban': {'name': 'فرانسه 🇫🇷', 'setting': 'data_warning_marzban'}
+}
+
+
+@dataclass
+class OutgoingWarning:
+    chat_id: int
+    text: str
+    uuid_id: int
+    warning_type: Optional[str] = None   # logged in warning_log once delivered
+    welcome: bool = False                # marks welcome_message_sent once delivered
+
+
+@dataclass
+class WarningBatch:
+    messages: List[OutgoingWarning] = field(default_factory=list)
+    log_now: List[Tuple[int, str]] = field(default_factory=list)     # logged regardless of delivery
+    first_connections: List[int] = field(default_factory=list)       # uuid_ids seen online for the first time
+
+
+def _welcome_text() -> str:
+    return (
+        f"🎉 *به جمع ما خوش آمدی!* 🎉\n\n"
+        f"از اینکه به ما اعتماد کردی خوشحالیم. امیدواریم از کیفیت سرویس لذت ببری.\n\n"
+        f"💬 در صورت داشتن هرگونه سوال یا نیاز به پشتیبانی، ما همیشه در کنار شما هستیم.\n\n"
+        f"با آرزوی بهترین‌ها ✨"
+    )
+
+
+def evaluate_warnings(candidates: List[Dict[str, Any]], users_by_uuid: Mapping[str, Mapping[str, Any]],
+                      recent_warnings: Set[Tuple[int, str]], daily_usage_map: Dict[int, Dict[str, float]],
+                      now: datetime) -> WarningBatch:
+    """
+    Applies every warning rule in memory.
+
+    `candidates` come from db.get_warning_candidates(), `recent_warnings` from db.get_recent_warnings()
+    and `daily_usage_map` from db.get_usage_since_midnight_bulk(); nothing here touches the DB or Telegram.
+    """
+    batch = WarningBatch()
+    list_bullet = escape_markdown("- ")
+
+    for account in candidates:
+        info = users_by_uuid.get(account['uuid'])
+        if not info:
+            continue
+        uuid_id, chat_id = account['id'], account['user_id']
+        user_name = escape_markdown(info.get('name', 'کاربر ناشناس'))
+
+        # 1. Welcome message, 48h after the first connection
+        first_connection = account.get('first_connection_time')
+        if info.get('last_online') and not first_connection:
+            batch.first_connections.append(uuid_id)
+        if first_connection and not account.get('welcome_message_sent'):
+            if (now - first_connection).total_seconds() >= WELCOME_DELAY_SECONDS:
+                batch.messages.append(OutgoingWarning(chat_id, _welcome_text(), uuid_id, welcome=True))
+
+        # 2. Expiry warning
+        if account.get('expiry_warnings'):
+            expire_days = info.get('expire')
+            if expire_days is not None and 0 <= expire_days <= WARNING_DAYS_BEFORE_EXPIRY and (uuid_id, 'expiry') not in recent_warnings:
+                msg = (f"{EMOJIS['warning']} *هشدار انقضای اکانت*\n\n"
+                       f"اکانت *{user_name}* شما تا *{expire_days}* روز دیگر منقضی می‌شود.")
+                batch.messages.append(OutgoingWarning(chat_id, msg, uuid_id, warning_type='expiry'))
+
+        # 3. Data usage warning (for each panel)
+        breakdown = info.get('breakdown', {})
+        for code, details in SERVER_MAP.items():
+            server_info = breakdown.get(code)
+            if not account.get(details['setting']) or not server_info:
+                continue
+            limit = server_info.get('usage_limit_GB', 0.0)
+            usage = server_info.get('current_usage_GB', 0.0)
+            warning_type = f'low_data_{code}'
+            if limit > 0 and (usage / limit) * 100 >= WARNING_USAGE_THRESHOLD and (uuid_id, warning_type) not in recent_warnings:
+                remaining_gb = max(0, limit - usage)
+                msg = (f"{EMOJIS['warning']} *هشدار اتمام حجم*\n\n"
+                       f"کاربر گرامی، حجم اکانت *{user_name}* شما در سرور *{details['name']}* رو به اتمام است.\n"
+                       f"{list_bullet}حجم باقیمانده: *{remaining_gb:.2f} GB*")
+                batch.messages.append(OutgoingWarning(chat_id, msg, uuid_id, warning_type=warning_type))
+
+        # 4. Unusual daily usage alert (for admins)
+        if DAILY_USAGE_ALERT_THRESHOLD_GB > 0:
+            total_daily_usage = sum(daily_usage_map.get(uuid_id, {}).values())
+            warning_type = 'unusual_daily_usage'
+            if total_daily_usage >= DAILY_USAGE_ALERT_THRESHOLD_GB and (uuid_id, warning_type) not in recent_warnings:
+                alert_msg = (f"{EMOJIS['warning']} *هشدار مصرف غیرعادی روزانه*\n\n"
+                             f"کاربر *{user_name}* (`{escape_markdown(account['uuid'])}`) از حد مجاز مصرف روزانه عبور کرده است.\n\n"
+                             f"{list_bullet}*میزان مصرف امروز:* `{escape_markdown(format_daily_usage(total_daily_usage))}`\n"
+                             f"{list_bullet}*حد مجاز تعریف شده:* `{DAILY_USAGE_ALERT_THRESHOLD_GB} GB`")
+                batch.messages.extend(OutgoingWarning(admin_id, alert_msg, uuid_id) for admin_id in ADMIN_IDS)
+                batch.log_now.append((uuid_id, warning_type))
+
+    return batch
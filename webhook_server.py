@@ -0,0 +1,145 @@
+import logging
+import queue
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from flask import Flask, Response, jsonify, request
+from telebot import TeleBot, types
+from werkzeug.serving import make_server
+
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT, WEBHOOK_SECRET,
+                    WEBHOOK_QUEUE_SIZE, WEBHOOK_MAX_CONNECTIONS)
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WebhookServer:
+    """
+    Receives Telegram updates over a webhook and feeds them to the bot's handlers.
+
+    - the HTTP handler only validates the secret token and enqueues the update, so Telegram gets
+      its answer immediately
+    - a bounded queue provides back-pressure: when it is full the update is answered with 503
+      and Telegram delivers it again later
+    - a single feeder thread passes the updates, in arrival order, to bot.process_new_updates (the
+      update dispatcher, which runs the handlers in parallel while keeping each user's updates in
+      order); when the dispatcher is saturated the feeder blocks, the queue fills up and Telegram
+      is asked to retry
+    """
+
+    def __init__(self, queue_size: int = WEBHOOK_QUEUE_SIZE) -> None:
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        self.app = self._create_app()
+        self._bot: Optional[TeleBot] = None
+        self._server = None
+        self._feeder: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'received': 0, 'processed': 0, 'rejected': 0, 'invalid': 0, 'unauthorized': 0, 'errors': 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _create_app(self) -> Flask:
+        app = Flask(__name__)
+
+        @app.post(WEBHOOK_PATH)
+        def receive_update():
+            if not secrets.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.secret):
+                self._count('unauthorized')
+                return Response(status=403)
+            try:
+                update = types.Update.de_json(request.get_data(as_text=True))
+            except Exception as e:
+                logger.warning(f"Webhook: could not decode update: {e}")
+                self._count('invalid')
+                return Response(status=400)
+            try:
+                self.queue.put_nowait((time.monotonic(), update))
+            except queue.Full:
+                self._count('rejected')
+                return Response(status=503)
+            self._count('received')
+            return Response(status=200)
+
+        @app.get('/healthz')
+        def health():
+            return jsonify(self.stats())
+
+        return app
+
+    def _count(self, key: str, latency: Optional[float] = None) -> None:
+        with self._lock:
+            self._stats[key] += 1
+            if latency is not None:
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+
+    def _feed(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            enqueued, update = item
+            try:
+                self._bot.process_new_updates([update])
+                self._count('processed', time.monotonic() - enqueued)
+            except Exception as e:
+                logger.error(f"Webhook: update {update.update_id} failed: {e}", exc_info=True)
+                self._count('errors', time.monotonic() - enqueued)
+
+    def serve(self, bot: TeleBot) -> None:
+        """Registers the webhook with Telegram and blocks until stop() is called."""
+        if not WEBHOOK_URL:
+            raise ValueError("BOT_MODE is 'webhook' but WEBHOOK_URL is not set")
+        self._bot = bot
+        self._stopped.clear()
+        # One feeder: several threads could hand one user's updates to the dispatcher out of order
+        self._feeder = threading.Thread(target=self._feed, name="webhook-feeder", daemon=True)
+        self._feeder.start()
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  # one access log line per update is too noisy
+        self._server = make_server(WEBHOOK_LISTEN_HOST, WEBHOOK_LISTEN_PORT, self.app, threaded=True)
+        threading.Thread(target=self._server.serve_forever, name="webhook-http", daemon=True).start()
+        bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, max_connections=WEBHOOK_MAX_CONNECTIONS,
+                        secret_token=self.secret, drop_pending_updates=True)
+        logger.info(f"Webhook: listening on {WEBHOOK_LISTEN_HOST}:{WEBHOOK_LISTEN_PORT}{WEBHOOK_PATH} "
+                    f"(queue size {self.queue.maxsize})")
+
+        while not self._stopped.is_set():
+            self._stopped.wait(1)
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stops accepting updates, then lets the feeder hand over what is already queued."""
+        self._stopped.set()
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+        if self._feeder:
+            self.queue.put(_STOP)
+            self._feeder.join(timeout)
+            self._feeder = None
+        logger.info(f"Webhook stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            handled = self._stats['processed'] + self._stats['errors']
+            return {**self._stats,
+                    'queue_depth': self.queue.qsize(),
+                    'queue_size': self.queue.maxsize,
+                    'avg_latency': round(self._latency_total / handled, 4) if handled else None,
+                    'max_latency': round(self._latency_max, 4)}
+
+
+webhook_server = WebhookServer()
+
+registry.callback('webhook_updates_total', 'Webhook requests by result (received, processed, rejected, invalid, unauthorized, errors).',
+                  lambda: {(key,): value for key, value in webhook_server.stats().items()
+                           if key in ('received', 'processed', 'rejected', 'invalid', 'unauthorized', 'errors')},
+                  ('result',), kind='counter')
+registry.callback('webhook_queue_depth', 'Updates waiting in the webhook queue.', lambda: webhook_server.stats()['queue_depth'])